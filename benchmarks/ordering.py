@@ -0,0 +1,193 @@
+"""
+Benchmark the orderings of file operations (see the `io` configuration section) on a
+corpus of audio files, by reading the rating of every file in each order.
+
+The reads only hit the disks with a cold page cache, so the cache is dropped before each
+pass with `--drop-caches` (Linux only, requires root). The baseline is the artist/album
+order in which a run processes the tracks of a Plex library, fetched from the
+configured Plex server with `--library`, or taken from `--order-file` (one path per
+line).
+
+    python benchmarks/ordering.py /mnt/music --library Music --limit 20000 --drop-caches
+"""
+
+import os
+import random
+import statistics
+from pathlib import Path
+from time import perf_counter
+
+import click
+
+from plex_music_ratings_sync.config import init_config
+from plex_music_ratings_sync.logger import capture_logs, init_logging
+from plex_music_ratings_sync.ordering import order_by_locality, readahead_headers
+from plex_music_ratings_sync.ratings import get_rating_from_file
+from plex_music_ratings_sync.sync import (
+    _SUPPORTED_EXTENSIONS,
+    RatingSync,
+    _get_track_path,
+)
+
+_DROP_CACHES_PATH = "/proc/sys/vm/drop_caches"
+"""Linux control file dropping the page cache, dentries and inodes when written."""
+
+
+def _find_files(root, limit):
+    """Find the supported audio files below `root`, up to `limit` of them."""
+    file_paths = []
+
+    # Absolute, as the paths of the tracks in Plex
+    for directory, _, file_names in os.walk(os.path.abspath(root)):
+        for file_name in sorted(file_names):
+            if Path(file_name).suffix.lower() in _SUPPORTED_EXTENSIONS:
+                file_paths.append(Path(directory, file_name))
+
+    file_paths.sort()
+
+    return file_paths[:limit] if limit else file_paths
+
+
+def _read_order_file(order_file, corpus):
+    """Read the baseline order from a file, keeping the files of the corpus only."""
+    corpus = set(corpus)
+
+    with open(order_file, "r", encoding="utf-8") as paths:
+        file_paths = [Path(line.strip()) for line in paths if line.strip()]
+
+    return [file_path for file_path in file_paths if file_path in corpus]
+
+
+def _read_plex_order(library_name, corpus):
+    """
+    Fetch the paths of the tracks of a Plex library in the order a run processes them,
+    from the configured Plex server, keeping the files of the corpus only.
+    """
+    init_config()
+
+    rating_sync = RatingSync()
+    library = rating_sync.plex.library.section(library_name)
+
+    file_paths = [
+        _get_track_path(track)
+        for album_tracks in rating_sync._iter_album_tracks(library)
+        for track in album_tracks
+    ]
+
+    corpus = set(corpus)
+
+    # Tracks sharing a file are read once, where the file first appears
+    return [
+        file_path
+        for file_path in dict.fromkeys(file_paths)
+        if file_path in corpus
+    ]
+
+
+def _drop_caches():
+    """Flush the dirty pages and drop the page cache, so that reads hit the disks."""
+    os.sync()
+
+    with open(_DROP_CACHES_PATH, "w") as drop_caches:
+        drop_caches.write("3\n")
+
+
+def _run_pass(file_paths, readahead, drop_caches):
+    """Read the rating of every file in the given order. Returns the elapsed time."""
+    if drop_caches:
+        _drop_caches()
+
+    started_at = perf_counter()
+
+    readahead_headers(file_paths, readahead)
+
+    # Read failures are part of the workload, but their messages are not
+    with capture_logs():
+        for file_path in file_paths:
+            get_rating_from_file(str(file_path))
+
+    return perf_counter() - started_at
+
+
+@click.command()
+@click.argument("root", type=click.Path(exists=True, file_okay=False))
+@click.option("--limit", type=int, default=0, help="Maximum number of files to read")
+@click.option(
+    "--library",
+    help="Plex library whose processing order is the baseline, from the configuration",
+)
+@click.option(
+    "--order-file",
+    type=click.Path(exists=True, dir_okay=False),
+    help="File listing the paths in the order returned by Plex, one per line",
+)
+@click.option(
+    "--readahead",
+    type=int,
+    default=65536,
+    show_default=True,
+    help="Number of bytes to prefetch in the passes with readahead",
+)
+@click.option(
+    "--repeat", type=int, default=3, show_default=True, help="Passes per order"
+)
+@click.option(
+    "--drop-caches",
+    is_flag=True,
+    help="Drop the page cache before each pass (Linux only, requires root)",
+)
+def benchmark(root, limit, library, order_file, readahead, repeat, drop_caches):
+    """Benchmark the orderings of file operations on the audio files below ROOT."""
+    # Files sorted by path are already in directory order, so can't be the baseline
+    if (library is None) == (order_file is None):
+        raise click.UsageError("Exactly one of --library and --order-file is required")
+
+    init_logging(quiet=True)
+
+    corpus = _find_files(root, limit)
+
+    if not corpus:
+        raise click.ClickException(f"No supported audio files found in: {root}")
+
+    if library is not None:
+        baseline = _read_plex_order(library, corpus)
+    else:
+        baseline = _read_order_file(order_file, corpus)
+
+    if not baseline:
+        raise click.ClickException("None of the files of the baseline order were found")
+    shuffled = random.Random(0).sample(baseline, len(baseline))
+
+    inode_order = order_by_locality(baseline, Path, by_inode=True)
+
+    orders = [
+        ("plex", baseline, 0),
+        ("shuffled", shuffled, 0),
+        ("directory", order_by_locality(baseline, Path), 0),
+        ("inode", inode_order, 0),
+        ("inode+readahead", inode_order, readahead),
+    ]
+
+    if not drop_caches:
+        click.echo("Warning: the page cache is kept, the reads may not hit the disks")
+
+    click.echo(f"Reading the ratings of {len(baseline)} files ({repeat} passes each)")
+
+    baseline_time = None
+
+    for name, file_paths, order_readahead in orders:
+        elapsed_time = statistics.median(
+            _run_pass(file_paths, order_readahead, drop_caches) for _ in range(repeat)
+        )
+
+        if baseline_time is None:
+            baseline_time = elapsed_time
+
+        click.echo(
+            f"{name:<16} {elapsed_time:8.2f}s {len(file_paths) / elapsed_time:9.1f} "
+            f"files/s {baseline_time / elapsed_time:6.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,224 @@
+import hmac
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+
+from plex_music_ratings_sync.logger import (
+    capture_logs,
+    log_debug,
+    log_info,
+    log_warning,
+)
+from plex_music_ratings_sync.ordering import order_by_locality
+from plex_music_ratings_sync.registry import stat_file
+
+AGENT_PORT = 32499
+"""Default port the file agent listens on."""
+
+_TOKEN_HEADER = "X-PMRS-Agent-Token"
+"""HTTP header holding the token shared between the agent and its clients."""
+
+_ENDPOINTS = ("/stat", "/read", "/write")
+"""Endpoints of the file agent."""
+
+
+def _is_within_roots(path, roots):
+    """
+    Return whether a path lies below one of the root directories once resolved, so
+    that neither `..` components nor symbolic links can escape them.
+    """
+    resolved_path = Path(path).resolve()
+
+    return any(resolved_path == root or root in resolved_path.parents for root in roots)
+
+
+def _stat_files(paths):
+    """Check the existence of files and build their keys (see `get_file_key`)."""
+    files = {}
+
+    for path in paths:
+        exists, file_key = stat_file(path)
+        files[path] = {"exists": exists, "key": list(file_key)}
+
+    return files
+
+
+def _read_files(storage, paths):
+    """
+    Read the ratings of files from the storage, in disk order, along with the log
+    messages of each read so that the client can emit them as if the files were read
+    locally.
+    """
+    files = {}
+
+    for path in order_by_locality(paths, Path):
+        with capture_logs() as records:
+            rating = storage.get_rating(path)
+
+        files[path] = {"rating": rating, "logs": records}
+
+    return files
+
+
+def _write_files(storage, ratings):
+    """
+    Write the ratings of files to the storage, along with the log messages of each
+    write.
+    """
+    files = {}
+
+    for path, rating in ratings.items():
+        with capture_logs() as records:
+            written = storage.set_rating(path, rating)
+
+        files[path] = {"written": written, "logs": records}
+
+    return files
+
+
+class _AgentRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handle the batched requests of the file agent. Each request is a `POST` with a JSON
+    body, authenticated with the token shared with the clients:
+    - `/stat`: Check the existence of the given `paths` and return their keys
+    - `/read`: Read the ratings of the given `paths`
+    - `/write`: Write the given `ratings`, keyed by path
+
+    Requests for any path outside the root directories of the agent are rejected.
+    """
+
+    token = None
+    storage = None
+    roots = ()
+
+    def _send_json(self, status, payload):
+        """Send a JSON response."""
+        body = json.dumps(payload).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        """Authenticate and dispatch a batched request."""
+        token = self.headers.get(_TOKEN_HEADER, "")
+
+        if not hmac.compare_digest(token.encode("utf-8"), self.token.encode("utf-8")):
+            log_warning(
+                f"Rejected request with an invalid token: {self.client_address[0]}"
+            )
+            return self._send_json(401, {"error": "invalid token"})
+
+        if self.path not in _ENDPOINTS:
+            return self._send_json(404, {"error": "unknown endpoint"})
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length))
+
+            paths = payload["ratings"] if self.path == "/write" else payload["paths"]
+            outside_paths = [
+                path for path in paths if not _is_within_roots(path, self.roots)
+            ]
+
+            if outside_paths:
+                error = f"path outside the root directories: {outside_paths[0]}"
+                log_warning(f"Rejected request for a {error}")
+
+                return self._send_json(403, {"error": error})
+
+            if self.path == "/stat":
+                files = _stat_files(paths)
+            elif self.path == "/read":
+                files = _read_files(self.storage, paths)
+            else:
+                files = _write_files(self.storage, paths)
+        except (KeyError, TypeError, ValueError) as e:
+            return self._send_json(400, {"error": f"invalid request: {e}"})
+
+        log_debug(f"Served {self.path} for **{len(files)}** files", 1)
+
+        self._send_json(200, {"files": files})
+
+    def log_message(self, format, *args):
+        """Silence the default request logging, which goes to stderr."""
+
+
+def create_agent_server(host, port, token, storage, roots):
+    """
+    Create the HTTP server of the file agent, storing the ratings in `storage` and
+    only accessing the files below the `roots` directories.
+    """
+    handler = type(
+        "AgentRequestHandler",
+        (_AgentRequestHandler,),
+        {
+            "token": token,
+            "storage": storage,
+            "roots": tuple(Path(root).resolve() for root in roots),
+        },
+    )
+
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def serve_agent(host, port, token, storage, roots):
+    """Serve the file agent until interrupted (see `create_agent_server`)."""
+    with create_agent_server(host, port, token, storage, roots) as server:
+        log_info(f"File agent listening on **{host}:{port}**")
+
+        for root in server.RequestHandlerClass.roots:
+            log_info(f"Serving files below: __{root}__", 1)
+
+        server.serve_forever()
+
+
+class AgentClient:
+    """
+    Client of a file agent running on the storage host, performing the file side of
+    the synchronization there instead of over a network file system.
+    """
+
+    def __init__(self, url, token, timeout):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+        self._session = requests.Session()
+        self._session.headers[_TOKEN_HEADER] = token
+
+    def _post(self, endpoint, payload):
+        """Send a batched request to the agent and return the result of each file."""
+        response = self._session.post(
+            f"{self.url}{endpoint}", json=payload, timeout=self.timeout
+        )
+        response.raise_for_status()
+
+        return response.json()["files"]
+
+    def stat(self, paths):
+        """Return whether each file exists, and its key (see `get_file_key`)."""
+        return {
+            path: (file["exists"], tuple(file["key"]))
+            for path, file in self._post("/stat", {"paths": paths}).items()
+        }
+
+    def read_ratings(self, paths):
+        """Return the rating of each file, and the log messages of the read."""
+        return {
+            path: (file["rating"], file["logs"])
+            for path, file in self._post("/read", {"paths": paths}).items()
+        }
+
+    def write_ratings(self, ratings):
+        """
+        Write the rating of each file, keyed by path. Returns whether each file was
+        written, and the log messages of the write.
+        """
+        return {
+            path: (file["written"], file["logs"])
+            for path, file in self._post("/write", {"ratings": ratings}).items()
+        }
@@ -1,13 +1,34 @@
+import json
 import sys
 
 import click
 import plexapi
 
 from plex_music_ratings_sync import APP_DESCRIPTION, APP_NAME, __version__
-from plex_music_ratings_sync.config import init_config
-from plex_music_ratings_sync.lock import acquire_process_lock
-from plex_music_ratings_sync.logger import init_logging, log_info, log_warning
-from plex_music_ratings_sync.state import set_dry_run
+from plex_music_ratings_sync.agent import AGENT_PORT, serve_agent
+from plex_music_ratings_sync.config import get_storage_config, init_config
+from plex_music_ratings_sync.daemon import DAEMON_STATUS_PORT, RatingDaemon
+from plex_music_ratings_sync.logger import (
+    init_logging,
+    log_info,
+    log_warning,
+    open_log_file,
+)
+from plex_music_ratings_sync.profiler import profile_run
+from plex_music_ratings_sync.ratings import create_rating_storage
+from plex_music_ratings_sync.registry import FileRatingCache, UnreadableFiles
+from plex_music_ratings_sync.scope import (
+    Scope,
+    parse_duration,
+    parse_shard,
+    parse_since,
+)
+from plex_music_ratings_sync.state import set_dry_run, set_gentle, set_lock_timeout
+from plex_music_ratings_sync.summary import (
+    merge_run_summaries,
+    read_run_summary,
+    write_run_summary,
+)
 from plex_music_ratings_sync.sync import RatingSync
 from plex_music_ratings_sync.util.paths import (
     get_config_dir,
@@ -30,6 +51,75 @@ def _validate_verbosity_flags(ctx, param, value):
     return value
 
 
+def _parse_since_option(ctx, param, value):
+    """Parse a point in time given as a date or as a time relative to now."""
+    if value is None:
+        return None
+
+    try:
+        return parse_since(value)
+    except ValueError:
+        raise click.BadParameter(
+            "expected a date (YYYY-MM-DD) or a relative time (e.g., 12h, 30d, 2w)"
+        )
+
+
+def _parse_duration_option(ctx, param, value):
+    """Parse a duration given as an amount and a unit."""
+    try:
+        return parse_duration(value)
+    except ValueError:
+        raise click.BadParameter("expected a duration (e.g., 30m, 6h, 1d)")
+
+
+def _parse_shard_option(ctx, param, value):
+    """Parse a shard given as its index and the number of shards."""
+    if value is None:
+        return None
+
+    try:
+        return parse_shard(value)
+    except ValueError:
+        raise click.BadParameter("expected a shard index and count (e.g., 1/4)")
+
+
+def _scope_options(command):
+    """Add the options restricting a run to part of the configured libraries."""
+    options = [
+        click.option(
+            "--library",
+            "libraries",
+            multiple=True,
+            help="Only process the given library (can be repeated)",
+        ),
+        click.option("--artist", help="Only process tracks from the given artist"),
+        click.option("--album", help="Only process tracks from the given album"),
+        click.option(
+            "--path-prefix", help="Only process tracks stored under the given folder"
+        ),
+        click.option(
+            "--added-since",
+            callback=_parse_since_option,
+            help="Only process tracks added since a date or relative time (e.g., 30d)",
+        ),
+        click.option(
+            "--updated-since",
+            callback=_parse_since_option,
+            help="Only process tracks updated since a date or relative time (e.g., 7d)",
+        ),
+        click.option(
+            "--shard",
+            callback=_parse_shard_option,
+            help="Only process the i-th of N disjoint slices of the tracks (e.g., 1/4)",
+        ),
+    ]
+
+    for option in reversed(options):
+        command = option(command)
+
+    return command
+
+
 @click.group(invoke_without_command=True, help=APP_DESCRIPTION)
 @click.option("--version", is_flag=True, help="Show program version and exit")
 @click.option("--help", is_flag=True, help="Show this help message and exit")
@@ -67,7 +157,7 @@ def show_info():
     click.echo(f"Config Directory: {_colorize_path(get_config_dir())}")
     click.echo(f"Config File: {_colorize_path(get_config_file_path())}")
     click.echo(f"Log Directory: {_colorize_path(get_log_dir())}")
-    click.echo(f"Log File: {_colorize_path(get_log_file_path())}")
+    click.echo(f"Log Files: {_colorize_path(get_log_file_path('*'))}")
 
 
 @cli.command("sync")
@@ -83,10 +173,42 @@ def show_info():
 @click.option(
     "--verbose",
     is_flag=True,
-    help="Show detailed debug information",
+    help="Show detailed debug information for every track",
     callback=_validate_verbosity_flags,
 )
-def sync_ratings(dry_run, quiet, verbose):
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Write CPU and memory profiling data to the log directory",
+)
+@click.option(
+    "--lock-timeout",
+    type=click.FloatRange(min=0),
+    default=0,
+    show_default=True,
+    help="Seconds to wait for libraries locked by another instance",
+)
+@click.option(
+    "--summary-file",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write the summary of the run to a JSON file",
+)
+@click.option(
+    "--gentle",
+    is_flag=True,
+    help="Cap resource usage as configured in the gentle section",
+)
+@_scope_options
+def sync_ratings(
+    dry_run,
+    quiet,
+    verbose,
+    profile,
+    lock_timeout,
+    summary_file,
+    gentle,
+    **scope_options,
+):
     """
     Synchronize ratings between Plex and supported audio files.
 
@@ -94,19 +216,23 @@ def sync_ratings(dry_run, quiet, verbose):
     ratings, Plex's rating takes precedence and overwrites the file. When a rating
     exists in only one place, it will be copied to the other location.
     """
-    acquire_process_lock()
-
     init_logging(quiet=quiet, verbose=verbose)
     log_info(f"{APP_NAME} v{__version__}")
 
     set_dry_run(dry_run)
+    set_lock_timeout(lock_timeout)
+    set_gentle(gentle)
 
     try:
-        RatingSync().sync_ratings()
+        with profile_run(profile):
+            run_summary = RatingSync(Scope(**scope_options)).sync_ratings()
     except KeyboardInterrupt:
         log_warning("Synchronization operation interrupted by user")
         sys.exit(1)
 
+    if summary_file:
+        write_run_summary(summary_file, run_summary)
+
 
 @cli.command("import")
 @click.option(
@@ -121,10 +247,42 @@ def sync_ratings(dry_run, quiet, verbose):
 @click.option(
     "--verbose",
     is_flag=True,
-    help="Show detailed debug information",
+    help="Show detailed debug information for every track",
     callback=_validate_verbosity_flags,
 )
-def import_ratings(dry_run, quiet, verbose):
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Write CPU and memory profiling data to the log directory",
+)
+@click.option(
+    "--lock-timeout",
+    type=click.FloatRange(min=0),
+    default=0,
+    show_default=True,
+    help="Seconds to wait for libraries locked by another instance",
+)
+@click.option(
+    "--summary-file",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write the summary of the run to a JSON file",
+)
+@click.option(
+    "--gentle",
+    is_flag=True,
+    help="Cap resource usage as configured in the gentle section",
+)
+@_scope_options
+def import_ratings(
+    dry_run,
+    quiet,
+    verbose,
+    profile,
+    lock_timeout,
+    summary_file,
+    gentle,
+    **scope_options,
+):
     """
     Import ratings from audio files into Plex.
 
@@ -132,19 +290,23 @@ def import_ratings(dry_run, quiet, verbose):
     and updates the corresponding tracks in Plex. Useful for initial setup
     or recovering Plex ratings from files.
     """
-    acquire_process_lock()
-
     init_logging(quiet=quiet, verbose=verbose)
     log_info(f"{APP_NAME} v{__version__}")
 
     set_dry_run(dry_run)
+    set_lock_timeout(lock_timeout)
+    set_gentle(gentle)
 
     try:
-        RatingSync().import_ratings()
+        with profile_run(profile):
+            run_summary = RatingSync(Scope(**scope_options)).import_ratings()
     except KeyboardInterrupt:
         log_warning("Import operation interrupted by user")
         sys.exit(1)
 
+    if summary_file:
+        write_run_summary(summary_file, run_summary)
+
 
 @cli.command("export")
 @click.option(
@@ -159,10 +321,42 @@ def import_ratings(dry_run, quiet, verbose):
 @click.option(
     "--verbose",
     is_flag=True,
-    help="Show detailed debug information",
+    help="Show detailed debug information for every track",
     callback=_validate_verbosity_flags,
 )
-def export_ratings(dry_run, quiet, verbose):
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Write CPU and memory profiling data to the log directory",
+)
+@click.option(
+    "--lock-timeout",
+    type=click.FloatRange(min=0),
+    default=0,
+    show_default=True,
+    help="Seconds to wait for libraries locked by another instance",
+)
+@click.option(
+    "--summary-file",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write the summary of the run to a JSON file",
+)
+@click.option(
+    "--gentle",
+    is_flag=True,
+    help="Cap resource usage as configured in the gentle section",
+)
+@_scope_options
+def export_ratings(
+    dry_run,
+    quiet,
+    verbose,
+    profile,
+    lock_timeout,
+    summary_file,
+    gentle,
+    **scope_options,
+):
     """
     Export ratings from Plex to audio files.
 
@@ -170,15 +364,238 @@ def export_ratings(dry_run, quiet, verbose):
     and updates the corresponding audio files' metadata. Useful for
     backing up Plex ratings or preparing files for use in other players.
     """
-    acquire_process_lock()
-
     init_logging(quiet=quiet, verbose=verbose)
     log_info(f"{APP_NAME} v{__version__}")
 
     set_dry_run(dry_run)
+    set_lock_timeout(lock_timeout)
+    set_gentle(gentle)
 
     try:
-        RatingSync().export_ratings()
+        with profile_run(profile):
+            run_summary = RatingSync(Scope(**scope_options)).export_ratings()
     except KeyboardInterrupt:
         log_warning("Export operation interrupted by user")
         sys.exit(1)
+
+    if summary_file:
+        write_run_summary(summary_file, run_summary)
+
+
+@cli.command("unreadable")
+@click.option(
+    "--clear",
+    is_flag=True,
+    help="Forget the listed files, so that the next runs read them again",
+)
+def list_unreadable(clear):
+    """
+    List the audio files whose rating couldn't be read.
+
+    Runs skip these files until they change (e.g., once repaired or replaced), instead
+    of failing to read them again every time. Use --clear to have the next runs read
+    them again anyway.
+    """
+    unreadable_files = UnreadableFiles()
+    unreadable_files.load()
+
+    entries = unreadable_files.entries()
+
+    for file_path, entry in entries:
+        click.echo(_colorize_path(file_path))
+        click.echo(f"  Since {entry['since']}: {entry['error'].replace('**', '')}")
+
+    click.echo(f"Unreadable files: {_colorize_version(str(len(entries)))}")
+
+    if clear and entries:
+        unreadable_files.clear()
+        click.echo("Cleared the unreadable files, the next runs will read them again")
+
+
+@cli.command("merge-summaries")
+@click.argument("summary_files", nargs=-1, required=True, type=click.Path(exists=True))
+def merge_summaries(summary_files):
+    """
+    Merge the summaries of runs on different shards.
+
+    Reads the JSON files written with --summary-file by the runs of each shard, and
+    prints the summary of the whole run as JSON. Exits with an error if shards are
+    missing or were merged more than once.
+    """
+    try:
+        merged_summary = merge_run_summaries(
+            [read_run_summary(summary_file) for summary_file in summary_files]
+        )
+    except (OSError, KeyError, TypeError, ValueError) as e:
+        raise click.ClickException(f"Failed to merge summaries: {e}")
+
+    click.echo(json.dumps(merged_summary, indent=2))
+
+    incomplete = False
+
+    for key, description in (
+        ("missing_shards", "Missing shards"),
+        ("duplicate_shards", "Shards merged more than once"),
+    ):
+        if merged_summary.get(key):
+            shards = ", ".join(map(str, merged_summary[key]))
+            click.echo(f"{description}: {shards}", err=True)
+            incomplete = True
+
+    if incomplete:
+        sys.exit(1)
+
+
+@cli.command("agent")
+@click.option(
+    "--root",
+    "roots",
+    multiple=True,
+    required=True,
+    type=click.Path(exists=True, file_okay=False),
+    help="Directory the files are served from, e.g., the music library (repeatable)",
+)
+@click.option(
+    "--host",
+    default="127.0.0.1",
+    show_default=True,
+    help="Address to listen on (e.g., 0.0.0.0 for all interfaces)",
+)
+@click.option(
+    "--port", type=int, default=AGENT_PORT, show_default=True, help="Port to listen on"
+)
+@click.option(
+    "--token",
+    envvar="PMRS_AGENT_TOKEN",
+    required=True,
+    help="Token shared with the clients (or set PMRS_AGENT_TOKEN)",
+)
+@click.option(
+    "--quiet",
+    is_flag=True,
+    help="Suppress all output except errors",
+    callback=_validate_verbosity_flags,
+)
+@click.option(
+    "--verbose",
+    is_flag=True,
+    help="Show detailed debug information for every request and file",
+    callback=_validate_verbosity_flags,
+)
+def run_agent(roots, host, port, token, quiet, verbose):
+    """
+    Serve the file side of the synchronization on the storage host.
+
+    Reads and writes the ratings of audio files on behalf of the sync, import and
+    export commands running on another host, configured with the `agent` section.
+    The agent must see the files at the same paths as Plex, and stores the ratings
+    according to its own `storage` section. Files outside the root directories given
+    with `--root` are never accessed.
+    """
+    init_logging(quiet=quiet, verbose=verbose)
+    open_log_file(get_log_file_path(f"agent-{port}"))
+    log_info(f"{APP_NAME} v{__version__}")
+
+    storage = create_rating_storage(get_storage_config())
+
+    try:
+        serve_agent(host, port, token, storage, roots)
+    except KeyboardInterrupt:
+        log_warning("File agent stopped by user")
+
+
+@cli.command("daemon")
+@click.option(
+    "--mode",
+    type=click.Choice(["sync", "import", "export"]),
+    default="sync",
+    show_default=True,
+    help="Operation run by every pass",
+)
+@click.option(
+    "--interval",
+    default="6h",
+    show_default=True,
+    callback=_parse_duration_option,
+    help="Time between two passes (e.g., 30m, 6h, 1d)",
+)
+@click.option(
+    "--jitter",
+    default="5m",
+    show_default=True,
+    callback=_parse_duration_option,
+    help="Maximum random deviation from the interval",
+)
+@click.option(
+    "--status-host",
+    envvar="PMRS_STATUS_HOST",
+    default="127.0.0.1",
+    show_default=True,
+    help="Address of the status endpoint (or set PMRS_STATUS_HOST)",
+)
+@click.option(
+    "--status-port",
+    type=click.IntRange(min=0),
+    default=DAEMON_STATUS_PORT,
+    show_default=True,
+    help="Port of the status endpoint (0 to disable it)",
+)
+@click.option(
+    "--dry-run", is_flag=True, help="Simulates every pass without making changes"
+)
+@click.option(
+    "--quiet",
+    is_flag=True,
+    help="Suppress all output except errors",
+    callback=_validate_verbosity_flags,
+)
+@click.option(
+    "--verbose",
+    is_flag=True,
+    help="Show detailed debug information for every track",
+    callback=_validate_verbosity_flags,
+)
+@click.option(
+    "--lock-timeout",
+    type=click.FloatRange(min=0),
+    default=0,
+    show_default=True,
+    help="Seconds to wait for libraries locked by another instance",
+)
+@click.option(
+    "--gentle",
+    is_flag=True,
+    help="Cap resource usage as configured in the gentle section",
+)
+@_scope_options
+def run_daemon(
+    mode,
+    interval,
+    jitter,
+    status_host,
+    status_port,
+    dry_run,
+    quiet,
+    verbose,
+    lock_timeout,
+    gentle,
+    **scope_options,
+):
+    """
+    Run passes of an operation on a schedule, as a resident process.
+
+    The Plex connections are kept open between passes, and the ratings of the audio
+    files are cached in memory so that later passes only read the files changed since.
+    The status of the daemon and the metrics of the last pass are served as JSON on
+    the status endpoint.
+    """
+    init_logging(quiet=quiet, verbose=verbose)
+    log_info(f"{APP_NAME} v{__version__}")
+
+    set_dry_run(dry_run)
+    set_lock_timeout(lock_timeout)
+    set_gentle(gentle)
+
+    rating_sync = RatingSync(Scope(**scope_options), file_cache=FileRatingCache())
+
+    RatingDaemon(rating_sync, mode, interval, jitter).run(status_host, status_port)
@@ -0,0 +1,189 @@
+import threading
+from contextlib import contextmanager
+from time import perf_counter, sleep
+
+_LATENCY_SMOOTHING = 0.2
+"""Weight given to the latest sample in the latency moving average."""
+
+
+class AdaptiveLimiter:
+    """
+    A concurrency limiter that adapts the number of in-flight operations using an
+    additive increase, multiplicative decrease (AIMD) strategy.
+
+    Every operation that completes under the target latency grows the limit by roughly
+    one slot per window of operations, while an operation that fails or exceeds the
+    target latency shrinks it by the backoff factor. Operations that started before the
+    last back off don't trigger another one, so a single slow period only halves the
+    limit once instead of once per operation that was in flight.
+    """
+
+    def __init__(self, name, minimum, maximum, target_latency, backoff=0.5):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.backoff = backoff
+
+        self._limit = float(minimum)
+        self._in_flight = 0
+        self._held = 0
+        self._condition = threading.Condition()
+        self._last_backoff = 0.0
+
+        self.peak_limit = minimum
+        self.operations = 0
+        self.errors = 0
+        self.average_latency = None
+
+    @property
+    def limit(self):
+        """The current number of operations allowed to run concurrently."""
+        return int(self._limit)
+
+    def _acquire(self):
+        """Wait until an operation slot is available and take it."""
+        with self._condition:
+            # Held slots only take from the slots above the minimum, which stay free
+            while self._in_flight >= max(self.minimum, int(self._limit) - self._held):
+                self._condition.wait()
+
+            self._in_flight += 1
+
+    def _release(self, started_at, latency, failed):
+        """Give back an operation slot and adjust the limit based on the outcome."""
+        with self._condition:
+            self._in_flight -= 1
+            self.operations += 1
+
+            if self.average_latency is None:
+                self.average_latency = latency
+            else:
+                self.average_latency += _LATENCY_SMOOTHING * (
+                    latency - self.average_latency
+                )
+
+            if failed:
+                self.errors += 1
+
+            if failed or latency > self.target_latency:
+                if started_at > self._last_backoff:
+                    self._limit = max(self.minimum, self._limit * self.backoff)
+                    self._last_backoff = perf_counter()
+            else:
+                self._limit = min(self.maximum, self._limit + 1 / self._limit)
+                self.peak_limit = max(self.peak_limit, int(self._limit))
+
+            self._condition.notify_all()
+
+    def hold(self):
+        """
+        Take a slot without waiting for it, for an operation abandoned by its caller
+        but still running, so that hung operations count against the limit. Returns
+        the function giving the slot back once the operation completes.
+        """
+        with self._condition:
+            self._held += 1
+
+        def release():
+            with self._condition:
+                self._held -= 1
+                self._condition.notify_all()
+
+        return release
+
+    @contextmanager
+    def slot(self):
+        """
+        Run the wrapped operation within a slot of the limiter. Exceptions raised by
+        the operation count as failures, as do calls to the yielded `fail` function.
+        """
+        outcome = {"failed": False}
+
+        def fail():
+            outcome["failed"] = True
+
+        self._acquire()
+
+        started_at = perf_counter()
+
+        try:
+            yield fail
+        except BaseException:
+            outcome["failed"] = True
+            raise
+        finally:
+            self._release(started_at, perf_counter() - started_at, outcome["failed"])
+
+    def summary(self):
+        """Return a short human readable summary of the limiter state."""
+        average_latency = (
+            f"{self.average_latency * 1000:.0f}ms"
+            if self.average_latency is not None
+            else "n/a"
+        )
+
+        return (
+            f"{self.name}: limit **{self.limit}** "
+            f"(peak **{self.peak_limit}**, range {self.minimum}-{self.maximum}), "
+            f"**{self.operations}** operations, **{self.errors}** errors, "
+            f"avg latency **{average_latency}**"
+        )
+
+
+class RateLimiter:
+    """
+    A token bucket capping the rate of operations, or of any quantity they consume
+    (e.g., bytes), to `rate` per second with bursts of up to one second worth of it.
+
+    Each caller reserves its cost and sleeps until the bucket covers it, so callers are
+    served in order. Costs only known once an operation is done (e.g., the bytes it
+    actually read) are charged afterwards, delaying the next callers instead.
+    """
+
+    def __init__(self, name, rate, unit="operations"):
+        self.name = name
+        self.rate = rate
+        self.unit = unit
+
+        self._tokens = float(rate)
+        self._updated_at = perf_counter()
+        self._lock = threading.Lock()
+
+        self.consumed = 0
+        self.waited = 0.0
+
+    def _reserve(self, cost):
+        """Take the cost out of the bucket. Returns the seconds until it's covered."""
+        with self._lock:
+            now = perf_counter()
+
+            self._tokens = min(
+                self.rate, self._tokens + (now - self._updated_at) * self.rate
+            )
+            self._updated_at = now
+            self._tokens -= cost
+            self.consumed += cost
+
+            delay = max(0.0, -self._tokens / self.rate)
+            self.waited += delay
+
+            return delay
+
+    def acquire(self, cost=1):
+        """Wait until the bucket covers the cost of an operation, and consume it."""
+        delay = self._reserve(cost)
+
+        if delay > 0:
+            sleep(delay)
+
+    def charge(self, cost):
+        """Consume the cost of a completed operation without waiting."""
+        self._reserve(cost)
+
+    def summary(self):
+        """Return a short human readable summary of the limiter state."""
+        return (
+            f"{self.name}: capped at **{self.rate:g}** {self.unit}/s, "
+            f"**{self.consumed:g}** {self.unit}, waited **{self.waited:.1f}s**"
+        )
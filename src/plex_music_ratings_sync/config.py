@@ -3,16 +3,77 @@ from shutil import copyfile
 
 import yaml
 
+from plex_music_ratings_sync.lock import LOCK_SCOPES
 from plex_music_ratings_sync.logger import log_error
+from plex_music_ratings_sync.ordering import ORDERINGS
+from plex_music_ratings_sync.ratings import RATING_STORAGES
+from plex_music_ratings_sync.resources import IO_PRIORITIES
+from plex_music_ratings_sync.scope import SHARD_KEYS
 from plex_music_ratings_sync.util.paths import (
     get_config_dir,
     get_config_file_path,
+    get_rating_database_path,
     get_template_file_path,
 )
+from plex_music_ratings_sync.watchdog import DEADLINE_KINDS
 
 _config = None
 """User configuration data."""
 
+_DEFAULT_CONCURRENCY_CONFIG = {
+    "plex": {"min": 1, "max": 4, "target_latency": 1.0},
+    "files": {"min": 1, "max": 8, "target_latency": 0.5},
+}
+"""Default adaptive concurrency limits for Plex requests and file operations."""
+
+_DEFAULT_IO_CONFIG = {
+    "ordering": "plex",
+    "batch_size": 500,
+    "readahead": 0,
+    "prefetch": 4,
+}
+"""Default ordering and prefetching options for file operations."""
+
+_DEFAULT_LOCKS_CONFIG = {"scope": "library"}
+"""Default scope of the locks preventing overlapping runs."""
+
+_DEFAULT_RETRY_CONFIG = {
+    "max_attempts": 3,
+    "initial_delay": 1.0,
+    "max_delay": 30.0,
+    "max_runs": 5,
+}
+"""Default retry policy for the write operations that failed during a run."""
+
+_DEFAULT_AGENT_CONFIG = {"timeout": 30}
+"""Default options for the connection to a file agent."""
+
+_DEFAULT_STORAGE_CONFIG = {
+    "backend": "tags",
+    "sidecar_name": ".ratings.json",
+    "database": None,
+}
+"""Default backend storing the ratings of the audio files."""
+
+_DEFAULT_SHARDING_CONFIG = {"key": "path", "affinity": {}}
+"""Default assignment of the tracks to shards."""
+
+_DEFAULT_GENTLE_CONFIG = {
+    "plex_requests_per_second": 5,
+    "file_bytes_per_second": 8 * 1024 * 1024,
+    "niceness": 10,
+    "io_priority": "idle",
+}
+"""Default resource caps of the gentle mode."""
+
+_DEFAULT_DEADLINES_CONFIG = {
+    "file_stat": 10,
+    "file_read": 30,
+    "file_write": 120,
+    "plex_request": 300,
+}
+"""Default number of seconds after which each kind of operation is abandoned."""
+
 
 def _create_config(config_file_path):
     """Create a new configuration file from the template."""
@@ -40,13 +101,288 @@ def init_config():
 
 
 def get_plex_config():
-    """Retrieve the Plex configuration."""
+    """
+    Retrieve the configuration of the Plex servers, given either as a single server or
+    as a list of servers. Returns a list of servers, each named after its URL unless
+    named explicitly.
+    """
     plex_config = _config.get("plex", {})
 
-    if not isinstance(plex_config.get("url"), str) or not isinstance(
-        plex_config.get("token"), str
+    servers_config = plex_config if isinstance(plex_config, list) else [plex_config]
+
+    for server_config in servers_config:
+        if (
+            not isinstance(server_config, dict)
+            or not isinstance(server_config.get("url"), str)
+            or not isinstance(server_config.get("token"), str)
+            or not isinstance(server_config.get("libraries"), list)
+        ):
+            log_error("The Plex configuration is not valid")
+            sys.exit(1)
+
+        server_config.setdefault("name", server_config["url"])
+
+    server_names = [server_config["name"] for server_config in servers_config]
+
+    if not servers_config or len(set(server_names)) != len(server_names):
+        log_error("The Plex configuration is not valid (server names must be unique)")
+        sys.exit(1)
+
+    return servers_config
+
+
+def get_concurrency_config():
+    """
+    Retrieve the adaptive concurrency configuration, falling back to the defaults for
+    any missing value.
+    """
+    concurrency_config = _config.get("concurrency") or {}
+
+    if not isinstance(concurrency_config, dict):
+        log_error("The concurrency configuration is not valid")
+        sys.exit(1)
+
+    merged_config = {}
+
+    for resource, defaults in _DEFAULT_CONCURRENCY_CONFIG.items():
+        resource_config = {**defaults, **(concurrency_config.get(resource) or {})}
+
+        minimum = resource_config["min"]
+        maximum = resource_config["max"]
+        target_latency = resource_config["target_latency"]
+
+        if (
+            not isinstance(minimum, int)
+            or not isinstance(maximum, int)
+            or not isinstance(target_latency, (int, float))
+            or not 1 <= minimum <= maximum
+            or target_latency <= 0
+        ):
+            log_error(f"The {resource} concurrency configuration is not valid")
+            sys.exit(1)
+
+        merged_config[resource] = resource_config
+
+    return merged_config
+
+
+def get_io_config():
+    """
+    Retrieve the file operations configuration, falling back to the defaults for any
+    missing value.
+    """
+    io_config = _config.get("io") or {}
+
+    if not isinstance(io_config, dict):
+        log_error("The I/O configuration is not valid")
+        sys.exit(1)
+
+    io_config = {**_DEFAULT_IO_CONFIG, **io_config}
+
+    if (
+        io_config["ordering"] not in ORDERINGS
+        or not isinstance(io_config["batch_size"], int)
+        or not isinstance(io_config["readahead"], int)
+        or not isinstance(io_config["prefetch"], int)
+        or io_config["batch_size"] < 1
+        or io_config["readahead"] < 0
+        or io_config["prefetch"] < 0
+    ):
+        log_error("The I/O configuration is not valid")
+        sys.exit(1)
+
+    return io_config
+
+
+def get_locks_config():
+    """
+    Retrieve the locks configuration, falling back to the defaults for any missing
+    value.
+    """
+    locks_config = _config.get("locks") or {}
+
+    if not isinstance(locks_config, dict):
+        log_error("The locks configuration is not valid")
+        sys.exit(1)
+
+    locks_config = {**_DEFAULT_LOCKS_CONFIG, **locks_config}
+
+    if locks_config["scope"] not in LOCK_SCOPES:
+        log_error("The locks configuration is not valid")
+        sys.exit(1)
+
+    return locks_config
+
+
+def get_retry_config():
+    """
+    Retrieve the retry configuration of failed write operations, falling back to the
+    defaults for any missing value.
+    """
+    retry_config = _config.get("retry") or {}
+
+    if not isinstance(retry_config, dict):
+        log_error("The retry configuration is not valid")
+        sys.exit(1)
+
+    retry_config = {**_DEFAULT_RETRY_CONFIG, **retry_config}
+
+    if (
+        not isinstance(retry_config["max_attempts"], int)
+        or not isinstance(retry_config["initial_delay"], (int, float))
+        or not isinstance(retry_config["max_delay"], (int, float))
+        or not isinstance(retry_config["max_runs"], int)
+        or retry_config["max_attempts"] < 1
+        or retry_config["initial_delay"] < 0
+        or retry_config["max_delay"] < retry_config["initial_delay"]
+        or retry_config["max_runs"] < 1
+    ):
+        log_error("The retry configuration is not valid")
+        sys.exit(1)
+
+    return retry_config
+
+
+def get_agent_config():
+    """
+    Retrieve the file agent configuration, falling back to the defaults for any
+    missing value. Returns `None` when files are accessed locally.
+    """
+    agent_config = _config.get("agent")
+
+    if agent_config is None:
+        return None
+
+    if (
+        not isinstance(agent_config, dict)
+        or not isinstance(agent_config.get("url"), str)
+        or not isinstance(agent_config.get("token"), str)
+    ):
+        log_error("The agent configuration is not valid")
+        sys.exit(1)
+
+    agent_config = {**_DEFAULT_AGENT_CONFIG, **agent_config}
+
+    if (
+        not isinstance(agent_config["timeout"], (int, float))
+        or agent_config["timeout"] <= 0
+    ):
+        log_error("The agent configuration is not valid")
+        sys.exit(1)
+
+    return agent_config
+
+
+def get_storage_config():
+    """
+    Retrieve the configuration of the backend storing the ratings of the audio files,
+    falling back to the defaults for any missing value.
+    """
+    storage_config = _config.get("storage") or {}
+
+    if not isinstance(storage_config, dict):
+        log_error("The storage configuration is not valid")
+        sys.exit(1)
+
+    storage_config = {**_DEFAULT_STORAGE_CONFIG, **storage_config}
+
+    if storage_config["database"] is None:
+        storage_config["database"] = str(get_rating_database_path())
+
+    if (
+        storage_config["backend"] not in RATING_STORAGES
+        or not isinstance(storage_config["sidecar_name"], str)
+        or not isinstance(storage_config["database"], str)
+        or not storage_config["sidecar_name"]
+        or "/" in storage_config["sidecar_name"]
+    ):
+        log_error("The storage configuration is not valid")
+        sys.exit(1)
+
+    return storage_config
+
+
+def get_sharding_config():
+    """
+    Retrieve the configuration assigning tracks to shards, falling back to the
+    defaults for any missing value.
+    """
+    sharding_config = _config.get("sharding") or {}
+
+    if not isinstance(sharding_config, dict):
+        log_error("The sharding configuration is not valid")
+        sys.exit(1)
+
+    sharding_config = {**_DEFAULT_SHARDING_CONFIG, **sharding_config}
+    affinity = sharding_config["affinity"] or {}
+
+    if (
+        sharding_config["key"] not in SHARD_KEYS
+        or not isinstance(affinity, dict)
+        or not all(
+            isinstance(prefix, str) and isinstance(index, int) and index >= 1
+            for prefix, index in affinity.items()
+        )
+    ):
+        log_error("The sharding configuration is not valid")
+        sys.exit(1)
+
+    sharding_config["affinity"] = affinity
+
+    return sharding_config
+
+
+def get_gentle_config():
+    """
+    Retrieve the resource caps of the gentle mode, falling back to the defaults for
+    any missing value. Caps set to `null` are disabled.
+    """
+    gentle_config = _config.get("gentle") or {}
+
+    if not isinstance(gentle_config, dict):
+        log_error("The gentle mode configuration is not valid")
+        sys.exit(1)
+
+    gentle_config = {**_DEFAULT_GENTLE_CONFIG, **gentle_config}
+
+    rates = (
+        gentle_config["plex_requests_per_second"],
+        gentle_config["file_bytes_per_second"],
+    )
+
+    if (
+        not all(
+            rate is None or (isinstance(rate, (int, float)) and rate > 0)
+            for rate in rates
+        )
+        or not isinstance(gentle_config["niceness"], int)
+        or not 0 <= gentle_config["niceness"] <= 19
+        or gentle_config["io_priority"] not in (None, *IO_PRIORITIES)
+    ):
+        log_error("The gentle mode configuration is not valid")
+        sys.exit(1)
+
+    return gentle_config
+
+
+def get_deadlines_config():
+    """
+    Retrieve the deadline of each kind of operation, in seconds, falling back to the
+    defaults for any missing value. Deadlines set to `null` are disabled.
+    """
+    deadlines_config = _config.get("deadlines") or {}
+
+    if not isinstance(deadlines_config, dict):
+        log_error("The deadlines configuration is not valid")
+        sys.exit(1)
+
+    deadlines_config = {**_DEFAULT_DEADLINES_CONFIG, **deadlines_config}
+
+    if set(deadlines_config) - set(DEADLINE_KINDS) or not all(
+        deadline is None or (isinstance(deadline, (int, float)) and deadline > 0)
+        for deadline in deadlines_config.values()
     ):
-        log_error("The Plex configuration is not valid")
+        log_error("The deadlines configuration is not valid")
         sys.exit(1)
 
-    return plex_config
+    return deadlines_config
@@ -0,0 +1,183 @@
+import json
+import random
+import signal
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from plex_music_ratings_sync.logger import log_error, log_info, log_warning
+from plex_music_ratings_sync.util.datetime import format_time
+
+DAEMON_STATUS_PORT = 32498
+"""Default port of the daemon status endpoint."""
+
+
+class _StatusRequestHandler(BaseHTTPRequestHandler):
+    """Serve the status of the daemon as JSON on `GET /status`."""
+
+    daemon = None
+
+    def do_GET(self):
+        """Send the status of the daemon."""
+        if self.path not in ("/", "/status"):
+            status, payload = 404, {"error": "unknown endpoint"}
+        else:
+            status, payload = 200, self.daemon.get_status()
+
+        body = json.dumps(payload).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Silence the default request logging, which goes to stderr."""
+
+
+class RatingDaemon:
+    """
+    A resident process running passes of the same mode on a schedule, with a random
+    jitter so that instances started together don't hit Plex at the same time.
+
+    The Plex connections, sessions and library sections are created once and reused by
+    every pass, along with a cache of the file ratings so that only the files changed
+    since the previous pass are read again. The Plex tracks are listed again by every
+    pass, since changing their rating doesn't change their update time in Plex, so a
+    cached track can't be known to be current without listing it again.
+    """
+
+    def __init__(self, rating_sync, mode, interval, jitter):
+        self.rating_sync = rating_sync
+        self.mode = mode
+        self.interval = interval
+        self.jitter = jitter
+
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._status = {
+            "state": "starting",
+            "mode": mode,
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "passes": 0,
+            "failed_passes": 0,
+            "last_run": None,
+            "last_error": None,
+            "next_run_at": None,
+        }
+
+    def get_status(self):
+        """Return the status of the daemon and the summary of the last pass."""
+        with self._lock:
+            status = dict(self._status)
+
+        if self.rating_sync.file_cache is not None:
+            status["cached_files"] = len(self.rating_sync.file_cache)
+
+        return status
+
+    def _update_status(self, **values):
+        """Update the status of the daemon."""
+        with self._lock:
+            self._status.update(values)
+
+    def _run_pass(self):
+        """Run a single pass, recording its summary or its failure."""
+        self._update_status(state="running", next_run_at=None)
+
+        run = getattr(self.rating_sync, f"{self.mode}_ratings")
+
+        error = None
+
+        try:
+            run_summary = run()
+        except SystemExit:
+            # The cause was already logged, the daemon tries again on the next pass
+            error = "Pass aborted, see the log for details"
+        except Exception as e:
+            error = f"Pass failed: {e}"
+
+        if error is not None:
+            log_error(error)
+
+            with self._lock:
+                self._status["passes"] += 1
+                self._status["failed_passes"] += 1
+                self._status["last_error"] = error
+
+            return
+
+        with self._lock:
+            self._status["passes"] += 1
+            self._status["last_run"] = run_summary
+
+    def _get_delay(self):
+        """Return the number of seconds until the next pass, jitter included."""
+        jitter = random.uniform(-1, 1) * self.jitter.total_seconds()
+
+        return max(0.0, self.interval.total_seconds() + jitter)
+
+    def stop(self, *args):
+        """
+        Stop the daemon, and the current pass, if any, once its current batch is
+        completed, so that it exits before the container runtime kills it.
+        """
+        log_info("Stopping daemon after the current batch")
+        self._stopped.set()
+        self.rating_sync.request_stop()
+
+    def _serve_status(self, host, port):
+        """Serve the status endpoint in a background thread."""
+        handler = type(
+            "StatusRequestHandler", (_StatusRequestHandler,), {"daemon": self}
+        )
+
+        server = ThreadingHTTPServer((host, port), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        log_info(f"Serving daemon status on **http://{host}:{port}/status**")
+
+        return server
+
+    def run(self, status_host=None, status_port=None):
+        """Run passes until stopped, serving the status endpoint if configured."""
+        signal.signal(signal.SIGTERM, self.stop)
+
+        server = None
+
+        if status_port:
+            server = self._serve_status(status_host, status_port)
+
+        log_info(
+            f"Running **{self.mode}** every **{format_time(self.interval)}** (jitter "
+            f"**{format_time(self.jitter)}**)"
+        )
+
+        try:
+            while not self._stopped.is_set():
+                self._run_pass()
+
+                if self._stopped.is_set():
+                    break
+
+                delay = self._get_delay()
+                next_run_at = datetime.now() + timedelta(seconds=delay)
+
+                self._update_status(
+                    state="idle", next_run_at=next_run_at.isoformat(timespec="seconds")
+                )
+
+                log_info(
+                    f"Next pass in **{format_time(timedelta(seconds=delay))}**, at "
+                    f"**{next_run_at:%Y-%m-%d %H:%M:%S}**"
+                )
+
+                self._stopped.wait(delay)
+        except KeyboardInterrupt:
+            log_warning("Daemon interrupted by user")
+        finally:
+            if server is not None:
+                server.shutdown()
+
+        self._update_status(state="stopped", next_run_at=None)
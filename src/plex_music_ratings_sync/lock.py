@@ -1,39 +1,265 @@
-import atexit
+import re
 import sys
-from pathlib import Path
+from hashlib import sha1
+from time import monotonic, sleep
 
 from filelock import FileLock, Timeout
-from platformdirs import user_cache_dir
 
 from plex_music_ratings_sync import APP_NAME
+from plex_music_ratings_sync.logger import log_error, log_info
+from plex_music_ratings_sync.util.paths import get_lock_dir
 
-_process_lock_file = Path(user_cache_dir(APP_NAME)) / "process.lock"
-"""Path to the single process lock file."""
+LOCK_SCOPES = ("library", "library_mode")
+"""
+Supported lock scopes:
+- `library`: Runs on the same library exclude each other, regardless of their mode
+- `library_mode`: Only runs on the same library whose modes write the same targets
+  exclude each other (e.g., an `import` and an `export` can run on the same library
+  simultaneously, but not a `sync` and either of them)
+"""
 
-_process_lock_file.parent.mkdir(parents=True, exist_ok=True)
+LOCK_TARGETS = ("files", "plex")
+"""Targets written by the runs on a library, each with its own lock."""
 
-_process_lock = FileLock(_process_lock_file)
-"""File lock to ensure only one instance of the application is running."""
+_MODE_TARGETS = {"sync": ("files", "plex"), "import": ("plex",), "export": ("files",)}
+"""Targets written by the runs of each mode."""
 
+_POLL_TIMEOUT = 0.1
+"""Number of seconds to wait for a lock before reporting that it's held elsewhere."""
+
+_LAYOUT_LOCK_TIMEOUT = 10
+"""Maximum number of seconds to wait for the lock guarding the shard layout."""
+
+
+class _LibraryHeld(Exception):
+    """
+    Raised when a library is held by another instance, with the number of shards of
+    the runs holding it if split differently.
+    """
+
+    def __init__(self, shard_count=None):
+        super().__init__(shard_count)
+        self.shard_count = shard_count
+
+
+def get_lock_targets(mode, scope):
+    """Return the targets to lock for a run with the given mode and lock scope."""
+    if scope == "library_mode":
+        return _MODE_TARGETS[mode]
+
+    return LOCK_TARGETS
+
+
+def _slugify(name):
+    """
+    Reduce a name to safe characters for a file name, with a short hash of the original
+    name to keep it unique.
+    """
+    slug = re.sub(r"[^A-Za-z0-9_-]+", "_", name).strip("_")[:40]
+    digest = sha1(name.encode("utf-8")).hexdigest()[:8]
+
+    return f"{slug}-{digest}"
+
+
+def _get_lock_file_path(library_name, target, shard=None, extension="lock"):
+    """Return the path to the lock file of a target of a library (and shard)."""
+    suffix = f"-{target}"
+
+    if shard:
+        suffix += "-shard{}of{}".format(*shard)
+
+    return get_lock_dir() / f"library-{_slugify(library_name)}{suffix}.{extension}"
+
+
+def _get_shard_lock_file_paths(library_name, target, shard_count):
+    """Return the paths to the lock files of every shard of a target of a library."""
+    if shard_count == 1:
+        return [_get_lock_file_path(library_name, target)]
+
+    return [
+        _get_lock_file_path(library_name, target, (index, shard_count))
+        for index in range(1, shard_count + 1)
+    ]
+
+
+def _is_locked(lock_file_path):
+    """Check if a lock file is held, by this process or another one."""
+    lock = FileLock(lock_file_path)
 
-def _cleanup_lock():
-    """Release the lock and remove the lock file."""
     try:
-        if _process_lock.is_locked:
-            _process_lock.release()
+        lock.acquire(timeout=0)
+    except Timeout:
+        return True
+
+    lock.release()
 
-        if _process_lock_file.exists():
-            _process_lock_file.unlink()
-    except Exception:
-        pass
+    return False
 
 
-def acquire_process_lock():
-    """Try to acquire the process lock. Exit if already locked."""
+def _read_shard_count(layout_file_path):
+    """
+    Return the number of shards of the runs last started on a library, 1 for unsharded
+    runs, or `None` if unknown.
+    """
     try:
-        _process_lock.acquire(timeout=0.1)
+        return int(layout_file_path.read_text())
+    except (OSError, ValueError):
+        return None
 
-        atexit.register(_cleanup_lock)
-    except Timeout:
-        print(f"Another instance of {APP_NAME} is already running. Exiting.")
-        sys.exit(1)
+
+def _describe_shard_count(shard_count):
+    """Describe the runs split into a number of shards, for the log messages."""
+    if shard_count == 1:
+        return "an unsharded run"
+
+    return f"runs split into **{shard_count}** shards"
+
+
+class LibraryLocks:
+    """
+    Locks held on a set of libraries for the duration of a run, so that independent
+    runs on other libraries can proceed in parallel, including from other machines or
+    containers sharing the same cache directory. Each library is locked for the targets
+    written by the run (see `LOCK_TARGETS`), so that two runs never write the same audio
+    files or Plex items at once.
+
+    Runs on different shards of a library (see `Shard`) process disjoint tracks, so
+    they only exclude runs on the same shard, as long as the library is split into the
+    same number of shards. The tracks of runs split differently, or not at all, would
+    overlap, so those runs exclude each other. The number of shards of the runs on a
+    library is recorded in a layout file, which is only read and written with the
+    layout lock held, along with the acquisition of the lock of the run.
+
+    Locks are always acquired in the same order to prevent deadlocks between instances
+    waiting on each other. If a lock can't be acquired within the timeout, the locks
+    acquired so far are released and the application exits.
+
+    Lock files are intentionally left behind when released: removing them would allow
+    an instance waiting on the old file and a new instance creating a new file to both
+    acquire "the same" lock.
+    """
+
+    def __init__(self, library_names, targets=LOCK_TARGETS, shard=None, timeout=0):
+        self.library_names = sorted(set(library_names))
+        self.targets = sorted(set(targets))
+        self.shard = shard
+        self.timeout = timeout
+        self._locks = []
+
+    @property
+    def name(self):
+        """
+        Name identifying the locked libraries, targets and shard, which no other run
+        holds at the same time, e.g., for the log file of the run.
+        """
+        name = f"{_slugify('+'.join(self.library_names))}-{'-'.join(self.targets)}"
+
+        if self.shard:
+            name += "-shard{}of{}".format(*self.shard)
+
+        return name
+
+    def _try_acquire(self, library_name, target):
+        """
+        Try to acquire the lock of a target of a single library. Returns the lock if
+        acquired, or `None` along with the number of shards of the runs holding it if
+        split differently.
+        """
+        layout_file_path = _get_lock_file_path(
+            library_name, target, extension="shards"
+        )
+        layout_lock = FileLock(f"{layout_file_path}.lock")
+        shard_count = self.shard[1] if self.shard else 1
+
+        try:
+            layout_lock.acquire(timeout=_LAYOUT_LOCK_TIMEOUT)
+        except Timeout:
+            return None, None
+
+        try:
+            active_shard_count = _read_shard_count(layout_file_path)
+
+            if active_shard_count not in (None, shard_count):
+                lock_file_paths = _get_shard_lock_file_paths(
+                    library_name, target, active_shard_count
+                )
+
+                if any(map(_is_locked, lock_file_paths)):
+                    return None, active_shard_count
+
+            lock = FileLock(_get_lock_file_path(library_name, target, self.shard))
+
+            try:
+                lock.acquire(timeout=_POLL_TIMEOUT)
+            except Timeout:
+                return None, None
+
+            if active_shard_count != shard_count:
+                layout_file_path.write_text(str(shard_count))
+        finally:
+            layout_lock.release()
+
+        return lock, None
+
+    def _acquire(self, library_name, target):
+        """
+        Acquire the lock of a target of a single library, waiting up to the timeout.
+        Raises `_LibraryHeld` if it's held by another instance.
+        """
+        lock, active_shard_count = self._try_acquire(library_name, target)
+
+        if lock is None and self.timeout > 0:
+            log_info(
+                f"Waiting up to **{self.timeout}s** for library **{library_name}** to "
+                "be released by another instance"
+            )
+
+            deadline = monotonic() + self.timeout
+
+            while lock is None and monotonic() < deadline:
+                sleep(_POLL_TIMEOUT)
+                lock, active_shard_count = self._try_acquire(library_name, target)
+
+        if lock is None:
+            raise _LibraryHeld(active_shard_count)
+
+        self._locks.append(lock)
+
+    def acquire(self):
+        """Acquire the locks of all libraries. Exit if any of them is held elsewhere."""
+        get_lock_dir().mkdir(parents=True, exist_ok=True)
+
+        for library_name in self.library_names:
+            try:
+                for target in self.targets:
+                    self._acquire(library_name, target)
+            except _LibraryHeld as e:
+                self.release()
+
+                if e.shard_count is None:
+                    log_error(
+                        f"Another instance of {APP_NAME} is already processing "
+                        f"library **{library_name}**. Exiting."
+                    )
+                else:
+                    shard_count = self.shard[1] if self.shard else 1
+
+                    log_error(
+                        f"Library **{library_name}** is being processed by "
+                        f"{_describe_shard_count(e.shard_count)}, which can't overlap "
+                        f"with {_describe_shard_count(shard_count)}. Exiting."
+                    )
+
+                sys.exit(1)
+
+    def release(self):
+        """Release all acquired locks."""
+        while self._locks:
+            self._locks.pop().release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
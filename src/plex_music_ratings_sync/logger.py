@@ -1,12 +1,15 @@
 import logging
 import re
+import threading
+from collections import deque
+from contextlib import contextmanager
 from inspect import currentframe
 from pathlib import Path
 
 from colorama import Fore, Style
 
 from plex_music_ratings_sync import APP_NAME
-from plex_music_ratings_sync.util.paths import get_log_dir, get_log_file_path
+from plex_music_ratings_sync.util.paths import get_log_dir
 
 MAX_LOG_FILES = 7
 """Maximum number of log files to keep."""
@@ -14,6 +17,18 @@ MAX_LOG_FILES = 7
 _logger = None
 """Application logger instance."""
 
+_capture = threading.local()
+"""Per-thread storage for log records captured instead of being emitted."""
+
+_BUFFERED_RECORDS = 10000
+"""Maximum number of log records kept for the next log file while none is open."""
+
+_file_handler = None
+"""Handler writing to the log file of the current run, if one is open."""
+
+_buffer_handler = None
+"""Handler keeping the log records emitted while no log file is open."""
+
 
 class PlainFormatter(logging.Formatter):
     """A formatter that uses standard log format for file output."""
@@ -34,6 +49,18 @@ class PlainFormatter(logging.Formatter):
         return super().format(record)
 
 
+class _BufferHandler(logging.Handler):
+    """A handler keeping the latest log records, until they're written to a file."""
+
+    def __init__(self):
+        super().__init__()
+        self.records = deque(maxlen=_BUFFERED_RECORDS)
+
+    def emit(self, record):
+        """Keep the log record."""
+        self.records.append(record)
+
+
 class ColoredFormatter(logging.Formatter):
     """
     A custom formatter that adds colors and styling to log messages.
@@ -102,9 +129,10 @@ def init_logging(quiet=None, verbose=None):
 
     Configures the logger based on the application config and command line arguments.
     Supports different log levels with colored output for console, and plain output for
-    file. The log file is truncated on initialization.
+    file. Log messages are only written to a file once one is opened (see
+    `open_log_file`), and kept until then.
     """
-    global _logger
+    global _logger, _file_handler, _buffer_handler
 
     log_dir = get_log_dir()
 
@@ -122,9 +150,47 @@ def init_logging(quiet=None, verbose=None):
     console_handler.setFormatter(ColoredFormatter())
     _logger.addHandler(console_handler)
 
-    file_handler = logging.FileHandler(get_log_file_path(), mode="w")
-    file_handler.setFormatter(PlainFormatter())
-    _logger.addHandler(file_handler)
+    _file_handler = None
+    _buffer_handler = _BufferHandler()
+    _logger.addHandler(_buffer_handler)
+
+
+def open_log_file(file_path):
+    """
+    Write the log messages to a file, truncated first, starting with those kept since
+    logging was initialized or the last log file was closed. Runs on the same libraries
+    share a log file, so a run only opens it once it holds the locks of its libraries.
+    """
+    global _file_handler
+
+    close_log_file()
+
+    _file_handler = logging.FileHandler(file_path, mode="w")
+    _file_handler.setFormatter(PlainFormatter())
+
+    while _buffer_handler.records:
+        _file_handler.handle(_buffer_handler.records.popleft())
+
+    _logger.removeHandler(_buffer_handler)
+    _logger.addHandler(_file_handler)
+
+
+def close_log_file():
+    """Close the log file if open, keeping the next log messages for the next one."""
+    global _file_handler
+
+    if _file_handler is None:
+        return
+
+    _logger.addHandler(_buffer_handler)
+    _logger.removeHandler(_file_handler)
+    _file_handler.close()
+    _file_handler = None
+
+
+def is_verbose():
+    """Check if debug messages are being logged."""
+    return _logger.isEnabledFor(logging.DEBUG)
 
 
 def _get_caller_info():
@@ -140,13 +206,53 @@ def _get_caller_info():
     return (__file__, 0)
 
 
+def _log(level, message, extra):
+    """Emit the log message, or capture it if the current thread is capturing logs."""
+    records = getattr(_capture, "records", None)
+
+    if records is None:
+        _logger.log(level, message, extra=extra)
+    elif _logger.isEnabledFor(level):
+        records.append((level, message, extra))
+
+
+@contextmanager
+def capture_logs():
+    """
+    Capture the log messages of the current thread instead of emitting them.
+
+    This allows work running concurrently in worker threads to have its messages
+    emitted together, and in a deterministic order, with `replay_logs`. Captures can
+    be nested, the outer capture resuming when the inner one ends.
+    """
+    records = []
+
+    previous_records = getattr(_capture, "records", None)
+    _capture.records = records
+
+    try:
+        yield records
+    finally:
+        _capture.records = previous_records
+
+
+def replay_logs(records):
+    """
+    Emit log messages previously captured with `capture_logs`, or capture them again
+    if the current thread is capturing logs.
+    """
+    for level, message, extra in records:
+        _log(level, message, extra)
+
+
 def log_debug(message, indent=0):
     """Log a debug message with the specified indentation level."""
     pathname, lineno = _get_caller_info()
 
-    _logger.debug(
+    _log(
+        logging.DEBUG,
         message,
-        extra={"indent": indent, "caller_pathname": pathname, "caller_lineno": lineno},
+        {"indent": indent, "caller_pathname": pathname, "caller_lineno": lineno},
     )
 
 
@@ -154,9 +260,10 @@ def log_info(message, indent=0):
     """Log an info message with the specified indentation level."""
     pathname, lineno = _get_caller_info()
 
-    _logger.info(
+    _log(
+        logging.INFO,
         message,
-        extra={"indent": indent, "caller_pathname": pathname, "caller_lineno": lineno},
+        {"indent": indent, "caller_pathname": pathname, "caller_lineno": lineno},
     )
 
 
@@ -164,9 +271,10 @@ def log_warning(message, indent=0):
     """Log a warning message with the specified indentation level."""
     pathname, lineno = _get_caller_info()
 
-    _logger.warning(
+    _log(
+        logging.WARNING,
         message,
-        extra={"indent": indent, "caller_pathname": pathname, "caller_lineno": lineno},
+        {"indent": indent, "caller_pathname": pathname, "caller_lineno": lineno},
     )
 
 
@@ -174,9 +282,10 @@ def log_error(message, indent=0):
     """Log an error message with the specified indentation level."""
     pathname, lineno = _get_caller_info()
 
-    _logger.error(
+    _log(
+        logging.ERROR,
         message,
-        extra={"indent": indent, "caller_pathname": pathname, "caller_lineno": lineno},
+        {"indent": indent, "caller_pathname": pathname, "caller_lineno": lineno},
     )
 
 
@@ -184,7 +293,8 @@ def log_critical(message, indent=0):
     """Log a critical message with the specified indentation level."""
     pathname, lineno = _get_caller_info()
 
-    _logger.critical(
+    _log(
+        logging.CRITICAL,
         message,
-        extra={"indent": indent, "caller_pathname": pathname, "caller_lineno": lineno},
+        {"indent": indent, "caller_pathname": pathname, "caller_lineno": lineno},
     )
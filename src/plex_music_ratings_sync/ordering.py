@@ -0,0 +1,75 @@
+import os
+
+from plex_music_ratings_sync.registry import get_file_key
+
+ORDERINGS = ("plex", "directory", "inode")
+"""
+Supported orderings for file operations:
+- `plex`: Keep the artist/album order returned by Plex
+- `directory`: Group operations by device and directory
+- `inode`: Like `directory`, additionally sorting by inode within each directory
+"""
+
+
+def _locality_key(path, file_key, by_inode):
+    """
+    Build the sort key for a file path from its key (see `get_file_key`). Files that
+    can't be stat'ed (e.g., missing files) are sorted last, keeping their relative
+    order.
+    """
+    if file_key[0] != "inode":
+        return (1,)
+
+    _, device, inode = file_key
+    position = inode if by_inode else path.name
+
+    return (0, device, str(path.parent), position)
+
+
+def order_by_locality(items, get_path, by_inode=False, file_keys=None):
+    """
+    Sort items by the on-disk locality of their files (device, directory, and
+    optionally inode), so that their file operations translate into near-sequential
+    I/O on spinning disks. The sort is stable, preserving the original order of items
+    that share the same key.
+
+    The keys of the files (see `get_file_key`), keyed by path, can be given to avoid
+    stat'ing them again, in which case no file is stat'ed.
+    """
+    keys = {}
+
+    for item in items:
+        path = get_path(item)
+        file_key = file_keys[str(path)] if file_keys is not None else get_file_key(path)
+
+        keys[id(item)] = _locality_key(path, file_key, by_inode)
+
+    return sorted(items, key=lambda item: keys[id(item)])
+
+
+def readahead_header(path, length):
+    """
+    Hint the operating system to prefetch the first bytes of a file (where tags are
+    usually stored). This is a best effort optimization, silently skipped on platforms
+    without `posix_fadvise` and for files that can't be opened.
+    """
+    if length <= 0 or not hasattr(os, "posix_fadvise"):
+        return
+
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+
+    try:
+        os.posix_fadvise(fd, 0, length, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def readahead_headers(paths, length):
+    """Hint the operating system to prefetch the headers of files, in order."""
+    for path in paths:
+        readahead_header(path, length)
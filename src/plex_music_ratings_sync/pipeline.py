@@ -0,0 +1,76 @@
+import queue
+import threading
+
+from plex_music_ratings_sync.logger import capture_logs, replay_logs
+
+_PUT_INTERVAL = 0.1
+"""Number of seconds between checks for a stopped consumer while the queue is full."""
+
+_DONE = object()
+"""Marker for the end of the iteration in the prefetch queue."""
+
+
+def prefetch(iterable, size):
+    """
+    Iterate over `iterable` in a background thread, up to `size` items ahead of the
+    consumer, so that producing the next items (e.g., fetching them over the network)
+    overlaps with consuming the current one. The bounded queue provides backpressure,
+    keeping at most `size` items in memory. With a size of zero, `iterable` is
+    iterated in the calling thread.
+
+    The log messages of the background iteration are captured along with each item
+    and emitted when it's consumed, so they keep their order relative to the consumer
+    messages. Exceptions raised by the iteration are raised in the consumer.
+    """
+    if size <= 0:
+        yield from iterable
+        return
+
+    items = queue.Queue(maxsize=size)
+    stopped = threading.Event()
+
+    def put(entry):
+        """Queue an entry, giving up if the consumer stopped while waiting."""
+        while not stopped.is_set():
+            try:
+                items.put(entry, timeout=_PUT_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def produce():
+        """Iterate over `iterable` and queue each item with its log messages."""
+        iterator = iter(iterable)
+
+        while True:
+            try:
+                with capture_logs() as records:
+                    item = next(iterator, _DONE)
+            except BaseException as e:
+                put((records, e, True))
+                return
+
+            if not put((records, item, False)) or item is _DONE:
+                return
+
+    producer = threading.Thread(target=produce, name="prefetch", daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            records, item, failed = items.get()
+
+            replay_logs(records)
+
+            if failed:
+                raise item
+
+            if item is _DONE:
+                return
+
+            yield item
+    finally:
+        stopped.set()
+        producer.join()
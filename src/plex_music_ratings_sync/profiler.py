@@ -0,0 +1,158 @@
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+from plex_music_ratings_sync.logger import log_info
+from plex_music_ratings_sync.util.paths import (
+    get_profile_file_path,
+    get_profile_summary_file_path,
+)
+
+PROFILE_TOP_ENTRIES = 25
+"""Number of entries listed in each section of the profile summary."""
+
+_TRACEMALLOC_FRAMES = 10
+"""Number of stack frames recorded by tracemalloc for each allocation."""
+
+
+def _format_size(size):
+    """Format a size in bytes into a human readable string."""
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+
+        size /= 1024
+
+    return f"{size:.1f} GiB"
+
+
+def _format_function_stats(stats, sort_key):
+    """Format the top profiled functions sorted by the given key."""
+    stream = io.StringIO()
+
+    stats.stream = stream
+    stats.sort_stats(sort_key).print_stats(PROFILE_TOP_ENTRIES)
+
+    return stream.getvalue().strip()
+
+
+def _format_allocation_sites(snapshot):
+    """Format the top allocation sites from a tracemalloc snapshot."""
+    snapshot = snapshot.filter_traces(
+        (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        )
+    )
+
+    lines = []
+
+    statistics = snapshot.statistics("lineno")[:PROFILE_TOP_ENTRIES]
+
+    for index, stat in enumerate(statistics):
+        frame = stat.traceback[0]
+
+        lines.append(
+            f"{index + 1:>3}. {frame.filename}:{frame.lineno} "
+            f"{_format_size(stat.size)} in {stat.count} blocks"
+        )
+
+    return "\n".join(lines) if lines else "No allocations recorded"
+
+
+def _write_summary(stats, snapshot, current_memory, peak_memory):
+    """Write the human readable profile summary to the log directory."""
+    memory = f"{_format_size(peak_memory)} (current: {_format_size(current_memory)})"
+
+    sections = [
+        ("Peak memory", memory),
+        (
+            "Top functions by cumulative time",
+            _format_function_stats(stats, "cumulative"),
+        ),
+        (
+            "Top functions by internal time",
+            _format_function_stats(stats, "tottime"),
+        ),
+        ("Top allocation sites", _format_allocation_sites(snapshot)),
+    ]
+
+    with open(get_profile_summary_file_path(), "w") as summary_file:
+        for title, content in sections:
+            summary_file.write(f"{title}\n{'=' * len(title)}\n\n{content}\n\n")
+
+
+def _profile_new_threads(profilers, lock):
+    """
+    Return a profile hook for `threading.setprofile` that profiles each new thread with
+    its own profiler, added to `profilers`, since `cProfile` only profiles the thread it
+    is enabled in (e.g., not the worker threads where files are read and written).
+    """
+
+    def start_profiler(frame, event, arg):
+        """Replace the hook with a profiler for the current thread."""
+        sys.setprofile(None)
+
+        profiler = cProfile.Profile()
+
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ allows a single active profiler, which profiles every thread
+            return
+
+        with lock:
+            profilers.append(profiler)
+
+    return start_profiler
+
+
+@contextmanager
+def profile_run(enabled=False):
+    """
+    Profile the wrapped block for CPU and memory hotspots when enabled.
+
+    The raw CPU profile is dumped in `pstats` format (readable with `snakeviz`, `pstats`
+    or similar tools) and a summary with the top functions, allocation sites and peak
+    memory is written next to it in the log directory. When disabled, the block runs
+    untouched so that regular runs don't pay for any instrumentation.
+
+    The threads started by the block (e.g., worker threads) are profiled as well, and
+    their profiles merged with the one of the calling thread.
+    """
+    if not enabled:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profilers = [profiler]
+    lock = threading.Lock()
+
+    tracemalloc.start(_TRACEMALLOC_FRAMES)
+    threading.setprofile(_profile_new_threads(profilers, lock))
+    profiler.enable()
+
+    try:
+        yield
+    finally:
+        profiler.disable()
+        threading.setprofile(None)
+
+        snapshot = tracemalloc.take_snapshot()
+        current_memory, peak_memory = tracemalloc.get_traced_memory()
+
+        tracemalloc.stop()
+
+        with lock:
+            stats = pstats.Stats(*profilers)
+
+        stats.dump_stats(get_profile_file_path())
+        _write_summary(stats.strip_dirs(), snapshot, current_memory, peak_memory)
+
+        log_info(f"Profile written to: **{get_profile_file_path()}**")
+        log_info(f"Profile summary written to: **{get_profile_summary_file_path()}**")
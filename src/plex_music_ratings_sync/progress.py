@@ -0,0 +1,101 @@
+from datetime import timedelta
+from time import perf_counter
+
+from plex_music_ratings_sync.logger import log_info
+from plex_music_ratings_sync.util.datetime import format_time
+
+PROGRESS_INTERVAL = 10
+"""Minimum number of seconds between two progress reports."""
+
+OUTCOMES = ("changed", "unchanged", "skipped", "unreadable", "timed_out", "failed")
+"""
+Possible outcomes of processing a track:
+- `changed`: A rating was written to Plex or to the file
+- `unchanged`: Ratings were already in sync (or there was nothing to do)
+- `skipped`: The file is missing or not supported
+- `unreadable`: The file couldn't be read by a previous run and is unchanged since
+- `timed_out`: A file operation exceeded its deadline and was abandoned
+- `failed`: An error occurred while reading or writing a rating
+"""
+
+
+class ProgressReporter:
+    """
+    Aggregated progress of a library, periodically reported with throughput and an
+    estimated time of arrival instead of a line for every processed track.
+    """
+
+    def __init__(self, library_name, total_tracks=None, interval=PROGRESS_INTERVAL):
+        self.library_name = library_name
+        self.total_tracks = total_tracks
+        self.interval = interval
+
+        self.processed = 0
+        self.outcomes = dict.fromkeys(OUTCOMES, 0)
+
+        self._start_time = perf_counter()
+        self._last_report_time = self._start_time
+
+    def _throughput(self):
+        """Return the number of tracks processed per second so far."""
+        elapsed = perf_counter() - self._start_time
+
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+    def _format_counters(self):
+        """Format the outcome counters, skipping the unchanged tracks."""
+        return ", ".join(
+            f"**{self.outcomes[outcome]}** {outcome}"
+            for outcome in OUTCOMES
+            if outcome != "unchanged"
+        )
+
+    def extend(self, tracks):
+        """
+        Account for tracks joining the library after its total was counted, e.g., the
+        tracks of other Plex servers sharing its files.
+        """
+        if self.total_tracks:
+            self.total_tracks += tracks
+
+    def advance(self, outcome, tracks=1):
+        """
+        Account for processed tracks with the given outcome, and report the progress if
+        the report interval has elapsed.
+        """
+        self.processed += tracks
+        self.outcomes[outcome] += tracks
+
+        if perf_counter() - self._last_report_time >= self.interval:
+            self.report()
+
+    def report(self):
+        """Report the current progress of the library."""
+        self._last_report_time = perf_counter()
+
+        throughput = self._throughput()
+
+        if self.total_tracks:
+            percentage = min(100, self.processed * 100 // self.total_tracks)
+            position = f"**{self.processed}**/**{self.total_tracks}** ({percentage}%)"
+        else:
+            position = f"**{self.processed}**"
+
+        message = f"Progress: {position} tracks, **{throughput:.1f}** tracks/s"
+
+        if self.total_tracks and throughput > 0:
+            remaining = max(0, self.total_tracks - self.processed) / throughput
+            message += f", ETA **{format_time(timedelta(seconds=remaining))}**"
+
+        log_info(f"{message} ({self._format_counters()})", 1)
+
+    def finish(self):
+        """Report the final counters of the library."""
+        elapsed_time = timedelta(seconds=perf_counter() - self._start_time)
+
+        log_info(
+            f"Library **{self.library_name}** completed: **{self.processed}** tracks "
+            f"in **{format_time(elapsed_time)}** (**{self._throughput():.1f}** "
+            f"tracks/s, {self._format_counters()})",
+            1,
+        )
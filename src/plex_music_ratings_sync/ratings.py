@@ -1,3 +1,12 @@
+import json
+import logging
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from filelock import FileLock
+from mutagen import MutagenError
 from mutagen.flac import FLAC
 from mutagen.id3 import ID3, POPM
 from mutagen.mp3 import MP3
@@ -5,9 +14,27 @@ from mutagen.mp4 import MP4
 from mutagen.oggopus import OggOpus
 from mutagen.oggvorbis import OggVorbis
 
-from plex_music_ratings_sync.logger import log_debug, log_error, log_info
+from plex_music_ratings_sync.logger import (
+    capture_logs,
+    log_debug,
+    log_error,
+    log_info,
+    replay_logs,
+)
+from plex_music_ratings_sync.registry import get_file_signature
 from plex_music_ratings_sync.state import is_dry_run
 
+RATING_STORAGES = ("tags", "sidecar", "database")
+"""
+Backends storing the ratings of the audio files:
+- `tags`: In the tags of each audio file (default)
+- `sidecar`: In a JSON file next to the audio files of each folder
+- `database`: In a local SQLite database, keyed by audio file path
+"""
+
+_SIDECAR_LOCK_TIMEOUT = 30
+"""Maximum number of seconds to wait for a sidecar file locked by another process."""
+
 _PRIMARY_MP3_RATING_MAP = {
     0: 0,
     1: 13,
@@ -101,7 +128,25 @@ def _plex_rating_to_popm(plex_rating):
     return _PRIMARY_MP3_RATING_MAP.get(plex_rating, 0)
 
 
-def _get_rating_from_mp3(file_path):
+def is_format_error(error):
+    """
+    Check if an error raised while reading an audio file comes from its content (e.g.,
+    a corrupt or mislabeled file), which fails the same way until the file changes.
+    Errors accessing the file (e.g., permissions or I/O errors on a network share),
+    which `mutagen` wraps, may not happen again on the next attempt.
+    """
+    return isinstance(error, MutagenError) and not any(
+        isinstance(cause, OSError) for cause in (*error.args, error.__context__)
+    )
+
+
+def _report_read_error(errors, error):
+    """Report an error raised while reading an audio file, if `errors` are collected."""
+    if errors is not None:
+        errors.append(error)
+
+
+def _get_rating_from_mp3(file_path, errors=None):
     """
     Read rating from an MP3 file's POPM tag. Attempts to read the rating from a Plex
     POPM tag first, falling back to other POPM tags if no Plex tag is found. Converts
@@ -133,6 +178,7 @@ def _get_rating_from_mp3(file_path):
         return None
     except Exception as e:
         log_error(f"▪ Failed to read rating from MP3 file: {e}", 4)
+        _report_read_error(errors, e)
         return None
 
 
@@ -171,11 +217,14 @@ def _set_rating_to_mp3(file_path, plex_rating):
             audio.save()
 
             log_info(f"▸ Successfully rated MP3 file: {log_rating}", 4)
+
+        return True
     except Exception as e:
         log_error(f"▪ Failed to write rating for MP3 file: {e}", 4)
+        return False
 
 
-def _get_rating_from_vorbis(file_path, file_type):
+def _get_rating_from_vorbis(file_path, file_type, errors=None):
     """
     Read rating from a file using Vorbis Comments (FLAC/OGG/OPUS) RATING tag. Converts
     the rating (10-100 scale) to Plex's 1-10 scale.
@@ -209,6 +258,7 @@ def _get_rating_from_vorbis(file_path, file_type):
         return None
     except Exception as e:
         log_error(f"▪ Failed to read rating from {file_type} file: {e}", 4)
+        _report_read_error(errors, e)
         return None
 
 
@@ -242,11 +292,14 @@ def _set_rating_to_vorbis(file_path, plex_rating, file_type):
             audio.save()
 
             log_info(f"▸ Successfully rated {file_type} file: {log_rating}", 4)
+
+        return True
     except Exception as e:
         log_error(f"▪ Failed to write rating for {file_type} file: {e}", 4)
+        return False
 
 
-def _get_rating_from_m4a(file_path):
+def _get_rating_from_m4a(file_path, errors=None):
     """
     Read rating from an M4A (AAC/ALAC) file's RATE tag. Converts the rating (10-100
     scale) to Plex's 1-10 scale.
@@ -274,6 +327,7 @@ def _get_rating_from_m4a(file_path):
         return None
     except Exception as e:
         log_error(f"▪ Failed to read rating from M4A file: {e}", 4)
+        _report_read_error(errors, e)
         return None
 
 
@@ -301,24 +355,28 @@ def _set_rating_to_m4a(file_path, plex_rating):
             audio.save()
 
             log_info(f"▸ Successfully rated M4A file: {log_rating}", 4)
+
+        return True
     except Exception as e:
         log_error(f"▪ Failed to write rating for M4A file: {e}", 4)
+        return False
 
 
-def get_rating_from_file(file_path):
+def get_rating_from_file(file_path, errors=None):
     """
     Read rating from a music file based on its extension. Returns the rating on the 1-10
-    scale used by Plex.
+    scale used by Plex. Errors raised by a failed read are logged, and appended to
+    `errors` if given.
     """
     if file_path.endswith(".mp3"):
-        return _get_rating_from_mp3(file_path)
+        return _get_rating_from_mp3(file_path, errors)
 
     if file_path.endswith(".m4a"):
-        return _get_rating_from_m4a(file_path)
+        return _get_rating_from_m4a(file_path, errors)
 
     for ext, file_type in _VORBIS_FORMATS.items():
         if file_path.endswith(ext):
-            return _get_rating_from_vorbis(file_path, file_type)
+            return _get_rating_from_vorbis(file_path, file_type, errors)
 
     return None
 
@@ -326,17 +384,19 @@ def get_rating_from_file(file_path):
 def set_rating_to_file(file_path, plex_rating):
     """
     Write rating to a music file based on its extension. Converts the Plex rating to the
-    appropriate format for the file type.
+    appropriate format for the file type. Returns whether the rating was written.
     """
     if file_path.endswith(".mp3"):
-        _set_rating_to_mp3(file_path, plex_rating)
+        return _set_rating_to_mp3(file_path, plex_rating)
 
     if file_path.endswith(".m4a"):
-        _set_rating_to_m4a(file_path, plex_rating)
+        return _set_rating_to_m4a(file_path, plex_rating)
 
     for ext, file_type in _VORBIS_FORMATS.items():
         if file_path.endswith(ext):
-            _set_rating_to_vorbis(file_path, plex_rating, file_type)
+            return _set_rating_to_vorbis(file_path, plex_rating, file_type)
+
+    return False
 
 
 def get_rating_from_plex(plex_item):
@@ -365,7 +425,10 @@ def get_rating_from_plex(plex_item):
 
 
 def set_rating_to_plex(plex_item, file_rating):
-    """Write rating to a Plex media item using Plex's 1-10 scale."""
+    """
+    Write rating to a Plex media item using Plex's 1-10 scale. Returns whether the
+    rating was written.
+    """
     try:
         log_rating = f"**{file_rating}** (**{file_rating / 2}**"
 
@@ -378,5 +441,243 @@ def set_rating_to_plex(plex_item, file_rating):
             plex_item.rate(float(file_rating))
 
             log_info(f"▸ Successfully rated Plex media: {log_rating})", 4)
-    except AttributeError as e:
+
+        return True
+    except Exception as e:
         log_error(f"▪ Failed to write rating for Plex media: {e}", 4)
+        return False
+
+
+class TagRatingStorage:
+    """Store the ratings of the audio files in their own tags."""
+
+    def get_rating(self, file_path, errors=None):
+        """
+        Read the rating of an audio file on the 1-10 scale used by Plex. Errors raised
+        reading the file are appended to `errors` if given.
+        """
+        return get_rating_from_file(file_path, errors)
+
+    def set_rating(self, file_path, plex_rating):
+        """Write the rating of an audio file. Returns whether it was written."""
+        return set_rating_to_file(file_path, plex_rating)
+
+    def get_signature(self, file_path):
+        """
+        Return the signature of the stored rating of an audio file, which changes
+        whenever the rating may have changed (see `get_file_signature`).
+        """
+        return get_file_signature(file_path)
+
+
+class _ExternalRatingStorage(TagRatingStorage, ABC):
+    """
+    Base of the backends storing the ratings outside of the audio files, so that
+    changing a rating writes a few bytes instead of rewriting a media file.
+
+    Audio files without a stored rating fall back to the rating in their tags, which
+    is then stored so that switching backends carries the existing ratings over and
+    the tags are only read once. Unrated files aren't stored, so that a rating added
+    to their tags later on is still picked up.
+    """
+
+    description = None
+
+    @abstractmethod
+    def _lookup(self, file_path):
+        """Return whether a rating is stored for an audio file, and that rating."""
+
+    @abstractmethod
+    def _store(self, file_path, plex_rating):
+        """Store the rating of an audio file."""
+
+    def get_rating(self, file_path, errors=None):
+        """
+        Read the rating of an audio file, falling back to its tags if it has no stored
+        rating yet. Errors raised reading the tags are appended to `errors` if given,
+        unlike those of the backend, which are not tied to the file.
+        """
+        try:
+            stored, rating = self._lookup(file_path)
+        except Exception as e:
+            log_error(f"▪ Failed to read rating from {self.description}: {e}", 4)
+            return None
+
+        if stored:
+            log_debug(
+                f"▸ Successfully read rating from {self.description}: **{rating}**", 4
+            )
+            return rating
+
+        with capture_logs() as records:
+            rating = get_rating_from_file(file_path, errors)
+
+        replay_logs(records)
+
+        # A failed read isn't stored, so the tags are read again on the next run
+        if (
+            rating is not None
+            and not is_dry_run()
+            and not any(level >= logging.ERROR for level, _, _ in records)
+        ):
+            try:
+                self._store(file_path, rating)
+            except Exception as e:
+                log_error(f"▪ Failed to store rating in {self.description}: {e}", 4)
+
+        return rating
+
+    def set_rating(self, file_path, plex_rating):
+        """Store the rating of an audio file. Returns whether it was stored."""
+        try:
+            log_rating = f"**{plex_rating}** (**{(plex_rating or 0) / 2}**)"
+
+            if is_dry_run():
+                log_info(
+                    f"▸ [dry-run] Would have rated file in {self.description}: "
+                    f"{log_rating}",
+                    4,
+                )
+            else:
+                self._store(file_path, plex_rating)
+
+                log_info(
+                    f"▸ Successfully rated file in {self.description}: {log_rating}", 4
+                )
+
+            return True
+        except Exception as e:
+            log_error(f"▪ Failed to write rating to {self.description}: {e}", 4)
+            return False
+
+
+class SidecarRatingStorage(_ExternalRatingStorage):
+    """
+    Store the ratings of the audio files of each folder in a JSON sidecar file in that
+    folder, mapping file names to ratings. Sidecar files are cached in memory until
+    they change on disk, and updated under a file lock, so that processes sharing the
+    folder (e.g., a file agent and a run on another shard) don't lose each other's
+    ratings.
+    """
+
+    description = "sidecar"
+
+    def __init__(self, sidecar_name):
+        self.sidecar_name = sidecar_name
+
+        self._sidecars = {}
+        self._lock = threading.Lock()
+
+    def _get_sidecar_path(self, file_path):
+        """Return the path of the sidecar file holding the rating of an audio file."""
+        return Path(file_path).parent / self.sidecar_name
+
+    def _load(self, sidecar_path):
+        """Return the ratings of a sidecar file, reading it again if it changed."""
+        signature = get_file_signature(sidecar_path)
+
+        if signature is None:
+            return {}
+
+        cached = self._sidecars.get(sidecar_path)
+
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        with open(sidecar_path, "r", encoding="utf-8") as sidecar_file:
+            ratings = json.load(sidecar_file)
+
+        if not isinstance(ratings, dict):
+            raise ValueError(f"unexpected content in {sidecar_path}")
+
+        self._sidecars[sidecar_path] = (signature, ratings)
+
+        return ratings
+
+    def _lookup(self, file_path):
+        file_name = Path(file_path).name
+
+        with self._lock:
+            ratings = self._load(self._get_sidecar_path(file_path))
+
+        return (file_name in ratings, ratings.get(file_name))
+
+    def _store(self, file_path, plex_rating):
+        sidecar_path = self._get_sidecar_path(file_path)
+        temporary_path = sidecar_path.with_name(f"{sidecar_path.name}.tmp")
+
+        sidecar_lock = FileLock(f"{sidecar_path}.lock", timeout=_SIDECAR_LOCK_TIMEOUT)
+
+        # The sidecar is read again under the lock, in case another process updated it
+        with sidecar_lock, self._lock:
+            ratings = {**self._load(sidecar_path), Path(file_path).name: plex_rating}
+
+            with open(temporary_path, "w", encoding="utf-8") as sidecar_file:
+                json.dump(ratings, sidecar_file, indent=2, sort_keys=True)
+
+            temporary_path.replace(sidecar_path)
+
+            self._sidecars[sidecar_path] = (get_file_signature(sidecar_path), ratings)
+
+    def get_signature(self, file_path):
+        """
+        Return the signature of the stored rating of an audio file, made of the
+        signatures of the audio file and of its sidecar file.
+        """
+        return (
+            get_file_signature(file_path),
+            get_file_signature(self._get_sidecar_path(file_path)),
+        )
+
+
+class DatabaseRatingStorage(_ExternalRatingStorage):
+    """
+    Store the ratings of the audio files in a local SQLite database, keyed by path.
+    The database is meant to be owned by this app: ratings changed there by other
+    means aren't noticed by a running daemon until the audio file itself changes.
+    """
+
+    description = "database"
+
+    def __init__(self, database_path):
+        Path(database_path).parent.mkdir(parents=True, exist_ok=True)
+
+        self._connection = sqlite3.connect(
+            str(database_path), timeout=30, check_same_thread=False
+        )
+        self._lock = threading.Lock()
+
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS ratings "
+                "(path TEXT PRIMARY KEY, rating INTEGER)"
+            )
+
+    def _lookup(self, file_path):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT rating FROM ratings WHERE path = ?", (str(file_path),)
+            ).fetchone()
+
+        return (row is not None, row[0] if row is not None else None)
+
+    def _store(self, file_path, plex_rating):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO ratings (path, rating) VALUES (?, ?)",
+                (str(file_path), plex_rating),
+            )
+
+
+def create_rating_storage(storage_config):
+    """Create the backend storing the ratings of the audio files."""
+    backend = storage_config["backend"]
+
+    if backend == "sidecar":
+        return SidecarRatingStorage(storage_config["sidecar_name"])
+
+    if backend == "database":
+        return DatabaseRatingStorage(storage_config["database"])
+
+    return TagRatingStorage()
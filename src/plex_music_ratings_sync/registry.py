@@ -0,0 +1,287 @@
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from filelock import FileLock
+
+from plex_music_ratings_sync.logger import log_warning
+from plex_music_ratings_sync.util.paths import get_unreadable_file_path
+
+
+def stat_file(file_path):
+    """
+    Check the existence of an audio file and build its key (see `get_file_key`), with a
+    single `stat` call.
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return False, ("path", str(Path(file_path).resolve()))
+
+    if stat.st_ino:
+        return True, ("inode", stat.st_dev, stat.st_ino)
+
+    return True, ("path", str(Path(file_path).resolve()))
+
+
+def get_file_key(file_path):
+    """
+    Build the key identifying an audio file on disk. Files are identified by device
+    and inode so that the same file reached through different paths (e.g., a folder
+    configured in two libraries, bind mounts or hard links) shares a single key. The
+    resolved path is used instead when the file can't be stat'ed or the platform doesn't
+    provide inode numbers.
+    """
+    return stat_file(file_path)[1]
+
+
+class VisitedFiles:
+    """
+    Registry of the audio files visited during a run, along with the rating each file
+    ended up with. Later occurrences of a visited file (from another library or another
+    Plex item) reuse that rating instead of reading and writing the file again.
+    """
+
+    def __init__(self):
+        self._ratings = {}
+        self._lock = threading.Lock()
+
+        self.duplicates = 0
+        self.conflicts = 0
+
+    def lookup(self, file_key):
+        """
+        Return whether the file was already visited during this run, and the rating it
+        ended up with.
+        """
+        with self._lock:
+            return (file_key in self._ratings, self._ratings.get(file_key))
+
+    def record(self, file_key, rating, occurrences=1):
+        """Record the rating a file ended up with after processing its Plex items."""
+        with self._lock:
+            if file_key in self._ratings:
+                self.duplicates += occurrences
+            else:
+                self.duplicates += occurrences - 1
+
+            self._ratings[file_key] = rating
+
+    def report_conflict(self):
+        """Count a rating conflict between Plex items sharing the same file."""
+        with self._lock:
+            self.conflicts += 1
+
+
+def get_file_signature(file_path):
+    """
+    Return the signature of a file's content, made of its modification time and size,
+    or `None` if the file can't be stat'ed.
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class FileRatingCache:
+    """
+    Ratings of the audio files read or written by previous runs of a long-running
+    process. A cached rating is reused as long as the signature of the file (see
+    `get_file_signature`) didn't change, sparing the file from being read again.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def reset_counters(self):
+        """Reset the hit and miss counters, at the start of a run."""
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def lookup(self, file_path, signature):
+        """
+        Return whether the file has a cached rating that's still valid for its current
+        signature, and that rating.
+        """
+        with self._lock:
+            entry = self._entries.get(str(file_path))
+
+            if signature is not None and entry is not None and entry[0] == signature:
+                self.hits += 1
+                return (True, entry[1])
+
+            self.misses += 1
+
+            return (False, None)
+
+    def store(self, file_path, signature, rating):
+        """Cache the rating of a file with the signature it was read or written with."""
+        with self._lock:
+            if signature is None:
+                self._entries.pop(str(file_path), None)
+            else:
+                self._entries[str(file_path)] = (signature, rating)
+
+    def discard(self, file_path):
+        """Forget the cached rating of a file."""
+        with self._lock:
+            self._entries.pop(str(file_path), None)
+
+
+def _to_json(value):
+    """Convert a value to its JSON representation (e.g., tuples to lists)."""
+    return json.loads(json.dumps(value))
+
+
+class UnreadableFiles:
+    """
+    Persistent registry of the audio files whose rating couldn't be read (e.g.,
+    corrupt files, empty placeholders or unparseable tags), along with the signature
+    they had at the time, as returned by `get_signature` (see `get_file_signature`).
+    Runs skip these files until their signature changes, sparing the failed reads and
+    the errors they log every run.
+
+    The changes made by a run are merged into the registry when it's saved, so that
+    concurrent runs on other libraries keep theirs.
+    """
+
+    def __init__(self, get_signature=get_file_signature):
+        self.get_signature = get_signature
+
+        self._entries = {}
+        self._changes = {}
+        self._lock = threading.Lock()
+
+        self.recorded = 0
+
+    def _read(self):
+        """Read the persisted registry."""
+        unreadable_file_path = get_unreadable_file_path()
+
+        if not unreadable_file_path.exists():
+            return {}
+
+        try:
+            with open(unreadable_file_path, "r", encoding="utf-8") as unreadable_file:
+                entries = json.load(unreadable_file)
+        except (OSError, ValueError) as e:
+            log_warning(f"Ignoring unreadable registry of unreadable files: {e}")
+            return {}
+
+        return entries if isinstance(entries, dict) else {}
+
+    def _lock_persisted(self):
+        """Return the lock guarding the persisted registry across instances."""
+        unreadable_file_path = get_unreadable_file_path()
+        unreadable_file_path.parent.mkdir(parents=True, exist_ok=True)
+
+        return FileLock(f"{unreadable_file_path}.lock")
+
+    def load(self):
+        """Load the persisted registry, at the start of a run."""
+        with self._lock_persisted():
+            entries = self._read()
+
+        with self._lock:
+            self._entries = entries
+            self._changes = {}
+
+            self.recorded = 0
+
+    def save(self):
+        """Merge the changes made by the run into the persisted registry."""
+        with self._lock:
+            changes = self._changes
+            self._changes = {}
+
+        if not changes:
+            return
+
+        with self._lock_persisted():
+            entries = self._read()
+
+            for file_path, entry in changes.items():
+                if entry is None:
+                    entries.pop(file_path, None)
+                else:
+                    entries[file_path] = entry
+
+            unreadable_file_path = get_unreadable_file_path()
+            temporary_file_path = unreadable_file_path.with_suffix(".tmp")
+
+            with open(temporary_file_path, "w", encoding="utf-8") as unreadable_file:
+                json.dump(entries, unreadable_file, indent=2, sort_keys=True)
+
+            temporary_file_path.replace(unreadable_file_path)
+
+    def entries(self):
+        """Return the registered files, sorted by path."""
+        with self._lock:
+            return sorted(self._entries.items())
+
+    def lookup(self, file_path):
+        """
+        Return the entry of a file that couldn't be read and is unchanged since, or
+        `None`. Only registered files are stat'ed.
+        """
+        with self._lock:
+            entry = self._entries.get(str(file_path))
+
+        if entry is None:
+            return None
+
+        signature = self.get_signature(file_path)
+
+        if signature is None or _to_json(signature) != entry["signature"]:
+            return None
+
+        return entry
+
+    def record(self, file_path, signature, error):
+        """Register a file whose rating couldn't be read, with its signature."""
+        if signature is None:
+            return
+
+        with self._lock:
+            previous_entry = self._entries.get(str(file_path)) or {}
+
+            entry = {
+                "signature": _to_json(signature),
+                "error": error,
+                "since": previous_entry.get(
+                    "since", datetime.now().isoformat(timespec="seconds")
+                ),
+            }
+
+            self._entries[str(file_path)] = entry
+            self._changes[str(file_path)] = entry
+            self.recorded += 1
+
+    def discard(self, file_path):
+        """Forget a registered file, once its rating could be read."""
+        with self._lock:
+            if self._entries.pop(str(file_path), None) is not None:
+                self._changes[str(file_path)] = None
+
+    def clear(self):
+        """Forget all registered files, so that they are read again."""
+        with self._lock_persisted():
+            get_unreadable_file_path().unlink(missing_ok=True)
+
+        with self._lock:
+            self._entries = {}
+            self._changes = {}
@@ -0,0 +1,86 @@
+import ctypes
+import os
+import platform
+
+from plex_music_ratings_sync.logger import log_info, log_warning
+
+IO_PRIORITIES = ("idle", "low")
+"""
+Supported I/O priorities in gentle mode (Linux only):
+- `idle`: Only access the disks when no other process needs them
+- `low`: The lowest priority of the default (best-effort) scheduling class
+"""
+
+_IOPRIO_SET_SYSCALLS = {
+    "x86_64": 251,
+    "aarch64": 30,
+    "armv7l": 314,
+    "armv6l": 314,
+    "i686": 289,
+    "i386": 289,
+}
+"""Number of the `ioprio_set` system call on the supported architectures."""
+
+_IOPRIO_VALUES = {"idle": 3 << 13, "low": (2 << 13) | 7}
+"""Values of the I/O priorities, as the scheduling class shifted left plus the level."""
+
+_IOPRIO_WHO_PROCESS = 1
+"""Target of `ioprio_set` designating a process (or thread) by its identifier."""
+
+_THREAD_IO_PATH = "/proc/thread-self/io"
+"""Linux I/O accounting of the calling thread."""
+
+
+def _set_io_priority(io_priority):
+    """
+    Set the I/O priority of the calling thread, inherited by the threads it creates.
+    Returns whether the platform supports it.
+    """
+    syscall = _IOPRIO_SET_SYSCALLS.get(platform.machine())
+
+    if platform.system() != "Linux" or syscall is None:
+        return False
+
+    libc = ctypes.CDLL(None, use_errno=True)
+
+    if libc.syscall(syscall, _IOPRIO_WHO_PROCESS, 0, _IOPRIO_VALUES[io_priority]):
+        raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+    return True
+
+
+def lower_priority(niceness, io_priority):
+    """
+    Lower the CPU and I/O priorities of the calling thread, so that a run yields to
+    other processes (e.g., Plex transcoding). Must be called before creating the
+    worker threads, which inherit them. Failures are reported but not fatal.
+    """
+    if niceness:
+        try:
+            os.nice(niceness)
+            log_info(f"Lowered CPU priority by **{niceness}**")
+        except (AttributeError, OSError) as e:
+            log_warning(f"Failed to lower CPU priority: {e}")
+
+    if io_priority:
+        try:
+            if _set_io_priority(io_priority):
+                log_info(f"Lowered I/O priority to **{io_priority}**")
+            else:
+                log_warning("Lowering I/O priority is not supported on this platform")
+        except OSError as e:
+            log_warning(f"Failed to lower I/O priority: {e}")
+
+
+def get_thread_io_bytes():
+    """
+    Return the number of bytes read and written by the calling thread so far, or
+    `None` on platforms without per-thread I/O accounting.
+    """
+    try:
+        with open(_THREAD_IO_PATH, "r") as io_file:
+            counters = dict(line.split(": ", 1) for line in io_file)
+    except (OSError, ValueError):
+        return None
+
+    return int(counters["rchar"]) + int(counters["wchar"])
@@ -0,0 +1,289 @@
+import json
+import threading
+from time import sleep
+
+from filelock import FileLock
+
+from plex_music_ratings_sync.logger import log_debug, log_info, log_warning
+from plex_music_ratings_sync.util.paths import get_retry_file_path
+
+OPERATION_TARGETS = ("file", "plex")
+"""
+Targets of the write operations that can be retried:
+- `file`: Writing a rating to an audio file, identified by its path
+- `plex`: Writing a rating to a Plex item, identified by its server and rating key
+"""
+
+
+def _get_operation_key(operation):
+    """Return the key identifying the target of an operation."""
+    if operation["target"] == "file":
+        return ("file", operation["path"])
+
+    return ("plex", operation.get("server"), operation["rating_key"])
+
+
+def file_operation(library_name, file_path, rating, previous_rating):
+    """
+    Build the operation writing a rating to an audio file, which held
+    `previous_rating` when the operation was built.
+    """
+    return {
+        "target": "file",
+        "library": library_name,
+        "path": str(file_path),
+        "rating": rating,
+        "previous_rating": previous_rating,
+        "runs": 0,
+    }
+
+
+def plex_operation(library_name, server_name, rating_key, rating, previous_rating):
+    """
+    Build the operation writing a rating to an item of a Plex server, which held
+    `previous_rating` when the operation was built.
+    """
+    return {
+        "target": "plex",
+        "library": library_name,
+        "server": server_name,
+        "rating_key": rating_key,
+        "rating": rating,
+        "previous_rating": previous_rating,
+        "runs": 0,
+    }
+
+
+def is_superseded(operation, current_rating):
+    """
+    Return whether an operation must be dropped because its target no longer holds
+    the rating it had when the operation was built, i.e., it was rated since then by
+    someone else. Operations persisted before the previous rating was recorded are
+    never superseded.
+    """
+    if "previous_rating" not in operation:
+        return False
+
+    return current_rating not in (operation["previous_rating"], operation["rating"])
+
+
+def describe_operation(operation):
+    """Return a short human readable description of an operation."""
+    if operation["target"] == "file":
+        return f"rating **{operation['rating']}** to file __{operation['path']}__"
+
+    return (
+        f"rating **{operation['rating']}** to Plex item **{operation['rating_key']}**"
+    )
+
+
+class RetryQueue:
+    """
+    Queue of the write operations that failed during a run, retried once the run is
+    done instead of stalling it with inline retries.
+
+    The queue is drained with an exponential backoff between attempts. Operations that
+    still fail are persisted in the cache directory, so that the next run on the same
+    libraries retries them first, before scanning anything. Operations failing for
+    `max_runs` runs in a row are dropped.
+
+    Only the latest operation is kept for each target, so a rating written later in a
+    run supersedes a failed one for the same file or Plex item.
+
+    With a shard (e.g., `1/4`), the persisted operations are those of the runs on the
+    same shard, so that runs on other shards sharing the cache directory keep theirs.
+    """
+
+    def __init__(
+        self,
+        library_names,
+        max_attempts,
+        initial_delay,
+        max_delay,
+        max_runs,
+        shard=None,
+    ):
+        self.library_names = set(library_names)
+        self.shard = shard
+        self.max_attempts = max_attempts
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.max_runs = max_runs
+
+        self._operations = {}
+        self._lock = threading.Lock()
+
+        self.deferred = 0
+        self.recovered = 0
+        self.persisted = 0
+        self.dropped = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._operations)
+
+    def _requeue(self, operation):
+        """Queue an operation, superseding any pending one for its target."""
+        with self._lock:
+            self._operations[_get_operation_key(operation)] = operation
+
+    def push(self, operation):
+        """Defer an operation that failed during the run."""
+        operation["shard"] = self.shard
+
+        self._requeue(operation)
+
+        with self._lock:
+            self.deferred += 1
+
+    def discard(self, operation):
+        """
+        Forget the pending operation for the same target, if any, once a more recent
+        rating was successfully written to it.
+        """
+        with self._lock:
+            self._operations.pop(_get_operation_key(operation), None)
+
+    def _pop_all(self):
+        """Remove and return all pending operations."""
+        with self._lock:
+            operations = list(self._operations.values())
+            self._operations.clear()
+
+            return operations
+
+    def _read_persisted(self):
+        """Read the operations persisted by previous runs, for all libraries."""
+        retry_file_path = get_retry_file_path()
+
+        if not retry_file_path.exists():
+            return []
+
+        try:
+            with open(retry_file_path, "r", encoding="utf-8") as retry_file:
+                operations = json.load(retry_file)
+        except (OSError, ValueError) as e:
+            log_warning(f"Ignoring unreadable retry queue: {e}")
+            return []
+
+        return [
+            operation
+            for operation in operations
+            if isinstance(operation, dict)
+            and operation.get("target") in OPERATION_TARGETS
+        ]
+
+    def _owns(self, operation):
+        """Check if a persisted operation belongs to this run's libraries and shard."""
+        return (
+            operation.get("library") in self.library_names
+            and operation.get("shard") == self.shard
+        )
+
+    def _lock_persisted(self):
+        """Return the lock guarding the persisted operations across instances."""
+        retry_file_path = get_retry_file_path()
+        retry_file_path.parent.mkdir(parents=True, exist_ok=True)
+
+        return FileLock(f"{retry_file_path}.lock")
+
+    def load(self):
+        """
+        Return the operations persisted by previous runs for the libraries (and shard)
+        of this run. Other operations are left for the runs processing them.
+        """
+        with self._lock_persisted():
+            return list(filter(self._owns, self._read_persisted()))
+
+    def save(self):
+        """
+        Persist the pending operations of the libraries (and shard) of this run,
+        replacing those persisted by previous runs. Operations that failed for too many
+        runs are dropped instead.
+        """
+        operations = []
+
+        for operation in self._pop_all():
+            operation["runs"] = operation.get("runs", 0) + 1
+
+            if operation["runs"] >= self.max_runs:
+                self.dropped += 1
+
+                log_warning(
+                    f"Giving up on writing {describe_operation(operation)} after "
+                    f"**{operation['runs']}** runs"
+                )
+            else:
+                operations.append(operation)
+
+        with self._lock_persisted():
+            other_operations = [
+                operation
+                for operation in self._read_persisted()
+                if not self._owns(operation)
+            ]
+
+            retry_file_path = get_retry_file_path()
+            temporary_file_path = retry_file_path.with_suffix(".tmp")
+
+            with open(temporary_file_path, "w", encoding="utf-8") as retry_file:
+                json.dump(other_operations + operations, retry_file, indent=2)
+
+            temporary_file_path.replace(retry_file_path)
+
+        self.persisted = len(operations)
+
+        if operations:
+            log_info(
+                f"Persisted **{len(operations)}** failed operations to retry on the "
+                "next run"
+            )
+
+    def _get_delay(self, attempt):
+        """Return the number of seconds to wait before the given attempt."""
+        return min(self.max_delay, self.initial_delay * 2 ** (attempt - 2))
+
+    def drain(self, execute):
+        """
+        Retry the pending operations with `execute`, which returns whether an
+        operation succeeded, until they all succeed or reach the maximum number of
+        attempts. The first attempt being the one made during the run, retries start
+        at the second attempt.
+        """
+        for attempt in range(2, self.max_attempts + 1):
+            operations = self._pop_all()
+
+            if not operations:
+                return
+
+            delay = self._get_delay(attempt)
+
+            log_info(
+                f"Retrying **{len(operations)}** failed operations in **{delay:g}s** "
+                f"(attempt **{attempt}**/**{self.max_attempts}**)"
+            )
+
+            sleep(delay)
+
+            self.retry(operations, execute)
+
+    def retry(self, operations, execute):
+        """
+        Attempt the given operations once with `execute`, deferring those that fail
+        again.
+        """
+        for operation in operations:
+            log_debug(f"Retrying to write {describe_operation(operation)}", 1)
+
+            if execute(operation):
+                self.recovered += 1
+            else:
+                self._requeue(operation)
+
+    def summary(self):
+        """Return a summary of the deferred operations."""
+        return (
+            f"Deferred **{self.deferred}** failed operations: **{self.recovered}** "
+            f"recovered, **{self.persisted}** persisted for the next run, "
+            f"**{self.dropped}** dropped"
+        )
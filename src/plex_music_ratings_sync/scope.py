@@ -0,0 +1,409 @@
+import re
+from datetime import datetime, timedelta
+from hashlib import sha1
+
+from plexapi.exceptions import NotFound
+
+from plex_music_ratings_sync.logger import log_debug
+
+_RELATIVE_TIME_UNITS = {
+    "s": timedelta(seconds=1),
+    "m": timedelta(minutes=1),
+    "h": timedelta(hours=1),
+    "d": timedelta(days=1),
+    "w": timedelta(weeks=1),
+    "mon": timedelta(days=30),
+    "y": timedelta(days=365),
+}
+"""
+Units supported by durations and relative times (e.g., `30d`), matching the ones used by
+Plex.
+"""
+
+
+def parse_duration(value):
+    """
+    Parse a duration given as an amount and a unit (e.g., `30m`, `6h`, `1d`). Raises
+    `ValueError` if the value is not in this format.
+    """
+    match = re.fullmatch(r"(\d+)(s|m|h|d|w|mon|y)", value.strip())
+
+    if not match:
+        raise ValueError(f"Invalid duration: {value}")
+
+    amount, unit = match.groups()
+
+    return int(amount) * _RELATIVE_TIME_UNITS[unit]
+
+
+def parse_since(value):
+    """
+    Parse a point in time given either as a date (`YYYY-MM-DD`), a date and time
+    (`YYYY-MM-DDTHH:MM:SS`), or a time relative to now (e.g., `12h`, `30d`, `2w`).
+    Relative times are returned as the duration before now, resolved at the start of
+    each pass (see `Scope.resolve`). Raises `ValueError` if the value is not in any of
+    these formats.
+    """
+    try:
+        return parse_duration(value)
+    except ValueError:
+        return datetime.fromisoformat(value.strip())
+
+
+def _resolve_since(since, now):
+    """Resolve a point in time given as the duration before `now`."""
+    return now - since if isinstance(since, timedelta) else since
+
+
+def _describe_since(since):
+    """Describe a point in time, as the duration before now if it's relative."""
+    if not isinstance(since, timedelta):
+        return since
+
+    for unit in ("d", "h", "m", "s"):
+        if since % _RELATIVE_TIME_UNITS[unit] == timedelta(0):
+            return f"{since // _RELATIVE_TIME_UNITS[unit]}{unit} ago"
+
+    return f"{since} ago"
+
+
+SHARD_KEYS = ("path", "rating_key")
+"""
+Keys hashed to assign tracks to shards, which don't depend on the machine running the
+shard:
+- `path`: The path of the audio file, as known to Plex, so that all Plex items sharing
+  a file (from any library or server) belong to the same shard
+- `rating_key`: The rating key of the Plex item, only supported with a single server
+"""
+
+
+def parse_shard(value):
+    """
+    Parse a shard given as `i/N`, the 1-based index of the shard and the number of
+    shards. Raises `ValueError` if the value is not in this format.
+    """
+    match = re.fullmatch(r"(\d+)/(\d+)", value.strip())
+
+    if not match:
+        raise ValueError(f"Invalid shard: {value}")
+
+    index, count = map(int, match.groups())
+
+    if not 1 <= index <= count:
+        raise ValueError(f"Invalid shard: {value}")
+
+    return (index, count)
+
+
+def _split_path(path):
+    """Split a path into its components, regardless of the separator used."""
+    return [part for part in re.split(r"[\\/]+", path) if part]
+
+
+def _is_metadata_entry(folder):
+    """Check if a folder entry is a media item rather than an actual folder."""
+    return folder.key.startswith("/library/metadata")
+
+
+class Scope:
+    """
+    Selectors restricting a run to part of the configured libraries.
+
+    Selectors are combined with a logical AND. The artist, album and time selectors are
+    translated into a server-side Plex search, while the path prefix is resolved by
+    walking the library's folder hierarchy on the Plex server down to that subtree. The
+    shard, given as `(index, count)`, is applied locally to the selected tracks (see
+    `Shard`). The time selectors may be relative to now, given as a duration, and must
+    then be resolved before selecting tracks (see `resolve`).
+    """
+
+    def __init__(
+        self,
+        libraries=(),
+        artist=None,
+        album=None,
+        path_prefix=None,
+        added_since=None,
+        updated_since=None,
+        shard=None,
+    ):
+        self.libraries = tuple(libraries)
+        self.artist = artist
+        self.album = album
+        self.path_prefix = path_prefix
+        self.added_since = added_since
+        self.updated_since = updated_since
+        self.shard = shard
+
+    def is_narrowed(self):
+        """Check if tracks are selected within the libraries, not just libraries."""
+        return any(
+            selector is not None
+            for selector in (
+                self.artist,
+                self.album,
+                self.path_prefix,
+                self.added_since,
+                self.updated_since,
+            )
+        )
+
+    def describe(self):
+        """Return a short human readable description of the selectors."""
+        selectors = [
+            ("library", ", ".join(self.libraries) if self.libraries else None),
+            ("artist", self.artist),
+            ("album", self.album),
+            ("path prefix", self.path_prefix),
+            ("added since", _describe_since(self.added_since)),
+            ("updated since", _describe_since(self.updated_since)),
+            ("shard", "/".join(map(str, self.shard)) if self.shard else None),
+        ]
+
+        return ", ".join(
+            f"{name} **{value}**" for name, value in selectors if value is not None
+        )
+
+    def resolve(self):
+        """
+        Return a copy of the scope with its relative time selectors resolved against
+        now, so that each pass of the daemon selects the same period before its start.
+        """
+        now = datetime.now()
+
+        return Scope(
+            self.libraries,
+            self.artist,
+            self.album,
+            self.path_prefix,
+            _resolve_since(self.added_since, now),
+            _resolve_since(self.updated_since, now),
+            self.shard,
+        )
+
+    def _search_filters(self, include_updated_since=True):
+        """Build the Plex search filters for the track selectors."""
+        filters = {}
+
+        if self.artist is not None:
+            filters["artist.title="] = self.artist
+
+        if self.album is not None:
+            filters["album.title="] = self.album
+
+        if self.added_since is not None:
+            filters["track.addedAt>>"] = self.added_since
+
+        if self.updated_since is not None and include_updated_since:
+            filters["track.updatedAt>>"] = self.updated_since
+
+        return filters
+
+    def _matches(self, track):
+        """
+        Check if a track matches the track selectors. Only used for the tracks found
+        under the path prefix, which can't be combined with a server-side search.
+        """
+        if self.artist is not None and track.grandparentTitle != self.artist:
+            return False
+
+        if self.album is not None and track.parentTitle != self.album:
+            return False
+
+        if self.added_since is not None and (
+            track.addedAt is None or track.addedAt < self.added_since
+        ):
+            return False
+
+        if self.updated_since is not None and (
+            track.updatedAt is None or track.updatedAt < self.updated_since
+        ):
+            return False
+
+        return True
+
+    def _search_tracks(self, library):
+        """Search the library for the tracks matching the selectors, server-side."""
+        try:
+            return library.search(libtype="track", filters=self._search_filters())
+        except NotFound as e:
+            if self.updated_since is None:
+                raise
+
+            # Not every Plex server exposes the update date as a search filter
+            log_debug(f"Falling back to filtering the update date locally: {e}", 1)
+
+            tracks = library.search(
+                libtype="track",
+                filters=self._search_filters(include_updated_since=False),
+            )
+
+            return [
+                track
+                for track in tracks
+                if track.updatedAt is not None
+                and track.updatedAt >= self.updated_since
+            ]
+
+    def _find_prefix_folders(self, library):
+        """
+        Find the library folders matching the path prefix, by walking the folder
+        hierarchy of the library on the Plex server from the matching location.
+        """
+        prefix_parts = _split_path(self.path_prefix)
+        root_folders = None
+
+        for location in library.locations:
+            location_parts = _split_path(location)
+            common_length = min(len(location_parts), len(prefix_parts))
+
+            if location_parts[:common_length] != prefix_parts[:common_length]:
+                continue
+
+            if root_folders is None:
+                root_folders = library.folders()
+
+            # With multiple locations, the root lists the locations themselves
+            location_folder = next(
+                (
+                    folder
+                    for folder in root_folders
+                    if len(library.locations) > 1
+                    and folder.title in (location, location_parts[-1])
+                ),
+                None,
+            )
+
+            remaining_parts = prefix_parts[len(location_parts) :]
+
+            if not remaining_parts:
+                yield from [location_folder] if location_folder else root_folders
+                continue
+
+            folders = location_folder.subfolders() if location_folder else root_folders
+
+            for index, part in enumerate(remaining_parts):
+                folder = next(
+                    (
+                        folder
+                        for folder in folders
+                        if not _is_metadata_entry(folder) and folder.title == part
+                    ),
+                    None,
+                )
+
+                if folder is None:
+                    break
+
+                if index == len(remaining_parts) - 1:
+                    yield folder
+                else:
+                    folders = folder.subfolders()
+
+    def _walk_folders(self, library, folders):
+        """
+        Walk the given library folders depth-first, yielding the tracks stored in each
+        folder with a single request for all of them.
+        """
+        pending = list(reversed(folders))
+
+        while pending:
+            folder = pending.pop()
+
+            if _is_metadata_entry(folder):
+                yield [library.fetchItem(folder.key)]
+                continue
+
+            entries = folder.subfolders()
+
+            rating_keys = [
+                int(entry.key.rsplit("/", 1)[-1])
+                for entry in entries
+                if _is_metadata_entry(entry)
+            ]
+
+            if rating_keys:
+                yield library.fetchItems(rating_keys)
+
+            pending.extend(
+                reversed([entry for entry in entries if not _is_metadata_entry(entry)])
+            )
+
+    def iter_album_tracks(self, library):
+        """
+        Yield the tracks of a library matching the selectors, grouped by album in the
+        order they were returned by Plex.
+        """
+        if self.path_prefix is None:
+            tracks = self._search_tracks(library)
+        else:
+            folders = self._find_prefix_folders(library)
+
+            tracks = [
+                track
+                for folder_tracks in self._walk_folders(library, list(folders))
+                for track in folder_tracks
+                if track.type == "track" and self._matches(track)
+            ]
+
+        albums = {}
+
+        for track in tracks:
+            albums.setdefault(track.parentRatingKey, []).append(track)
+
+        yield from albums.values()
+
+
+class Shard:
+    """
+    One of `count` disjoint slices of the tracks, so that several machines can each
+    process their own slice at the same time, with no overlap and full coverage.
+
+    Tracks stored under a path prefix of the affinity map belong to the shard it's
+    mapped to (the longest prefix wins), so that each machine gets the files it can
+    reach quickly. Other tracks are assigned by a stable hash of their key, which
+    gives the same result on every machine and across runs.
+    """
+
+    def __init__(self, index, count, key="path", affinity=None):
+        self.index = index
+        self.count = count
+        self.key = key
+
+        self._affinity = sorted(
+            (
+                (_split_path(prefix), shard_index)
+                for prefix, shard_index in (affinity or {}).items()
+            ),
+            key=lambda entry: len(entry[0]),
+            reverse=True,
+        )
+
+    def __str__(self):
+        return f"{self.index}/{self.count}"
+
+    def _hash(self, value):
+        """Return the shard of a value, by a hash that is stable across processes."""
+        digest = sha1(str(value).encode("utf-8")).digest()
+
+        return int.from_bytes(digest[:8], "big") % self.count + 1
+
+    def get_index(self, file_path, rating_key):
+        """
+        Return the index of the shard a track belongs to, from its path and rating key
+        only, so that the files are not accessed to assign them.
+        """
+        path_parts = _split_path(str(file_path))
+
+        for prefix_parts, shard_index in self._affinity:
+            if path_parts[: len(prefix_parts)] == prefix_parts:
+                return shard_index
+
+        if self.key == "rating_key":
+            return self._hash(rating_key)
+
+        return self._hash("/".join(path_parts))
+
+    def contains(self, file_path, rating_key):
+        """Check if a track belongs to this shard (see `get_index`)."""
+        return self.get_index(file_path, rating_key) == self.index
@@ -0,0 +1,93 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from plexapi.server import PlexServer
+
+from plex_music_ratings_sync.concurrency import AdaptiveLimiter, RateLimiter
+from plex_music_ratings_sync.logger import log_error, log_info
+from plex_music_ratings_sync.session import PlexSession
+
+
+class PlexConnection:
+    """
+    A configured Plex server, with its own HTTP session and adaptive limiter so that
+    each server is throttled according to its own latency. In gentle mode, requests
+    are also capped to a number per second, for each server. With a watchdog, requests
+    are abandoned past their deadline.
+    """
+
+    def __init__(
+        self,
+        server_config,
+        limiter_config,
+        named_limiter=False,
+        requests_per_second=None,
+        watchdog=None,
+    ):
+        self.name = server_config["name"]
+        self.url = server_config["url"]
+        self.token = server_config["token"]
+        self.libraries = server_config["libraries"]
+
+        limiter_name = (
+            f"Plex requests ({self.name})" if named_limiter else "Plex requests"
+        )
+
+        self.limiter = AdaptiveLimiter(
+            limiter_name,
+            limiter_config["min"],
+            limiter_config["max"],
+            limiter_config["target_latency"],
+        )
+        self.rate_limiter = None
+
+        if requests_per_second is not None:
+            self.rate_limiter = RateLimiter(
+                limiter_name, requests_per_second, unit="requests"
+            )
+
+        self.session = PlexSession(self.limiter, self.rate_limiter, watchdog)
+        self.plex = None
+
+    def connect(self):
+        """Connect to the Plex server."""
+        log_info(f"Connecting to Plex server: **{self.url}**")
+
+        self.plex = PlexServer(self.url, self.token, session=self.session)
+
+        log_info(f"Connected to Plex server: **{self.plex.friendlyName}**")
+
+        return self
+
+
+def connect_servers(
+    servers_config, limiter_config, requests_per_second=None, watchdog=None
+):
+    """
+    Connect to all configured Plex servers concurrently. Exits if any of them can't be
+    reached. Returns the connections in the configured order.
+    """
+    connections = [
+        PlexConnection(
+            server_config,
+            limiter_config,
+            named_limiter=len(servers_config) > 1,
+            requests_per_second=requests_per_second,
+            watchdog=watchdog,
+        )
+        for server_config in servers_config
+    ]
+
+    with ThreadPoolExecutor(max_workers=len(connections)) as executor:
+        futures = [executor.submit(connection.connect) for connection in connections]
+
+        for connection, future in zip(connections, futures):
+            try:
+                future.result()
+            except Exception as e:
+                log_error(
+                    f"Failed to connect to Plex server **{connection.name}**: {e}"
+                )
+                sys.exit(1)
+
+    return connections
@@ -0,0 +1,79 @@
+import re
+import threading
+from collections import Counter
+from urllib.parse import urlsplit
+
+import requests
+
+from plex_music_ratings_sync.watchdog import OperationTimeout
+
+
+def _get_endpoint(method, url):
+    """
+    Return the endpoint of a request, with the numeric identifiers in its path
+    replaced by a placeholder so that requests for different items are grouped.
+    """
+    path = re.sub(r"/\d+(?:,\d+)*(?=/|$)", "/{id}", urlsplit(url).path)
+
+    return f"{method.upper()} {path}"
+
+
+class PlexSession(requests.Session):
+    """
+    HTTP session shared by every request made to the Plex server.
+
+    Requests are throttled by an adaptive limiter so that the number of concurrent
+    requests follows the latency of the server. Server errors and rate limiting
+    responses are reported to the limiter as failures so that it backs off.
+
+    Every request is also counted by endpoint, to expose the number of requests a run
+    actually makes, including those made implicitly by `plexapi`.
+
+    With a rate limiter (in gentle mode), requests are additionally capped to a number
+    per second, waiting for their turn before taking a slot of the adaptive limiter.
+
+    With a watchdog, requests exceeding their deadline are abandoned and raise an
+    `OperationTimeout`, counting as failures for the limiter. An abandoned request
+    still holds a slot of the limiter until it completes, if ever.
+    """
+
+    def __init__(self, limiter, rate_limiter=None, watchdog=None):
+        super().__init__()
+        self.limiter = limiter
+        self.rate_limiter = rate_limiter
+        self.watchdog = watchdog
+        self.request_counts = Counter()
+        self._counts_lock = threading.Lock()
+
+    def request(self, method, url, *args, **kwargs):
+        """Send a request within a slot of the Plex limiter."""
+        with self._counts_lock:
+            self.request_counts[_get_endpoint(method, url)] += 1
+
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+
+        send = super().request
+
+        with self.limiter.slot() as fail:
+            if self.watchdog is None:
+                response = send(method, url, *args, **kwargs)
+            else:
+                try:
+                    response = self.watchdog.call(
+                        "plex_request", send, method, url, *args, **kwargs
+                    )
+                except OperationTimeout as e:
+                    # The abandoned request keeps a slot until it completes
+                    e.add_done_callback(self.limiter.hold())
+                    raise
+
+            if response.status_code == 429 or response.status_code >= 500:
+                fail()
+
+            return response
+
+    def snapshot_request_counts(self):
+        """Return a copy of the request counts, to compute the requests of a run."""
+        with self._counts_lock:
+            return Counter(self.request_counts)
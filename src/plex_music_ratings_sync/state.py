@@ -1,4 +1,4 @@
-_state = {"dry_run": False}
+_state = {"dry_run": False, "lock_timeout": 0, "gentle": False}
 """Global state for the application."""
 
 
@@ -10,3 +10,23 @@ def is_dry_run():
 def set_dry_run(enabled):
     """Enable or disabled the dry-run mode."""
     _state["dry_run"] = enabled
+
+
+def get_lock_timeout():
+    """Get the number of seconds to wait for locks held by other instances."""
+    return _state["lock_timeout"]
+
+
+def set_lock_timeout(seconds):
+    """Set the number of seconds to wait for locks held by other instances."""
+    _state["lock_timeout"] = seconds
+
+
+def is_gentle():
+    """Check if application is running in gentle mode."""
+    return _state["gentle"]
+
+
+def set_gentle(enabled):
+    """Enable or disable the gentle mode."""
+    _state["gentle"] = enabled
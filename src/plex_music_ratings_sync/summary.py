@@ -0,0 +1,90 @@
+import json
+
+from plex_music_ratings_sync.scope import parse_shard
+
+
+def write_run_summary(summary_file_path, run_summary):
+    """Write the summary of a run to a JSON file."""
+    with open(summary_file_path, "w", encoding="utf-8") as summary_file:
+        json.dump(run_summary, summary_file, indent=2)
+
+
+def read_run_summary(summary_file_path):
+    """Read the summary of a run from a JSON file."""
+    with open(summary_file_path, "r", encoding="utf-8") as summary_file:
+        return json.load(summary_file)
+
+
+def _merge_values(merged_value, value):
+    """Sum two counters, or two mappings of counters key by key."""
+    if isinstance(merged_value, dict):
+        return {
+            key: _merge_values(merged_value.get(key, 0), value.get(key, 0))
+            for key in {**merged_value, **value}
+        }
+
+    return merged_value + value
+
+
+def merge_run_summaries(run_summaries):
+    """
+    Merge the summaries of runs on different shards into the summary of the whole run.
+    Counters are summed, while the runs are assumed to have happened in parallel: the
+    merged run starts with the earliest one and lasts as long as the longest one.
+
+    The merged summary lists the shards it covers, along with the missing ones and
+    those merged more than once. Raises `ValueError` if the runs are not shards of the
+    same run (different modes or numbers of shards).
+    """
+    modes = {run_summary["mode"] for run_summary in run_summaries}
+    shards = [
+        parse_shard(run_summary["shard"])
+        for run_summary in run_summaries
+        if run_summary.get("shard")
+    ]
+    shard_counts = {count for _, count in shards}
+
+    if len(modes) != 1:
+        raise ValueError(f"Runs of different modes: {', '.join(sorted(modes))}")
+
+    if len(shard_counts) > 1 or (shards and len(shards) != len(run_summaries)):
+        raise ValueError("Runs split into different numbers of shards")
+
+    merged_summary = {
+        "mode": modes.pop(),
+        "libraries": sorted(
+            {
+                library
+                for run_summary in run_summaries
+                for library in run_summary.get("libraries", [])
+            }
+        ),
+        "started_at": min(run_summary["started_at"] for run_summary in run_summaries),
+        "duration": max(run_summary["duration"] for run_summary in run_summaries),
+    }
+
+    if shards:
+        count = shard_counts.pop()
+        indices = [index for index, _ in shards]
+
+        merged_summary["shards"] = count
+        merged_summary["missing_shards"] = sorted(
+            set(range(1, count + 1)) - set(indices)
+        )
+        merged_summary["duplicate_shards"] = sorted(
+            {index for index in indices if indices.count(index) > 1}
+        )
+
+    counters = {}
+
+    for run_summary in run_summaries:
+        for key, value in run_summary.items():
+            if key in merged_summary or key == "shard":
+                continue
+
+            if key in counters:
+                counters[key] = _merge_values(counters[key], value)
+            else:
+                counters[key] = value
+
+    return {**merged_summary, **counters}
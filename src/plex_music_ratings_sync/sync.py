@@ -1,152 +1,1634 @@
+import logging
+import os
 import sys
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
 
-from plexapi.server import PlexServer
+from plexapi.exceptions import NotFound
 
-from plex_music_ratings_sync.config import get_plex_config
-from plex_music_ratings_sync.logger import log_debug, log_error, log_info, log_warning
+from plex_music_ratings_sync.agent import AgentClient
+from plex_music_ratings_sync.concurrency import AdaptiveLimiter, RateLimiter
+from plex_music_ratings_sync.config import (
+    get_agent_config,
+    get_concurrency_config,
+    get_deadlines_config,
+    get_gentle_config,
+    get_io_config,
+    get_locks_config,
+    get_plex_config,
+    get_retry_config,
+    get_sharding_config,
+    get_storage_config,
+)
+from plex_music_ratings_sync.lock import LibraryLocks, get_lock_targets
+from plex_music_ratings_sync.logger import (
+    capture_logs,
+    close_log_file,
+    is_verbose,
+    log_debug,
+    log_error,
+    log_info,
+    log_warning,
+    open_log_file,
+    replay_logs,
+)
+from plex_music_ratings_sync.ordering import order_by_locality, readahead_header
+from plex_music_ratings_sync.pipeline import prefetch
+from plex_music_ratings_sync.progress import OUTCOMES, ProgressReporter
 from plex_music_ratings_sync.ratings import (
-    get_rating_from_file,
+    create_rating_storage,
     get_rating_from_plex,
-    set_rating_to_file,
+    is_format_error,
     set_rating_to_plex,
 )
-from plex_music_ratings_sync.state import is_dry_run
+from plex_music_ratings_sync.registry import (
+    UnreadableFiles,
+    VisitedFiles,
+    stat_file,
+)
+from plex_music_ratings_sync.resources import get_thread_io_bytes, lower_priority
+from plex_music_ratings_sync.retry import (
+    RetryQueue,
+    describe_operation,
+    file_operation,
+    is_superseded,
+    plex_operation,
+)
+from plex_music_ratings_sync.scope import Scope, Shard
+from plex_music_ratings_sync.servers import connect_servers
+from plex_music_ratings_sync.state import get_lock_timeout, is_dry_run, is_gentle
 from plex_music_ratings_sync.util.datetime import format_time
+from plex_music_ratings_sync.util.paths import get_log_file_path
+from plex_music_ratings_sync.watchdog import (
+    OperationPending,
+    OperationTimeout,
+    Watchdog,
+)
 
 _SUPPORTED_EXTENSIONS = (".flac", ".m4a", ".mp3", ".ogg", ".opus")
 """Audio file extensions that are supported for rating synchronization."""
 
+_ESTIMATED_READ_BYTES = 64 * 1024
+"""
+Number of bytes assumed to be read to get the rating of an audio file, in gentle mode
+on platforms that don't account for the bytes actually read by each thread.
+"""
+
+
+def _get_track_path(track):
+    """Return the path of the audio file for a Plex track."""
+    return Path(track.media[0].parts[0].file)
+
+
+def _disable_auto_reload(plex_objects):
+    """
+    Prevent `plexapi` from silently reloading objects when accessing attributes missing
+    from the listing they come from (e.g., `userRating` of unrated tracks), which costs
+    an extra request per object. Returns the same objects.
+    """
+    for plex_object in plex_objects:
+        plex_object._autoReload = False
+
+    return plex_objects
+
 
 class RatingSync:
-    def __init__(self):
-        plex_config = get_plex_config()
+    def __init__(self, scope=None, file_cache=None):
+        servers_config = get_plex_config()
+        concurrency_config = get_concurrency_config()
+        agent_config = get_agent_config()
+        gentle_config = get_gentle_config() if is_gentle() else None
+
+        if gentle_config is not None:
+            log_info("Running in gentle mode (resource usage is capped)")
+
+            # Before any worker thread is created, so that they all inherit them
+            lower_priority(gentle_config["niceness"], gentle_config["io_priority"])
+
+        self.file_limiter = AdaptiveLimiter(
+            "File operations",
+            concurrency_config["files"]["min"],
+            concurrency_config["files"]["max"],
+            concurrency_config["files"]["target_latency"],
+        )
+
+        # Files accessed through an agent are read and written on the storage host
+        self.file_rate_limiter = None
+
+        if (
+            gentle_config is not None
+            and gentle_config["file_bytes_per_second"] is not None
+            and agent_config is None
+        ):
+            self.file_rate_limiter = RateLimiter(
+                "File I/O", gentle_config["file_bytes_per_second"], unit="bytes"
+            )
+
+        self.watchdog = Watchdog(get_deadlines_config())
+        self._stop_requested = threading.Event()
+
+        # Abandoned writes keep running, possibly past the end of the pass
+        self._abandoned_writes = set()
+        self._abandoned_writes_lock = threading.Lock()
+
+        self.connections = connect_servers(
+            servers_config,
+            concurrency_config["plex"],
+            requests_per_second=(
+                gentle_config["plex_requests_per_second"] if gentle_config else None
+            ),
+            watchdog=self.watchdog,
+        )
+        self.primary = self.connections[0]
+        self.plex = self.primary.plex
+
+        self._connections_by_server = {
+            id(connection.plex): connection for connection in self.connections
+        }
+
+        self.scope = scope or Scope()
+        self._pass_scope = self.scope.resolve()
+        self.io_config = get_io_config()
+        self.locks_config = get_locks_config()
+        self.retry_config = get_retry_config()
+        self.verbose = is_verbose()
+
+        self.agent = None
+        self._batch_files = {}
+        self._agent_ratings = {}
+        self._agent_writes = {}
+
+        # Files accessed through an agent are not stat'ed locally, so can't be cached
+        self.file_cache = file_cache if agent_config is None else None
+
+        # A file agent stores the ratings according to its own configuration
+        self.storage = None
+        self.unreadable_files = None
+
+        if agent_config is None:
+            self.storage = create_rating_storage(get_storage_config())
+            self.unreadable_files = UnreadableFiles(self.storage.get_signature)
+        else:
+            self.agent = AgentClient(
+                agent_config["url"], agent_config["token"], agent_config["timeout"]
+            )
 
+            log_info(f"Accessing audio files through file agent: **{self.agent.url}**")
+
+        if self.scope.libraries:
+            unknown_libraries = set(self.scope.libraries) - {
+                library
+                for connection in self.connections
+                for library in connection.libraries
+            }
+
+            if unknown_libraries:
+                log_error(
+                    "Libraries not found in the configuration: "
+                    f"**{', '.join(sorted(unknown_libraries))}**"
+                )
+                sys.exit(1)
+
+            for connection in self.connections:
+                connection.libraries = [
+                    library
+                    for library in connection.libraries
+                    if library in self.scope.libraries
+                ]
+
+        self.libraries = sorted(
+            {
+                library
+                for connection in self.connections
+                for library in connection.libraries
+            }
+        )
+
+        self.shard = None
+
+        if self.scope.shard is not None:
+            self.shard = self._create_shard(*self.scope.shard)
+
+        if self.scope.libraries or self.scope.is_narrowed() or self.shard:
+            log_info(f"Running scoped to: {self.scope.describe()}")
+
+        if is_dry_run():
+            log_warning("Running in dry-run mode (no changes will be made)")
+
+    def request_stop(self):
+        """
+        Stop the current run, and any later one, before its next batch. The tracks of
+        the batch being processed are completed, and the failed writes are persisted
+        for the next run without being retried.
+        """
+        self._stop_requested.set()
+
+    def _create_shard(self, index, count):
+        """Create the shard of the tracks processed by this run, as configured."""
+        sharding_config = get_sharding_config()
+
+        if any(
+            shard_index > count for shard_index in sharding_config["affinity"].values()
+        ):
+            log_error(
+                f"The sharding affinity map refers to shards beyond shard **{count}**"
+            )
+            sys.exit(1)
+
+        # Plex items of different servers sharing a file have different rating keys
+        if sharding_config["key"] == "rating_key" and len(self.connections) > 1:
+            log_error("Sharding by rating key is not supported with multiple servers")
+            sys.exit(1)
+
+        return Shard(index, count, sharding_config["key"], sharding_config["affinity"])
+
+    def _select_shard(self, tracks):
+        """Return the tracks belonging to the shard of this run, if any."""
+        if self.shard is None:
+            return tracks
+
+        return [
+            track
+            for track in tracks
+            if self.shard.contains(_get_track_path(track), track.ratingKey)
+        ]
+
+    def _keeps_plex_order(self):
+        """Check if file operations are processed in the order returned by Plex."""
+        return self.io_config["ordering"] == "plex"
+
+    def _shows_headers(self):
+        """
+        Check if the artist/album headers are shown, which is only the case in verbose
+        mode when tracks are processed in the order returned by Plex. Otherwise, only
+        tracks with changes, warnings or errors are shown, along with the progress.
+        """
+        return self.verbose and self._keeps_plex_order()
+
+    def _stat_local_file(self, path):
+        """
+        Check the existence of a local file and build its key (see `stat_file`). The
+        existence of a file whose stat was abandoned is unknown (`None`), and its path
+        stands for its key.
+        """
         try:
-            log_info(f"Connecting to Plex server: **{plex_config['url']}**")
+            return self.watchdog.call("file_stat", stat_file, path)
+        except OperationTimeout:
+            return None, ("path", str(path))
+
+    def _stat_files(self, file_paths, executor=None):
+        """
+        Check the existence of files and build their keys, through the file agent if
+        any with a request per batch of files. Local files are stat'ed concurrently
+        through `executor` if given, hiding the latency of network file systems. Returns
+        both, keyed by path. Exits if the agent can't be reached, since no file could be
+        processed.
+        """
+        paths = sorted({str(file_path) for file_path in file_paths})
+
+        if self.agent is None:
+            if executor is None:
+                return {path: self._stat_local_file(path) for path in paths}
 
-            self.plex = PlexServer(plex_config["url"], plex_config["token"])
+            return dict(zip(paths, executor.map(self._stat_local_file, paths)))
 
-            log_info(f"Connected to Plex server: **{self.plex.friendlyName}**")
+        batch_size = self.io_config["batch_size"]
+
+        agent_files = {}
+
+        try:
+            for index in range(0, len(paths), batch_size):
+                agent_files.update(self.agent.stat(paths[index : index + batch_size]))
         except Exception as e:
-            log_error(f"Failed to connect to Plex server: {e}")
+            log_error(f"Failed to reach the file agent: {e}")
             sys.exit(1)
 
-        self.libraries = plex_config["libraries"]
+        return agent_files
+
+    def _file_exists(self, file_path):
+        """
+        Check if an audio file exists, as stat'ed for the current batch. Raises
+        `OperationTimeout` if its stat was abandoned.
+        """
+        exists = self._batch_files[str(file_path)][0]
+
+        if exists is None:
+            raise OperationTimeout("file_stat", self.watchdog.deadlines["file_stat"])
+
+        return exists
+
+    def _get_file_key(self, file_path):
+        """Return the key of an audio file, as built for the current batch."""
+        return self._batch_files[str(file_path)][1]
+
+    def _estimate_io_bytes(self, file_path, writing):
+        """
+        Estimate the number of bytes read or written by a file operation. Writing tags
+        may rewrite the whole file, while reading them only reads its first bytes.
+        """
+        if not writing:
+            return _ESTIMATED_READ_BYTES
 
         if is_dry_run():
-            log_warning("Running in dry-run mode (no changes will be made)")
+            return 0
+
+        try:
+            return os.path.getsize(file_path)
+        except OSError:
+            return 0
+
+    @contextmanager
+    def _file_slot(self):
+        """
+        Run a file operation within a slot of the file limiter. In gentle mode, the
+        operation first waits for the file I/O budget to allow it.
+        """
+        if self.file_rate_limiter is not None:
+            self.file_rate_limiter.acquire(0)
+
+        with self.file_limiter.slot() as fail:
+            yield fail
 
-    def _process_item(self, item, mode="sync"):
+    def _call_file_operation(self, kind, file_path, function, *args):
         """
-        Process a single track with the specified mode:
+        Call a local file operation with the deadline of its `kind`, raising
+        `OperationTimeout` if it's abandoned. An abandoned operation keeps holding a
+        slot of the file limiter until it completes, so that hung operations can't pile
+        up. In gentle mode, the operation is charged to the file I/O budget (see
+        `_charge_file_operation`).
+
+        Until an abandoned write completes, the file is neither read nor written again,
+        which could race with it or see it half-written: those operations raise
+        `OperationPending` instead, so that deferred writes are retried later on.
+        """
+        with self._abandoned_writes_lock:
+            if str(file_path) in self._abandoned_writes:
+                raise OperationPending(kind, self.watchdog.deadlines["file_write"])
+
+        if self.file_rate_limiter is not None:
+            function = self._charge_file_operation(kind, file_path, function)
+
+        try:
+            return self.watchdog.call(kind, function, *args)
+        except OperationTimeout as e:
+            e.add_done_callback(self.file_limiter.hold())
+
+            if kind == "file_write":
+                self._track_abandoned_write(file_path, e)
+
+            raise
+
+    def _track_abandoned_write(self, file_path, timeout):
+        """Keep track of an abandoned write to a file until it completes."""
+        with self._abandoned_writes_lock:
+            self._abandoned_writes.add(str(file_path))
+
+        def forget_abandoned_write():
+            with self._abandoned_writes_lock:
+                self._abandoned_writes.discard(str(file_path))
+
+        timeout.add_done_callback(forget_abandoned_write)
+
+    def _charge_file_operation(self, kind, file_path, function):
+        """
+        Wrap a local file operation so that it's charged with the bytes it read and
+        wrote, and the next operations wait longer after large ones. The bytes are
+        counted by the thread running the operation, even once abandoned.
+        """
+
+        def charged_function(*args):
+            io_bytes = get_thread_io_bytes()
+
+            try:
+                return function(*args)
+            finally:
+                if io_bytes is None:
+                    cost = self._estimate_io_bytes(file_path, kind == "file_write")
+                else:
+                    cost = get_thread_io_bytes() - io_bytes
+
+                self.file_rate_limiter.charge(cost)
+
+        return charged_function
+
+    def _read_local_file_rating(self, file_path):
+        """
+        Read the rating from a local audio file. With a file cache, the rating read or
+        written by a previous run is reused instead while the file is unchanged. Files
+        whose content can't be parsed are registered as unreadable, so that the next
+        runs skip them until they change. Failures to access a file or the rating
+        storage are only logged, the file being read again by the next run.
+        """
+        signature = self.storage.get_signature(file_path)
+
+        if self.file_cache is not None:
+            cached, rating = self.file_cache.lookup(file_path, signature)
+
+            if cached:
+                log_debug(
+                    f"▸ File unchanged since the last run, rating: **{rating}**", 4
+                )
+                return rating
+
+        errors = []
+
+        with capture_logs() as records:
+            rating = self.storage.get_rating(str(file_path), errors)
+
+        replay_logs(records)
+
+        messages = [message for level, message, _ in records if level >= logging.ERROR]
+
+        if any(map(is_format_error, errors)):
+            self.unreadable_files.record(file_path, signature, messages[0].lstrip("▪ "))
+
+        # A failed read isn't cached, so the file is read again on the next run
+        if messages:
+            return rating
+
+        self.unreadable_files.discard(file_path)
+
+        if self.file_cache is not None:
+            self.file_cache.store(file_path, signature, rating)
+
+        return rating
+
+    def _read_file_rating(self, file_path):
+        """
+        Read the rating from an audio file within a slot of the file limiter. With a
+        file agent, the rating prefetched for the batch is used if available. Raises
+        `OperationTimeout` if a local read is abandoned.
+        """
+        with self._file_slot() as fail:
+            if self.agent is None:
+                return self._call_file_operation(
+                    "file_read", file_path, self._read_local_file_rating, file_path
+                )
+
+            agent_rating = self._agent_ratings.pop(str(file_path), None)
+
+            if agent_rating is None:
+                try:
+                    agent_rating = self.agent.read_ratings([str(file_path)])[
+                        str(file_path)
+                    ]
+                except Exception as e:
+                    fail()
+                    log_error(
+                        f"▪ Failed to read rating through the file agent: {e}", 4
+                    )
+                    return None
+
+            rating, records = agent_rating
+            replay_logs(records)
+
+            return rating
+
+    def _write_file_rating(self, file_path, rating, operation=None):
+        """
+        Write the rating to an audio file within a slot of the file limiter, through
+        the file agent if any. Returns whether the rating was written. Raises
+        `OperationTimeout` if a local write is abandoned.
+
+        With a file agent, the write of an `operation` is queued and sent along with
+        the other writes of the batch (see `_flush_agent_writes`), counting as written
+        until then.
+        """
+        if operation is not None and self.agent is not None and not is_dry_run():
+            self._agent_writes[str(file_path)] = operation
+            log_debug("▸ Queued writing the file rating through the file agent", 4)
+            return True
+
+        with self._file_slot() as fail:
+            # Dry runs never touch the file, so there's no need to involve the agent
+            if self.agent is None:
+                written = self._call_file_operation(
+                    "file_write",
+                    file_path,
+                    self.storage.set_rating,
+                    str(file_path),
+                    rating,
+                )
+            elif is_dry_run():
+                written = True
+
+                log_info(
+                    "▸ [dry-run] Would have rated file through the file agent: "
+                    f"**{rating}**",
+                    4,
+                )
+            else:
+                try:
+                    written, records = self.agent.write_ratings(
+                        {str(file_path): rating}
+                    )[str(file_path)]
+                    replay_logs(records)
+                except Exception as e:
+                    log_error(
+                        f"▪ Failed to write rating through the file agent: {e}", 4
+                    )
+                    written = False
+
+            if not written:
+                fail()
+
+            if self.file_cache is not None and not is_dry_run():
+                if written:
+                    signature = self.watchdog.call(
+                        "file_stat", self.storage.get_signature, file_path
+                    )
+
+                    self.file_cache.store(file_path, signature, rating)
+                else:
+                    self.file_cache.discard(file_path)
+
+            return written
+
+    def _prefetch_agent_ratings(self, file_groups):
+        """
+        Read the ratings of the files of a batch through the file agent in a single
+        request, skipping the files that won't be read. Files whose rating couldn't be
+        prefetched are read individually instead.
+        """
+        file_paths = []
+
+        for file_key, items in file_groups.items():
+            file_path = _get_track_path(items[0])
+
+            if (
+                self._file_exists(file_path)
+                and file_path.suffix.lower() in _SUPPORTED_EXTENSIONS
+                and not self.visited_files.lookup(file_key)[0]
+            ):
+                file_paths.append(str(file_path))
+
+        if not file_paths:
+            return
+
+        try:
+            self._agent_ratings = self.agent.read_ratings(file_paths)
+        except Exception as e:
+            log_debug(f"Failed to prefetch ratings through the file agent: {e}", 2)
+            self._agent_ratings = {}
+
+    def _flush_agent_writes(self):
+        """
+        Send the writes queued for a batch to the file agent in a single request.
+        Failed writes are deferred to the retry queue. Returns whether each file was
+        written, and the log messages of the write, keyed by path.
+        """
+        operations = self._agent_writes
+        self._agent_writes = {}
+
+        if not operations:
+            return {}
+
+        ratings = {path: operation["rating"] for path, operation in operations.items()}
+
+        with self._file_slot() as fail:
+            try:
+                results = self.agent.write_ratings(ratings)
+            except Exception as e:
+                fail()
+                log_error(f"Failed to write ratings through the file agent: {e}", 2)
+                results = {}
+
+        writes = {}
+
+        for path, operation in operations.items():
+            written, records = results.get(path, (False, []))
+
+            if not written:
+                self.retry_queue.push(operation)
+
+            writes[path] = (written, records)
+
+        return writes
+
+    def _get_connection(self, item):
+        """Return the connection to the Plex server a Plex item comes from."""
+        return self._connections_by_server.get(id(item._server), self.primary)
+
+    def _resolve_plex_rating(self, items, file_rating):
+        """
+        Read the ratings of the Plex items sharing a file, possibly from several Plex
+        servers. When they have conflicting ratings, a rating that differs from the
+        file wins, being a change made since the last synchronization. Otherwise, the
+        rating from the first configured server and the oldest item (lowest rating key)
+        wins, so that the outcome is the same on every run. Returns the resolved rating
+        and the rating of each item.
+        """
+        item_ratings = [get_rating_from_plex(item) for item in items]
+
+        server_ranks = {
+            id(connection): rank for rank, connection in enumerate(self.connections)
+        }
+
+        rated_items = sorted(
+            (
+                rating == file_rating,
+                server_ranks[id(self._get_connection(item))],
+                item.ratingKey,
+                rating,
+            )
+            for item, rating in zip(items, item_ratings)
+            if rating is not None
+        )
+
+        if not rated_items:
+            return None, item_ratings
+
+        plex_rating = rated_items[0][-1]
+
+        if len({rated_item[-1] for rated_item in rated_items}) > 1:
+            self.visited_files.report_conflict()
+
+            conflicting_ratings = ", ".join(
+                str(rated_item[-1]) for rated_item in rated_items
+            )
+
+            log_warning(
+                "▪ Plex items sharing this file have conflicting ratings "
+                f"({conflicting_ratings}), using **{plex_rating}**",
+                4,
+            )
+
+        return plex_rating, item_ratings
+
+    def _process_item(self, items, library_name, mode="sync", revisited=0):
+        """
+        Process the Plex tracks sharing a single audio file with the specified mode:
         - `sync`: Bidirectional sync between Plex and files
         - `import`: One-way import from audio files to Plex
         - `export`: One-way export from Plex to audio files
+
+        Each file is read and written at most once per run. When the file was already
+        processed for another Plex item, the rating it ended up with is reused and
+        these items are reconciled against it instead, unless `revisited` is the number
+        of leading items processed before the tracks of the other Plex servers sharing
+        the file were indexed: the file is then reconciled again as a whole, from that
+        rating, and may be written again. Failed writes are deferred to the retry
+        queue. Returns the processing outcome (see `progress.OUTCOMES`).
         """
         item_start_time = datetime.now()
 
-        file_path = Path(item.media[0].parts[0].file)
+        item = items[0]
+
+        file_path = _get_track_path(item)
 
         track_index = item.index if item.index is not None else 0
 
+        # Without the artist/album headers, the full path gives the track its context
+        file_display = file_path.name if self._shows_headers() else file_path
+
         log_info(
-            f"Track: **{track_index:02d}. {item.title}** __({file_path.name})__",
+            f"Track: **{track_index:02d}. {item.title}** __({file_display})__",
             3,
         )
 
-        if not file_path.exists():
+        if len(items) > 1:
+            log_debug(f"▸ File shared by **{len(items)}** Plex items", 4)
+
+        if not self._file_exists(file_path):
             log_warning("▸ File not found on disk", 4)
-            return
+            return "skipped"
 
         if file_path.suffix.lower() not in _SUPPORTED_EXTENSIONS:
             log_warning("▸ Skipping unsupported file type", 4)
-            return
+            return "skipped"
 
-        plex_rating = get_rating_from_plex(item)
-        file_rating = get_rating_from_file(str(file_path))
+        if self.unreadable_files is not None:
+            unreadable = self.watchdog.call(
+                "file_stat", self.unreadable_files.lookup, file_path
+            )
+
+            if unreadable is not None:
+                log_debug(
+                    "▸ Skipping file that couldn't be read since "
+                    f"**{unreadable['since']}**: {unreadable['error']}",
+                    4,
+                )
+                return "unreadable"
+
+        changed = False
+
+        file_key = self._get_file_key(file_path)
+        visited, visited_rating = self.visited_files.lookup(file_key)
+
+        # Revisited files are reconciled against the rating they ended up with too, so
+        # each file is only read once per run
+        if visited:
+            file_rating = visited_rating
+
+            if not revisited:
+                log_debug("▸ File already processed in this run", 4)
+        else:
+            file_rating = self._read_file_rating(file_path)
+
+        plex_rating, item_ratings = self._resolve_plex_rating(items, file_rating)
+
+        # A file rated earlier in this run keeps that rating, otherwise duplicate items
+        # with different ratings would overwrite each other's on every run. Revisited
+        # files are reconciled again, now against the items of every server.
+        file_writable = not visited or revisited or file_rating is None
+
+        new_file_rating = None
+        new_plex_rating = None
 
         if mode == "import" and file_rating is not None:
-            if plex_rating != file_rating:
-                set_rating_to_plex(item, file_rating)
-            else:
-                log_debug("▸ Plex rating already matches file", 4)
+            new_plex_rating = file_rating
         elif mode == "export" and plex_rating is not None:
             if file_rating != plex_rating:
-                set_rating_to_file(str(file_path), plex_rating)
+                new_file_rating = plex_rating
             else:
                 log_debug("▸ File rating already matches Plex", 4)
         elif mode == "sync":
             if plex_rating != file_rating:
                 if plex_rating is not None:
-                    set_rating_to_file(str(file_path), plex_rating)
+                    new_file_rating = plex_rating
                 elif file_rating is not None:
-                    set_rating_to_plex(item, file_rating)
+                    new_plex_rating = file_rating
             else:
                 log_debug("▸ Ratings are already in sync", 4)
 
+        if new_file_rating is not None and not file_writable:
+            self.visited_files.report_conflict()
+
+            log_warning(
+                f"▪ File was already rated **{file_rating}** earlier in this run, "
+                "keeping its rating",
+                4,
+            )
+
+            new_file_rating = None
+
+            if mode == "sync":
+                new_plex_rating = file_rating
+
+        if new_file_rating is not None:
+            operation = file_operation(
+                library_name, file_path, new_file_rating, file_rating
+            )
+
+            try:
+                written = self._write_file_rating(
+                    file_path, new_file_rating, operation
+                )
+            except OperationTimeout:
+                # The abandoned write may never complete, so it's retried later on
+                self.retry_queue.push(operation)
+                raise
+
+            if written:
+                self.retry_queue.discard(operation)
+                changed = True
+            else:
+                self.retry_queue.push(operation)
+                log_debug("▸ Deferred writing the file rating", 4)
+
+            # Pending writes count as done, so Plex isn't reverted to the old rating
+            file_rating = new_file_rating
+
+        # Bring duplicate Plex items in line with the file so they stop diverging. After
+        # a file write, that's the rating written or deferred, never the one it replaced
+        if mode == "sync" and file_rating is not None:
+            new_plex_rating = file_rating
+
+        if new_plex_rating is not None:
+            outdated_items = [
+                (item, rating)
+                for item, rating in zip(items, item_ratings)
+                if rating != new_plex_rating
+            ]
+
+            for outdated_item, rating in outdated_items:
+                operation = plex_operation(
+                    library_name,
+                    self._get_connection(outdated_item).name,
+                    outdated_item.ratingKey,
+                    new_plex_rating,
+                    rating,
+                )
+
+                if set_rating_to_plex(outdated_item, new_plex_rating):
+                    self.retry_queue.discard(operation)
+                    changed = True
+                else:
+                    self.retry_queue.push(operation)
+                    log_debug("▸ Deferred writing the Plex rating", 4)
+
+            if mode == "import" and not outdated_items:
+                log_debug("▸ Plex rating already matches file", 4)
+
+        self.visited_files.record(
+            file_key, file_rating, occurrences=len(items) - revisited
+        )
+
         item_elapsed_time = datetime.now() - item_start_time
 
         log_debug(f"▸ Processed in **{format_time(item_elapsed_time)}**", 4)
 
+        return "changed" if changed else "unchanged"
+
+    def _process_item_captured(self, items, library_name, mode="sync", revisited=0):
+        """
+        Process the tracks sharing a single file while capturing their log messages,
+        so that files processed concurrently don't interleave their output. Returns the
+        captured messages and the processing outcome, which is `failed` whenever an
+        error was logged, or `timed_out` if a file operation was abandoned.
+        """
+        with capture_logs() as records:
+            try:
+                outcome = self._process_item(
+                    items, library_name, mode=mode, revisited=revisited
+                )
+            except OperationTimeout as e:
+                log_error(f"▪ {e}, moving on", 4)
+                outcome = "timed_out"
+
+        if outcome != "timed_out" and any(
+            level >= logging.ERROR for level, _, _ in records
+        ):
+            outcome = "failed"
+
+        return records, outcome
+
+    def _execute_file_operation(self, operation):
+        """
+        Execute a deferred file write operation. Returns whether the operation no longer
+        needs to be retried, which is also the case when the file no longer exists or
+        can't be read.
+        """
+        file_path = Path(operation["path"])
+
+        self._batch_files = self._stat_files([file_path])
+
+        if not self._file_exists(file_path):
+            log_warning(f"Dropping {describe_operation(operation)}: file not found", 1)
+            return True
+
+        if self.unreadable_files is not None and self.watchdog.call(
+            "file_stat", self.unreadable_files.lookup, file_path
+        ):
+            log_warning(
+                f"Dropping {describe_operation(operation)}: file can't be read", 1
+            )
+            return True
+
+        if not self._is_operation_current(
+            operation, self._read_file_rating(file_path)
+        ):
+            return True
+
+        return self._write_file_rating(file_path, operation["rating"])
+
+    def _is_operation_current(self, operation, current_rating):
+        """
+        Return whether a deferred write operation still has to be executed, given the
+        rating its target currently holds. It doesn't once the target holds the rating
+        to write, or another one set since the write failed, which mustn't be
+        overwritten by a stale rating.
+        """
+        if current_rating == operation["rating"]:
+            log_debug(f"Already written: {describe_operation(operation)}", 1)
+            return False
+
+        if is_superseded(operation, current_rating):
+            log_warning(
+                f"Dropping {describe_operation(operation)}: rated **{current_rating}** "
+                "since the write failed",
+                1,
+            )
+            return False
+
+        return True
+
+    def _execute_operation(self, operation):
+        """
+        Execute a deferred write operation. Returns whether the operation no longer
+        needs to be retried, which is also the case when its target no longer exists.
+        """
+        if operation["target"] == "file":
+            try:
+                return self._execute_file_operation(operation)
+            except OperationTimeout as e:
+                log_error(f"{e}: {describe_operation(operation)}", 1)
+                return False
+
+        connection = next(
+            (
+                connection
+                for connection in self.connections
+                if connection.name == operation.get("server")
+            ),
+            self.primary,
+        )
+
+        try:
+            item = connection.plex.fetchItem(operation["rating_key"])
+        except NotFound:
+            log_warning(
+                f"Dropping {describe_operation(operation)}: item not found in Plex", 1
+            )
+            return True
+        except Exception as e:
+            log_error(f"Failed to fetch Plex item: {e}", 1)
+            return False
+
+        if not self._is_operation_current(operation, get_rating_from_plex(item)):
+            return True
+
+        return set_rating_to_plex(item, operation["rating"])
+
+    def _retry_persisted_operations(self):
+        """
+        Retry the write operations that still failed at the end of previous runs,
+        before processing the libraries. Those failing again are retried along with the
+        failures of this run.
+        """
+        operations = self.retry_queue.load()
+
+        if not operations:
+            return
+
+        log_info(
+            f"Retrying **{len(operations)}** failed operations from previous runs"
+        )
+
+        self.retry_queue.retry(operations, self._execute_operation)
+
+    def _snapshot_request_counts(self):
+        """
+        Return a copy of the request counts of all Plex servers, with the endpoints
+        prefixed by the server name when there are several servers.
+        """
+        if len(self.connections) == 1:
+            return self.primary.session.snapshot_request_counts()
+
+        request_counts = Counter()
+
+        for connection in self.connections:
+            for endpoint, count in connection.session.snapshot_request_counts().items():
+                request_counts[f"{connection.name}: {endpoint}"] = count
+
+        return request_counts
+
+    @contextmanager
+    def _lock_libraries(self, mode):
+        """
+        Hold the locks of the configured libraries for the specified mode, writing the
+        log messages to the log file of the run meanwhile (see `open_log_file`). Exits
+        if a library is held by another instance.
+        """
+        library_locks = LibraryLocks(
+            self.libraries,
+            targets=get_lock_targets(mode, self.locks_config["scope"]),
+            shard=self.scope.shard,
+            timeout=get_lock_timeout(),
+        )
+
+        with library_locks:
+            open_log_file(get_log_file_path(library_locks.name))
+
+            try:
+                yield
+            finally:
+                close_log_file()
+
     def _process_libraries(self, mode="sync"):
-        """Process all configured libraries with the specified mode."""
+        """
+        Process all configured libraries with the specified mode, with their locks held
+        (see `_lock_libraries`). Returns a summary of the run.
+        """
         total_start_time = datetime.now()
-        processed_tracks = 0
 
-        for library_name in self.libraries:
-            log_info(f"Processing Plex library: **{library_name}**")
+        # Relative times select the same period before each pass of the daemon
+        self._pass_scope = self.scope.resolve()
 
-            music_items = self.plex.library.section(library_name).all()
+        max_workers = max(
+            sum(connection.limiter.maximum for connection in self.connections),
+            self.file_limiter.maximum,
+        )
 
-            if not music_items:
-                log_warning(f"No items found in library: **{library_name}**")
-                continue
+        self.visited_files = VisitedFiles()
+        self.outcomes = dict.fromkeys(OUTCOMES, 0)
+        request_counts = self._snapshot_request_counts()
+
+        self.watchdog.reset_counters()
 
-            for item in music_items:
-                if hasattr(item, "type") and item.type == "artist":
-                    log_info(f"Artist: **{item.title}**", 1)
+        if self.file_cache is not None:
+            self.file_cache.reset_counters()
 
-                    for album in item.albums():
-                        album_tracks = album.tracks()
-                        album_path = Path(album_tracks[0].media[0].parts[0].file).parent
+        if self.unreadable_files is not None:
+            self.unreadable_files.load()
 
-                        log_info(
-                            f"Album: **{album.title}** __({album_path})__",
-                            2,
-                        )
+        self.retry_queue = RetryQueue(
+            self.libraries,
+            self.retry_config["max_attempts"],
+            self.retry_config["initial_delay"],
+            self.retry_config["max_delay"],
+            self.retry_config["max_runs"],
+            shard=str(self.shard) if self.shard else None,
+        )
 
-                        for track in album_tracks:
-                            self._process_item(track, mode=mode)
-                            processed_tracks += 1
+        if not self._stop_requested.is_set():
+            self._retry_persisted_operations()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            processed_tracks = self._process_sections(executor, mode)
+
+        if self._stop_requested.is_set():
+            log_warning("Run stopped before completion, as requested")
+        else:
+            self.retry_queue.drain(self._execute_operation)
+
+        if not is_dry_run():
+            self.retry_queue.save()
+
+            if self.unreadable_files is not None:
+                self.unreadable_files.save()
 
         total_elapsed_item = datetime.now() - total_start_time
 
         log_info(
             f"Processed **{processed_tracks}** tracks in **{format_time(total_elapsed_item)}**"
         )
+        request_counts = self._snapshot_request_counts() - request_counts
+        total_requests = sum(request_counts.values())
+        requests_per_track = (
+            total_requests / processed_tracks if processed_tracks else 0
+        )
+
+        log_info(
+            f"Made **{total_requests}** Plex requests "
+            f"(**{requests_per_track:.2f}** per track)"
+        )
+
+        for endpoint, count in request_counts.most_common():
+            log_debug(f"{endpoint}: **{count}**", 1)
+
+        for connection in self.connections:
+            log_info(connection.limiter.summary())
+
+        log_info(self.file_limiter.summary())
+
+        rate_limiters = [
+            connection.rate_limiter
+            for connection in self.connections
+            if connection.rate_limiter is not None
+        ]
+
+        if self.file_rate_limiter is not None:
+            rate_limiters.append(self.file_rate_limiter)
+
+        for rate_limiter in rate_limiters:
+            log_info(rate_limiter.summary())
+
+        if self.retry_queue.deferred or self.retry_queue.recovered:
+            log_info(self.retry_queue.summary())
+
+        if self.watchdog.timeouts or self.watchdog.refusals:
+            log_warning(self.watchdog.summary())
+
+        if self.visited_files.duplicates or self.visited_files.conflicts:
+            log_info(
+                f"Skipped **{self.visited_files.duplicates}** duplicate file "
+                f"occurrences, resolved **{self.visited_files.conflicts}** rating "
+                "conflicts"
+            )
+
+        if self.file_cache is not None:
+            log_info(
+                f"Reused **{self.file_cache.hits}** cached file ratings, read "
+                f"**{self.file_cache.misses}** files"
+            )
+
+        if self.outcomes["unreadable"]:
+            log_info(
+                f"Skipped **{self.outcomes['unreadable']}** tracks whose file couldn't "
+                "be read by a previous run"
+            )
+
+        if self.unreadable_files is not None and self.unreadable_files.recorded:
+            log_info(
+                f"Failed to read **{self.unreadable_files.recorded}** files, skipped "
+                "by the next runs until they change (see the **unreadable** command)"
+            )
+
+        run_summary = {
+            "mode": mode,
+            "libraries": self.libraries,
+            "shard": str(self.shard) if self.shard else None,
+            "started_at": total_start_time.isoformat(timespec="seconds"),
+            "duration": total_elapsed_item.total_seconds(),
+            "tracks": processed_tracks,
+            "outcomes": dict(self.outcomes),
+            "plex_requests": total_requests,
+            "deferred_operations": self.retry_queue.deferred,
+            "persisted_operations": self.retry_queue.persisted,
+            "rating_conflicts": self.visited_files.conflicts,
+            "timed_out_operations": dict(self.watchdog.timeouts),
+            "refused_operations": dict(self.watchdog.refusals),
+        }
+
+        if self.unreadable_files is not None:
+            run_summary["unreadable_files"] = self.unreadable_files.recorded
+
+        if rate_limiters:
+            run_summary["throttled_seconds"] = round(
+                sum(rate_limiter.waited for rate_limiter in rate_limiters), 3
+            )
+
+        if self.file_cache is not None:
+            run_summary["cached_file_ratings"] = self.file_cache.hits
+
+        return run_summary
+
+    def _prepare_tracks(self, library, tracks):
+        """
+        Prepare tracks for processing with auto-reload disabled, so that the hot loop
+        only ever accesses the fields already fetched. Tracks listed without their
+        media (which holds the file path) are fetched explicitly, in a single request.
+        """
+        _disable_auto_reload(tracks)
+
+        incomplete_tracks = [track for track in tracks if not track.media]
+
+        if not incomplete_tracks:
+            return tracks
+
+        log_debug(f"Fetching media of **{len(incomplete_tracks)}** tracks", 2)
+
+        fetched_tracks = {
+            track.ratingKey: track
+            for track in _disable_auto_reload(
+                library.fetchItems([track.ratingKey for track in incomplete_tracks])
+            )
+        }
+
+        return [fetched_tracks.get(track.ratingKey, track) for track in tracks]
+
+    def _iter_scoped_album_tracks(self, library):
+        """
+        Yield the tracks of each album in a library matching the scope selectors, as
+        selected by Plex.
+        """
+        header_log = log_info if self._shows_headers() else log_debug
+        artist_title = None
+
+        for album_tracks in self._pass_scope.iter_album_tracks(library):
+            album_tracks = self._select_shard(
+                self._prepare_tracks(library, album_tracks)
+            )
+
+            if not album_tracks:
+                continue
+
+            if album_tracks[0].grandparentTitle != artist_title:
+                artist_title = album_tracks[0].grandparentTitle
+                header_log(f"Artist: **{artist_title}**", 1)
+
+            album_path = _get_track_path(album_tracks[0]).parent
+
+            header_log(
+                f"Album: **{album_tracks[0].parentTitle}** __({album_path})__", 2
+            )
+
+            yield album_tracks
+
+    def _iter_album_tracks(self, library):
+        """Yield the tracks of each album in a library, in artist/album order."""
+        if self.scope.is_narrowed():
+            yield from self._iter_scoped_album_tracks(library)
+            return
+
+        music_items = _disable_auto_reload(library.all())
+
+        if not music_items:
+            log_warning(f"No items found in library: **{library.title}**")
+            return
+
+        header_log = log_info if self._shows_headers() else log_debug
+
+        for item in music_items:
+            if hasattr(item, "type") and item.type == "artist":
+                header_log(f"Artist: **{item.title}**", 1)
+
+                for album in _disable_auto_reload(item.albums()):
+                    album_tracks = self._select_shard(
+                        self._prepare_tracks(library, album.tracks())
+                    )
+
+                    if not album_tracks:
+                        continue
+
+                    album_path = _get_track_path(album_tracks[0]).parent
+
+                    header_log(f"Album: **{album.title}** __({album_path})__", 2)
+
+                    yield album_tracks
+
+    def _readahead_headers(self, file_paths, length):
+        """
+        Hint the operating system to prefetch the headers of local files (see
+        `readahead_header`), each with the deadline of a file read. Prefetching stops
+        at the first abandoned file, as the next ones would likely hang as well.
+        """
+        for file_path in file_paths:
+            try:
+                self.watchdog.call("file_read", readahead_header, file_path, length)
+            except OperationTimeout:
+                return
+
+    def _process_batch(
+        self, executor, tracks, library_name, mode, progress, revisits=None
+    ):
+        """
+        Process a batch of tracks concurrently, ordered for disk locality if configured
+        to, and replay their log messages in that same order. Unless running in verbose
+        mode, only the messages of tracks that didn't stay unchanged are replayed.
+
+        The tracks of the other Plex servers indexed so far are processed along with
+        the tracks sharing their files. `revisits` gives the number of tracks of each
+        file already processed earlier in the run, which are not counted again.
+        Returns the number of tracks processed.
+        """
+        revisits = revisits or {}
+        ordering = self.io_config["ordering"]
+        readahead = self.io_config["readahead"]
+
+        # Each file is stat'ed once per batch, for its existence, key and ordering
+        self._batch_files = self._stat_files(map(_get_track_path, tracks), executor)
+
+        # A file agent orders its own reads, on the host where the disks are
+        if self.agent is None and not self._keeps_plex_order():
+            tracks = order_by_locality(
+                tracks,
+                _get_track_path,
+                by_inode=ordering == "inode",
+                file_keys={
+                    path: file_key
+                    for path, (_, file_key) in self._batch_files.items()
+                },
+            )
+
+            log_debug(f"Ordered batch of **{len(tracks)}** tracks by **{ordering}**", 2)
+
+        # Prefetching by the OS would bypass the file I/O budget of the gentle mode. It
+        # runs on a worker, so that the first files are processed in the meantime.
+        if self.agent is None and self.file_rate_limiter is None and readahead:
+            file_paths = [_get_track_path(track) for track in tracks]
+
+            executor.submit(
+                self._readahead_headers,
+                [path for path in file_paths if self._batch_files[str(path)][0]],
+                readahead,
+            )
+
+        # Tracks sharing a file are processed together so it's only read once
+        file_groups = {}
+
+        for track in tracks:
+            file_key = self._get_file_key(_get_track_path(track))
+            file_groups.setdefault(file_key, []).append(track)
+
+        if self.agent is not None:
+            self._prefetch_agent_ratings(file_groups)
+
+        # Tracks of the other servers sharing these files are reconciled along with them
+        self._merge_indexed_server_tracks()
+
+        for file_key, items in file_groups.items():
+            other_tracks = self._pop_other_server_tracks(file_key)
+            progress.extend(len(other_tracks))
+            items.extend(other_tracks)
+
+            # Other servers may still share the file, it's then revisited once indexed.
+            # The items of every library sharing it are revisited together.
+            if self._indexing_futures:
+                self._pending_groups.setdefault(file_key, (library_name, []))[1].extend(
+                    items
+                )
+
+        futures = [
+            executor.submit(
+                self._process_item_captured,
+                items,
+                library_name,
+                mode=mode,
+                revisited=revisits.get(file_key, 0),
+            )
+            for file_key, items in file_groups.items()
+        ]
+
+        results = [future.result() for future in futures]
+        agent_writes = self._flush_agent_writes() if self.agent is not None else {}
+
+        processed_tracks = 0
+
+        for (file_key, items), (records, outcome) in zip(file_groups.items(), results):
+            written, write_records = agent_writes.get(
+                str(_get_track_path(items[0])), (True, [])
+            )
+
+            # The outcome of a write queued for the file agent is only known now
+            if not written:
+                outcome = "failed"
+
+            # Files known to be unreadable are skipped silently, like unchanged ones
+            if self.verbose or outcome not in ("unchanged", "unreadable"):
+                replay_logs(records + write_records)
+
+                if not written:
+                    log_debug("▸ Deferred writing the file rating", 4)
+
+            group_tracks = len(items) - revisits.get(file_key, 0)
+            progress.advance(outcome, tracks=group_tracks)
+            processed_tracks += group_tracks
+
+        return processed_tracks
+
+    def _add_outcomes(self, progress):
+        """Add the outcome counters of a library to those of the run."""
+        for outcome, count in progress.outcomes.items():
+            self.outcomes[outcome] += count
+
+    def _index_server_tracks(self, connection):
+        """
+        Index the tracks of the libraries of another Plex server than the first one by
+        audio file, so that they are processed along with the tracks of the first
+        server sharing the same files. Returns the library name and tracks of each file.
+        """
+        server_tracks = {}
+
+        for library_name in connection.libraries:
+            library = connection.plex.library.section(library_name)
+
+            if self.scope.is_narrowed():
+                tracks = [
+                    track
+                    for album_tracks in self._pass_scope.iter_album_tracks(library)
+                    for track in album_tracks
+                ]
+            else:
+                tracks = library.search(libtype="track")
+
+            tracks = self._select_shard(self._prepare_tracks(library, tracks))
+            file_paths = [_get_track_path(track) for track in tracks]
+            files = self._stat_files(file_paths)
+            file_keys = [files[str(file_path)][1] for file_path in file_paths]
+
+            for track, file_key in zip(tracks, file_keys):
+                server_tracks.setdefault(file_key, []).append((library_name, track))
+
+        log_info(
+            f"Indexed **{len(server_tracks)}** files from Plex server "
+            f"**{connection.name}**"
+        )
+
+        return server_tracks
+
+    def _merge_indexed_server_tracks(self, wait=False):
+        """
+        Merge the tracks of the other Plex servers indexed so far by audio file, or of
+        all of them once indexed with `wait`. The first batches don't wait for the
+        indexing, their files are revisited if other servers turn out to share them.
+        """
+        pending_futures = []
+
+        for future in self._indexing_futures:
+            if not wait and not future.done():
+                pending_futures.append(future)
+                continue
+
+            for file_key, entries in future.result().items():
+                self._other_server_tracks.setdefault(file_key, []).extend(entries)
+
+        self._indexing_futures = pending_futures
+
+    def _pop_other_server_tracks(self, file_key):
+        """Remove and return the tracks of the other Plex servers sharing a file."""
+        entries = self._other_server_tracks.pop(file_key, [])
+
+        return [track for _, track in entries]
+
+    def _process_revisited_files(self, executor, mode):
+        """
+        Process again the files processed before the other Plex servers sharing them
+        were indexed, along with the tracks of those servers, in batches grouped by
+        library. Returns the number of tracks of the other servers processed.
+        """
+        processed_tracks = 0
+
+        library_groups = {}
+
+        for file_key, (library_name, items) in self._pending_groups.items():
+            other_tracks = self._pop_other_server_tracks(file_key)
+
+            if other_tracks:
+                library_groups.setdefault(library_name, []).append(
+                    (file_key, items, other_tracks)
+                )
+
+        self._pending_groups.clear()
+
+        batch_size = self.io_config["batch_size"]
+
+        for library_name, groups in library_groups.items():
+            log_info(
+                f"Processing Plex library: **{library_name}** (files shared with "
+                "other servers indexed since)"
+            )
+
+            progress = ProgressReporter(
+                library_name, sum(len(other_tracks) for _, _, other_tracks in groups)
+            )
+
+            # Batches are made of whole files, so that each one is revisited once
+            for index in range(0, len(groups), batch_size):
+                if self._stop_requested.is_set():
+                    break
+
+                batch_groups = groups[index : index + batch_size]
+
+                processed_tracks += self._process_batch(
+                    executor,
+                    [
+                        track
+                        for _, items, other_tracks in batch_groups
+                        for track in items + other_tracks
+                    ],
+                    library_name,
+                    mode,
+                    progress,
+                    revisits={
+                        file_key: len(items) for file_key, items, _ in batch_groups
+                    },
+                )
+
+            progress.finish()
+            self._add_outcomes(progress)
+
+        return processed_tracks
+
+    def _process_other_server_tracks(self, executor, mode):
+        """
+        Process the tracks of the other Plex servers whose files were not found on the
+        first server, in batches grouped by library. Returns the number of tracks
+        processed.
+        """
+        self._merge_indexed_server_tracks(wait=True)
+
+        processed_tracks = self._process_revisited_files(executor, mode)
+
+        library_tracks = {}
+
+        for entries in self._other_server_tracks.values():
+            for library_name, track in entries:
+                library_tracks.setdefault(library_name, []).append(track)
+
+        self._other_server_tracks.clear()
+
+        batch_size = self.io_config["batch_size"]
+
+        for library_name, tracks in library_tracks.items():
+            log_info(
+                f"Processing Plex library: **{library_name}** (files only found on "
+                "other servers)"
+            )
+
+            progress = ProgressReporter(library_name, len(tracks))
+
+            for index in range(0, len(tracks), batch_size):
+                if self._stop_requested.is_set():
+                    break
+
+                processed_tracks += self._process_batch(
+                    executor,
+                    tracks[index : index + batch_size],
+                    library_name,
+                    mode,
+                    progress,
+                )
+
+            progress.finish()
+            self._add_outcomes(progress)
+
+        return processed_tracks
+
+    def _process_sections(self, executor, mode):
+        """
+        Process the tracks of all configured libraries in batches, with the tracks of
+        each batch processed concurrently. A batch is a single album when keeping the
+        Plex order, or enough albums to fill the configured batch size otherwise.
+
+        The libraries of the first Plex server drive the processing, while those of
+        the other servers are indexed concurrently and joined by audio file, so that
+        each file is reconciled against all servers. Files processed before the other
+        servers were indexed are revisited if those share them. Returns the number of
+        tracks processed.
+        """
+        processed_tracks = 0
+
+        self._other_server_tracks = {}
+        self._pending_groups = {}
+        self._indexing_futures = [
+            executor.submit(self._index_server_tracks, connection)
+            for connection in self.connections[1:]
+        ]
+
+        for library_name in self.primary.libraries:
+            if self._stop_requested.is_set():
+                break
+
+            log_info(f"Processing Plex library: **{library_name}**")
+
+            library = self.plex.library.section(library_name)
+
+            total_tracks = None
+
+            # Scoped runs only select part of the library, so its size is meaningless
+            if not self.scope.is_narrowed() and self.shard is None:
+                try:
+                    total_tracks = library.totalViewSize(libtype="track")
+                except Exception as e:
+                    log_debug(f"Failed to count tracks in library: {e}")
+
+            progress = ProgressReporter(library_name, total_tracks)
+
+            batch = []
+
+            # Fetching the next albums from Plex overlaps with processing their files
+            album_tracks_iterator = prefetch(
+                self._iter_album_tracks(library), self.io_config["prefetch"]
+            )
+
+            # A stopped run leaves the albums not yet processed for the next one
+            for album_tracks in album_tracks_iterator:
+                if self._stop_requested.is_set():
+                    batch = []
+                    break
+
+                batch.extend(album_tracks)
+
+                if (
+                    self._keeps_plex_order()
+                    or len(batch) >= self.io_config["batch_size"]
+                ):
+                    processed_tracks += self._process_batch(
+                        executor, batch, library_name, mode, progress
+                    )
+                    batch = []
+
+            if batch:
+                processed_tracks += self._process_batch(
+                    executor, batch, library_name, mode, progress
+                )
+
+            progress.finish()
+            self._add_outcomes(progress)
+
+        if not self._stop_requested.is_set():
+            processed_tracks += self._process_other_server_tracks(executor, mode)
+
+        return processed_tracks
 
     def sync_ratings(self):
-        """Synchronize ratings between Plex and supported audio files."""
-        log_info("Synchronization started: **Plex ⇄ Audio Files**")
+        """
+        Synchronize ratings between Plex and supported audio files. Returns a summary
+        of the run.
+        """
+        with self._lock_libraries("sync"):
+            log_info("Synchronization started: **Plex ⇄ Audio Files**")
 
-        self._process_libraries(mode="sync")
+            run_summary = self._process_libraries(mode="sync")
 
-        log_info("Synchronization completed: **Plex** ⇄ **Audio Files**")
+            log_info("Synchronization completed: **Plex** ⇄ **Audio Files**")
+
+        return run_summary
 
     def import_ratings(self):
-        """Import ratings from audio files into Plex."""
-        log_info("Import started: **Audio Files → Plex**")
+        """Import ratings from audio files into Plex. Returns a summary of the run."""
+        with self._lock_libraries("import"):
+            log_info("Import started: **Audio Files → Plex**")
+
+            run_summary = self._process_libraries(mode="import")
 
-        self._process_libraries(mode="import")
+            log_info("Import completed: **Audio Files → Plex**")
 
-        log_info("Import completed: **Audio Files → Plex**")
+        return run_summary
 
     def export_ratings(self):
-        """Export ratings from Plex to audio files."""
-        log_info("Export started: **Plex → Audio Files**")
+        """Export ratings from Plex to audio files. Returns a summary of the run."""
+        with self._lock_libraries("export"):
+            log_info("Export started: **Plex → Audio Files**")
+
+            run_summary = self._process_libraries(mode="export")
 
-        self._process_libraries(mode="export")
+            log_info("Export completed: **Plex → Audio Files**")
 
-        log_info("Export completed: **Plex → Audio Files**")
+        return run_summary
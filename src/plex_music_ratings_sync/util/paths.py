@@ -1,7 +1,7 @@
-from os import getenv
+from os import getenv, getpid
 from pathlib import Path
 
-from platformdirs import user_config_dir, user_log_dir
+from platformdirs import user_cache_dir, user_config_dir, user_log_dir
 
 from plex_music_ratings_sync import APP_NAME
 
@@ -16,14 +16,52 @@ def get_config_file_path():
     return get_config_dir() / "config.yml"
 
 
+def get_cache_dir():
+    """Return the path to the cache directory."""
+    return Path(getenv("PMRS_CACHE_DIR", user_cache_dir(APP_NAME)))
+
+
+def get_lock_dir():
+    """Return the path to the directory holding the lock files."""
+    return get_cache_dir() / "locks"
+
+
+def get_retry_file_path():
+    """Return the path to the file holding the operations to retry on the next run."""
+    return get_cache_dir() / "retry.json"
+
+
+def get_unreadable_file_path():
+    """Return the path to the file holding the audio files that couldn't be read."""
+    return get_cache_dir() / "unreadable.json"
+
+
+def get_rating_database_path():
+    """Return the path to the default database of the `database` rating storage."""
+    return get_cache_dir() / "ratings.db"
+
+
 def get_log_dir():
     """Return the path to the log directory."""
     return Path(getenv("PMRS_LOG_DIR", user_log_dir(APP_NAME)))
 
 
-def get_log_file_path():
-    """Return the path to the log file."""
-    return get_log_dir() / f"{APP_NAME}.log"
+def get_log_file_path(name):
+    """
+    Return the path to the log file of the runs with the given name (e.g., the libraries
+    they lock, see `LibraryLocks.name`).
+    """
+    return get_log_dir() / f"{APP_NAME}-{name}.log"
+
+
+def get_profile_file_path():
+    """Return the path to the CPU profile file of this process."""
+    return get_log_dir() / f"{APP_NAME}-{getpid()}.prof"
+
+
+def get_profile_summary_file_path():
+    """Return the path to the profile summary file of this process."""
+    return get_log_dir() / f"{APP_NAME}-{getpid()}.profile.txt"
 
 
 def get_template_file_path():
@@ -0,0 +1,234 @@
+import queue
+import threading
+from collections import Counter
+
+from plex_music_ratings_sync.logger import capture_logs, replay_logs
+
+DEADLINE_KINDS = ("file_stat", "file_read", "file_write", "plex_request")
+"""Kinds of operations that can be given a deadline."""
+
+_DESCRIPTIONS = {
+    "file_stat": "Checking the file",
+    "file_read": "Reading the file rating",
+    "file_write": "Writing the file rating",
+    "plex_request": "Plex request",
+}
+"""Description of each kind of operation, for the timeout messages."""
+
+_MAX_STUCK_OPERATIONS = 16
+"""
+Number of abandoned operations of a kind still running past which the next ones of
+that kind are refused, as they would most likely hang as well and each hold a runner.
+"""
+
+
+class OperationTimeout(TimeoutError):
+    """Raised when an operation is abandoned for exceeding its deadline."""
+
+    def __init__(self, kind, deadline, call=None):
+        super().__init__(f"{_DESCRIPTIONS[kind]} timed out after {deadline:g}s")
+        self.kind = kind
+        self.deadline = deadline
+        self._call = call
+
+    def add_done_callback(self, callback):
+        """
+        Call `callback` once the abandoned operation completes, e.g., to give back the
+        resources it still holds. It's called right away if the operation already
+        completed, or was never started.
+        """
+        if self._call is None:
+            callback()
+        else:
+            self._call.add_done_callback(callback)
+
+
+class OperationRefused(OperationTimeout):
+    """
+    Raised instead of starting an operation while too many abandoned operations of its
+    kind are still running, e.g., on a network file system that stopped responding.
+    """
+
+    def __init__(self, kind, deadline, stuck):
+        super().__init__(kind, deadline)
+        self.args = (
+            f"{_DESCRIPTIONS[kind]} skipped, **{stuck}** operations still hung past "
+            f"{deadline:g}s",
+        )
+
+
+class OperationPending(OperationTimeout):
+    """
+    Raised instead of operating on a file while an abandoned write to it is still
+    running, so that the file isn't read half-written or written twice at once.
+    """
+
+    def __init__(self, kind, deadline):
+        super().__init__(kind, deadline)
+        self.args = (
+            f"{_DESCRIPTIONS[kind]} skipped, a write of the file abandoned after "
+            f"{deadline:g}s is still running",
+        )
+
+
+class _Call:
+    """An operation handed to a runner thread, along with its outcome."""
+
+    def __init__(self, function, args, kwargs):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+
+        self.done = threading.Event()
+        self.abandoned = False
+        self.result = None
+        self.error = None
+        self.records = []
+
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+
+    def run(self):
+        """Run the operation, keeping its result or exception and its log messages."""
+        with capture_logs() as self.records:
+            try:
+                self.result = self.function(*self.args, **self.kwargs)
+            except BaseException as e:
+                self.error = e
+
+    def run_callbacks(self):
+        """Call the callbacks added until the operation completed."""
+        with self._callbacks_lock:
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback in callbacks:
+            callback()
+
+    def add_done_callback(self, callback):
+        """Call `callback` once the operation completes, or right away if it did."""
+        with self._callbacks_lock:
+            if not self.done.is_set():
+                self._callbacks.append(callback)
+                return
+
+        callback()
+
+
+class Watchdog:
+    """
+    Run operations in runner threads while the calling thread waits for them up to the
+    deadline of their kind, so that an operation hanging on an unresponsive network
+    file system or Plex server doesn't hang the whole run.
+
+    Threads can't be interrupted in Python: an operation past its deadline is abandoned
+    by the caller, which gets an `OperationTimeout`, but keeps its runner until it
+    completes, if ever. Runners are reused once their operation completes, so threads
+    are only started when more operations run at once than ever before. Once too many
+    abandoned operations of a kind are still running, the next ones of that kind are
+    refused with an `OperationRefused` until some complete, which bounds the number of
+    runners stuck on a hung file system or server.
+
+    The log messages of an operation are emitted by the calling thread, as if it ran
+    there, and those of abandoned operations are dropped. Operations of a kind without
+    a deadline run in the calling thread.
+    """
+
+    def __init__(self, deadlines):
+        self.deadlines = deadlines
+        self.timeouts = Counter()
+        self.refusals = Counter()
+        self.running_abandoned = Counter()
+
+        self._lock = threading.Lock()
+        self._idle_runners = []
+
+    def reset_counters(self):
+        """Reset the timeout counters, e.g., between the passes of a daemon."""
+        with self._lock:
+            self.timeouts.clear()
+            self.refusals.clear()
+
+    def _run(self, calls):
+        """Run the operations handed to a runner thread, one at a time."""
+        while True:
+            kind, call = calls.get()
+            call.run()
+
+            with self._lock:
+                call.done.set()
+
+                if call.abandoned:
+                    self.running_abandoned[kind] -= 1
+
+                self._idle_runners.append(calls)
+
+            call.run_callbacks()
+
+    def call(self, kind, function, *args, **kwargs):
+        """
+        Call `function` with the deadline of the `kind` of operation. Returns its result
+        or raises its exception, or raises `OperationTimeout` once the deadline passes,
+        or right away if too many operations of that kind are hung.
+        """
+        deadline = self.deadlines.get(kind)
+
+        if deadline is None:
+            return function(*args, **kwargs)
+
+        call = _Call(function, args, kwargs)
+
+        with self._lock:
+            stuck = self.running_abandoned[kind]
+
+            if stuck >= _MAX_STUCK_OPERATIONS:
+                self.refusals[kind] += 1
+
+                raise OperationRefused(kind, deadline, stuck)
+
+            calls = self._idle_runners.pop() if self._idle_runners else None
+
+        if calls is None:
+            calls = queue.SimpleQueue()
+
+            threading.Thread(
+                target=self._run, args=(calls,), name="watchdog", daemon=True
+            ).start()
+
+        calls.put((kind, call))
+        call.done.wait(deadline)
+
+        with self._lock:
+            if not call.done.is_set():
+                call.abandoned = True
+                self.running_abandoned[kind] += 1
+                self.timeouts[kind] += 1
+
+                raise OperationTimeout(kind, deadline, call)
+
+        replay_logs(call.records)
+
+        if call.error is not None:
+            raise call.error
+
+        return call.result
+
+    def summary(self):
+        """Return a short human readable summary of the abandoned operations."""
+        timeouts = ", ".join(
+            f"{kind}: **{count}**" for kind, count in sorted(self.timeouts.items())
+        )
+
+        summary = (
+            f"Abandoned **{sum(self.timeouts.values())}** operations past their "
+            f"deadline ({timeouts}), **{sum(self.running_abandoned.values())}** still "
+            "running"
+        )
+
+        if self.refusals:
+            refusals = ", ".join(
+                f"{kind}: **{count}**" for kind, count in sorted(self.refusals.items())
+            )
+
+            summary += f", refused **{sum(self.refusals.values())}** ({refusals})"
+
+        return summary
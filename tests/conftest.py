@@ -0,0 +1,59 @@
+import logging
+
+import pytest
+import yaml
+
+from plex_music_ratings_sync import APP_NAME
+from plex_music_ratings_sync.config import init_config
+from plex_music_ratings_sync.logger import init_logging
+from plex_music_ratings_sync.state import set_dry_run
+from tests.fake_plex import FakeLibrary, FakePlexServer
+
+
+@pytest.fixture
+def fake_library(tmp_path):
+    """A music library of 12 tracks, 4 of them rated, backed by real MP3 files."""
+    return FakeLibrary(tmp_path / "music")
+
+
+@pytest.fixture
+def fake_plex(fake_library):
+    """A local fake Plex server for the fake library."""
+    server = FakePlexServer(fake_library)
+
+    yield server
+
+    server.close()
+
+
+@pytest.fixture
+def configure(tmp_path, monkeypatch, fake_plex):
+    """
+    Return a function writing the configuration of a run against the fake Plex server,
+    with the given extra sections, and loading it. Every directory of the application
+    is kept in the temporary directory of the test.
+    """
+    for name in ("CONFIG", "CACHE", "LOG"):
+        monkeypatch.setenv(f"PMRS_{name}_DIR", str(tmp_path / name.lower()))
+
+    set_dry_run(False)
+
+    def configure(**sections):
+        config = {
+            "plex": {"url": fake_plex.url, "token": "token", "libraries": ["Music"]},
+            **sections,
+        }
+
+        config_dir = tmp_path / "config"
+        config_dir.mkdir(exist_ok=True)
+
+        with open(config_dir / "config.yml", "w") as config_file:
+            yaml.safe_dump(config, config_file)
+
+        init_config()
+
+        # Each run logs to the directory of its own test
+        logging.getLogger(APP_NAME).handlers.clear()
+        init_logging(quiet=True)
+
+    return configure
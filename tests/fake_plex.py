@@ -0,0 +1,279 @@
+import re
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+from xml.sax.saxutils import quoteattr
+
+_MP3_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+"""A silent MPEG audio frame, enough for `mutagen` to read and write ID3 tags."""
+
+_SECTION_META = """<Meta>
+<Type key="/library/sections/1/all?type=8" type="artist" title="Artists" active="1">
+<Field key="artist.title" title="Artist" type="string"/>
+<Field key="artist.id" title="Id" type="integer"/>
+</Type>
+<Type key="/library/sections/1/all?type=9" type="album" title="Albums" active="0">
+<Field key="album.title" title="Album" type="string"/>
+</Type>
+<Type key="/library/sections/1/all?type=10" type="track" title="Tracks" active="0">
+<Field key="track.title" title="Title" type="string"/>
+<Field key="track.addedAt" title="Added" type="date"/>
+</Type>
+<FieldType type="string">
+<Operator key="=" title="contains"/><Operator key="==" title="is"/>
+</FieldType>
+<FieldType type="integer"><Operator key="=" title="is"/></FieldType>
+<FieldType type="date">
+<Operator key="&gt;&gt;=" title="is after"/>
+<Operator key="&lt;&lt;=" title="is before"/>
+</FieldType>
+</Meta>"""
+"""Filtering metadata of a music library section, as needed by `plexapi` searches."""
+
+
+class FakeLibrary:
+    """
+    A music library of artists, albums and tracks backed by real MP3 files below
+    `root`. Tracks at odd positions in their album are rated in Plex, the others are
+    unrated.
+    """
+
+    def __init__(self, root, artists=2, albums=2, tracks=3, title="Music"):
+        self.root = Path(root)
+        self.title = title
+        self.artists = []
+        self.albums = {}
+        self.tracks = {}
+
+        rating_key = 1000
+
+        for artist_index in range(artists):
+            rating_key += 1
+            artist = {
+                "key": rating_key,
+                "title": f"Artist {artist_index}",
+                "albums": [],
+            }
+
+            for album_index in range(albums):
+                rating_key += 1
+                album = {
+                    "key": rating_key,
+                    "title": f"Album {album_index}",
+                    "artist": artist,
+                    "tracks": [],
+                }
+
+                for track_index in range(tracks):
+                    rating_key += 1
+                    file_path = (
+                        self.root
+                        / f"artist{artist_index}"
+                        / f"album{album_index}"
+                        / f"{track_index:02d}.mp3"
+                    )
+                    file_path.parent.mkdir(parents=True, exist_ok=True)
+                    file_path.write_bytes(_MP3_FRAME * 20)
+
+                    track = {
+                        "key": rating_key,
+                        "title": f"Song {track_index}",
+                        "index": track_index + 1,
+                        "file": str(file_path),
+                        "rating": float(track_index * 2) if track_index % 2 else None,
+                        "album": album,
+                    }
+
+                    album["tracks"].append(track)
+                    self.tracks[rating_key] = track
+
+                artist["albums"].append(album)
+                self.albums[album["key"]] = album
+
+            self.artists.append(artist)
+
+
+def _track_xml(track):
+    """Render a track as listed by Plex, with its media."""
+    album = track["album"]
+    artist = album["artist"]
+    rating = f' userRating="{track["rating"]}"' if track["rating"] else ""
+
+    return (
+        f'<Track ratingKey="{track["key"]}" key="/library/metadata/{track["key"]}" '
+        f'type="track" title={quoteattr(track["title"])} index="{track["index"]}" '
+        f'parentRatingKey="{album["key"]}" parentTitle={quoteattr(album["title"])} '
+        f'grandparentRatingKey="{artist["key"]}" '
+        f'grandparentTitle={quoteattr(artist["title"])} addedAt="1700000000" '
+        f'updatedAt="1700000000"{rating}><Media id="{track["key"]}">'
+        f'<Part id="{track["key"]}" file={quoteattr(track["file"])}/></Media></Track>'
+    )
+
+
+def _album_xml(album):
+    """Render an album as listed by Plex."""
+    return (
+        f'<Directory ratingKey="{album["key"]}" '
+        f'key="/library/metadata/{album["key"]}/children" type="album" '
+        f'title={quoteattr(album["title"])} '
+        f'parentTitle={quoteattr(album["artist"]["title"])}/>'
+    )
+
+
+def _artist_xml(artist):
+    """Render an artist as listed by Plex."""
+    return (
+        f'<Directory ratingKey="{artist["key"]}" '
+        f'key="/library/metadata/{artist["key"]}/children" type="artist" '
+        f'title={quoteattr(artist["title"])}/>'
+    )
+
+
+class FakePlexServer:
+    """
+    A local HTTP server answering the Plex API requests made by a run for a single
+    library, counting them by endpoint.
+    """
+
+    def __init__(self, library, name="Fake"):
+        self.library = library
+        self.name = name
+        self.requests = Counter()
+
+        handler = type("FakePlexHandler", (_FakePlexHandler,), {"server_state": self})
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        """Stop the server."""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class _FakePlexHandler(BaseHTTPRequestHandler):
+    """Serve the endpoints of the Plex API used by the synchronization."""
+
+    server_state = None
+
+    def log_message(self, format, *args):
+        """Silence the default request logging, which goes to stderr."""
+
+    def _send_xml(self, body="", size=0):
+        """Send a media container."""
+        state = self.server_state
+
+        data = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            f'<MediaContainer size="{size}" totalSize="{size}" '
+            f'friendlyName="{state.name}" machineIdentifier="{state.name}" '
+            f'version="1.40.0" librarySectionID="1">{body}</MediaContainer>'
+        ).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_PUT(self):
+        """Handle rating requests, which `plexapi` sends with `PUT`."""
+        self.do_GET()
+
+    def do_GET(self):
+        """Dispatch a request to the matching endpoint."""
+        url = urlsplit(self.path)
+        path = url.path
+        query = parse_qs(url.query)
+        library = self.server_state.library
+
+        self.server_state.requests[f"{self.command} {path}"] += 1
+
+        if path == "/":
+            return self._send_xml()
+
+        if path == "/library":
+            return self._send_xml('<Directory key="sections" title="Library"/>')
+
+        if path == "/library/sections":
+            return self._send_xml(
+                f'<Directory key="1" type="artist" title={quoteattr(library.title)} '
+                'agent="tv.plex.agents.music" scanner="Plex Music">'
+                f'<Location id="1" path={quoteattr(str(library.root))}/></Directory>',
+                1,
+            )
+
+        if "includeMeta" in query:
+            return self._send_xml(
+                "<Meta/>" if path.endswith("/collections") else _SECTION_META
+            )
+
+        if path == "/library/sections/1/all":
+            return self._send_section_items(query)
+
+        match = re.fullmatch(r"/library/metadata/(\d+)/children", path)
+
+        if match:
+            return self._send_children(int(match.group(1)))
+
+        match = re.fullmatch(r"/library/metadata/([\d,]+)", path)
+
+        if match:
+            tracks = [
+                library.tracks[int(key)]
+                for key in match.group(1).split(",")
+                if int(key) in library.tracks
+            ]
+
+            return self._send_xml("".join(map(_track_xml, tracks)), len(tracks))
+
+        if path == "/:/rate":
+            library.tracks[int(query["key"][0])]["rating"] = float(query["rating"][0])
+            return self._send_xml()
+
+        self.send_response(404)
+        self.end_headers()
+
+    def _send_section_items(self, query):
+        """Send the artists, albums or tracks of the library section."""
+        library = self.server_state.library
+        libtype = query.get("type", ["8"])[0]
+
+        if libtype == "10":
+            tracks = list(library.tracks.values())
+
+            if query.get("X-Plex-Container-Size") == ["0"]:
+                return self._send_xml(size=len(tracks))
+
+            return self._send_xml("".join(map(_track_xml, tracks)), len(tracks))
+
+        if libtype == "9":
+            artist_key = int(query["artist.id"][0])
+            albums = [
+                album
+                for album in library.albums.values()
+                if album["artist"]["key"] == artist_key
+            ]
+
+            return self._send_xml("".join(map(_album_xml, albums)), len(albums))
+
+        return self._send_xml(
+            "".join(map(_artist_xml, library.artists)), len(library.artists)
+        )
+
+    def _send_children(self, rating_key):
+        """Send the albums of an artist, or the tracks of an album."""
+        library = self.server_state.library
+
+        for artist in library.artists:
+            if artist["key"] == rating_key:
+                albums = artist["albums"]
+                return self._send_xml("".join(map(_album_xml, albums)), len(albums))
+
+        tracks = library.albums[rating_key]["tracks"]
+
+        return self._send_xml("".join(map(_track_xml, tracks)), len(tracks))
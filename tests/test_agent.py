@@ -0,0 +1,81 @@
+import threading
+from collections import Counter
+
+import pytest
+import requests
+
+from plex_music_ratings_sync.agent import AgentClient, create_agent_server
+from plex_music_ratings_sync.config import get_storage_config
+from plex_music_ratings_sync.ratings import create_rating_storage, get_rating_from_file
+from plex_music_ratings_sync.sync import RatingSync
+
+
+@pytest.fixture
+def agent_server(configure, fake_library):
+    """A file agent serving the files of the fake library, on an ephemeral port."""
+    configure()
+
+    server = create_agent_server(
+        "127.0.0.1",
+        0,
+        "token",
+        create_rating_storage(get_storage_config()),
+        [fake_library.root],
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_agent_writes_are_sent_per_batch(
+    configure, agent_server, fake_library, monkeypatch
+):
+    configure(
+        agent={"url": agent_server, "token": "token"},
+        io={"ordering": "directory", "batch_size": 100},
+    )
+
+    requests_by_endpoint = Counter()
+    post = AgentClient._post
+
+    def counting_post(self, endpoint, payload):
+        requests_by_endpoint[endpoint] += 1
+        return post(self, endpoint, payload)
+
+    monkeypatch.setattr(AgentClient, "_post", counting_post)
+
+    run_summary = RatingSync().sync_ratings()
+
+    assert run_summary["outcomes"]["changed"] == 4
+    assert requests_by_endpoint["/write"] == 1
+
+    for track in fake_library.tracks.values():
+        rating = track["rating"] and int(track["rating"])
+        assert get_rating_from_file(track["file"]) == rating
+
+
+def test_agent_rejects_paths_outside_its_roots(agent_server, fake_library, tmp_path):
+    outside_path = tmp_path / "outside.mp3"
+    outside_path.write_bytes(b"")
+
+    escaping_link = fake_library.root / "link.mp3"
+    escaping_link.symlink_to(outside_path)
+
+    client = AgentClient(agent_server, "token", 5)
+    inside_path = next(iter(fake_library.tracks.values()))["file"]
+
+    assert client.stat([inside_path])[inside_path][0]
+
+    for path in (
+        outside_path,
+        fake_library.root / ".." / "outside.mp3",
+        escaping_link,
+    ):
+        with pytest.raises(requests.HTTPError, match="403"):
+            client.read_ratings([inside_path, str(path)])
+
+    with pytest.raises(requests.HTTPError, match="403"):
+        client.write_ratings({str(outside_path): 5})
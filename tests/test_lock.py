@@ -0,0 +1,53 @@
+import logging
+
+import pytest
+
+from plex_music_ratings_sync import APP_NAME
+from plex_music_ratings_sync.lock import LibraryLocks, get_lock_targets
+from plex_music_ratings_sync.sync import RatingSync
+from plex_music_ratings_sync.util.paths import get_log_file_path
+
+
+def test_modes_writing_the_same_targets_exclude_each_other(configure):
+    configure()
+
+    def lock(mode, scope="library_mode"):
+        return LibraryLocks(["Music"], targets=get_lock_targets(mode, scope))
+
+    # An import writes Plex only, an export the files only
+    with lock("import"), lock("export"):
+        for mode in ("sync", "import", "export"):
+            with pytest.raises(SystemExit):
+                lock(mode).acquire()
+
+    for mode, other_mode in (("sync", "import"), ("sync", "export")):
+        with lock(mode):
+            with pytest.raises(SystemExit):
+                lock(other_mode).acquire()
+
+    # Runs locking whole libraries exclude runs locking the targets of their mode
+    with lock("import", scope="library"):
+        with pytest.raises(SystemExit):
+            lock("export").acquire()
+
+
+def test_runs_only_write_their_log_once_holding_their_libraries(configure):
+    configure()
+    logging.getLogger(APP_NAME).setLevel(logging.INFO)
+
+    with LibraryLocks(["Music"]) as library_locks:
+        log_file_path = get_log_file_path(library_locks.name)
+        log_file_path.write_text("Log of the run holding the library\n")
+
+        with pytest.raises(SystemExit):
+            RatingSync().sync_ratings()
+
+        assert log_file_path.read_text() == "Log of the run holding the library\n"
+
+    RatingSync().sync_ratings()
+
+    # The messages logged before the libraries were locked are written as well
+    log = log_file_path.read_text()
+
+    assert "Connected to Plex server" in log
+    assert "Synchronization completed" in log
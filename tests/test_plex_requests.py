@@ -0,0 +1,46 @@
+from plexapi.server import PlexServer
+
+from plex_music_ratings_sync.concurrency import AdaptiveLimiter
+from plex_music_ratings_sync.session import PlexSession
+from plex_music_ratings_sync.sync import RatingSync, _disable_auto_reload
+
+MAX_REQUESTS_PER_TRACK = 1.5
+"""Upper bound of the Plex requests made per track by a run, writes included."""
+
+
+def test_sync_requests_per_track_are_bounded(configure):
+    configure()
+
+    run_summary = RatingSync().sync_ratings()
+
+    assert run_summary["tracks"] == 12
+    assert run_summary["outcomes"]["changed"] == 4
+    assert run_summary["plex_requests"] <= MAX_REQUESTS_PER_TRACK * 12
+
+
+def test_sync_makes_no_request_per_track(configure):
+    configure()
+
+    rating_sync = RatingSync()
+    rating_sync.sync_ratings()
+
+    request_counts = rating_sync.primary.session.request_counts
+
+    # Items are only ever fetched by rating key when reloaded
+    assert request_counts["GET /library/metadata/{id}"] == 0
+
+
+def test_unrated_tracks_are_not_reloaded(configure, fake_plex):
+    """
+    Pin the private `plexapi` attribute that disables auto-reload: accessing a field
+    missing from a listing (e.g., `userRating` of unrated tracks) must not reload the
+    item.
+    """
+    session = PlexSession(AdaptiveLimiter("Plex requests", 1, 1, 1.0))
+    plex = PlexServer(fake_plex.url, "token", session=session)
+    tracks = _disable_auto_reload(plex.library.section("Music").searchTracks())
+
+    request_counts = session.snapshot_request_counts()
+
+    assert [track.userRating for track in tracks].count(None) == 8
+    assert session.snapshot_request_counts() == request_counts
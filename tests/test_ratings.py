@@ -0,0 +1,70 @@
+import threading
+
+import pytest
+
+from plex_music_ratings_sync.ratings import (
+    DatabaseRatingStorage,
+    SidecarRatingStorage,
+    _ExternalRatingStorage,
+    set_rating_to_file,
+)
+from tests.fake_plex import FakeLibrary
+
+
+@pytest.fixture
+def album(tmp_path):
+    """The tracks of an album, as unrated MP3 files."""
+    library = FakeLibrary(tmp_path / "album", artists=1, albums=1, tracks=40)
+
+    return [track["file"] for track in library.tracks.values()]
+
+
+def test_external_storages_must_implement_lookup_and_store():
+    class IncompleteRatingStorage(_ExternalRatingStorage):
+        def _lookup(self, file_path):
+            return (False, None)
+
+    with pytest.raises(TypeError):
+        IncompleteRatingStorage()
+
+
+def test_unrated_files_are_not_stored(configure, tmp_path, album):
+    configure()
+    storage = DatabaseRatingStorage(tmp_path / "ratings.db")
+
+    assert storage.get_rating(album[0]) is None
+    assert storage._lookup(album[0]) == (False, None)
+
+    # Rated in its tags since, the file is now picked up and stored
+    set_rating_to_file(album[0], 6)
+
+    assert storage.get_rating(album[0]) == 6
+    assert storage._lookup(album[0]) == (True, 6)
+
+
+def test_sidecar_updates_from_several_processes_are_kept(configure, album):
+    configure()
+
+    # Each storage stands for a process, with its own cache of the sidecar files
+    storages = [SidecarRatingStorage(".ratings.json") for _ in range(2)]
+
+    threads = [
+        threading.Thread(
+            target=lambda storage, file_paths: [
+                storage.set_rating(file_path, 8) for file_path in file_paths
+            ],
+            args=(storage, album[index :: len(storages)]),
+        )
+        for index, storage in enumerate(storages)
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert all(
+        SidecarRatingStorage(".ratings.json")._lookup(file_path) == (True, 8)
+        for file_path in album
+    )
@@ -0,0 +1,37 @@
+import pytest
+
+from plex_music_ratings_sync.lock import LibraryLocks
+from plex_music_ratings_sync.scope import Shard
+
+
+def test_runs_split_differently_exclude_each_other(configure):
+    configure()
+
+    with LibraryLocks(["Music"], shard=(1, 4)), LibraryLocks(["Music"], shard=(2, 4)):
+        for shard in ((1, 4), (1, 2), None):
+            with pytest.raises(SystemExit):
+                LibraryLocks(["Music"], shard=shard).acquire()
+
+    with LibraryLocks(["Music"]):
+        with pytest.raises(SystemExit):
+            LibraryLocks(["Music"], shard=(3, 4)).acquire()
+
+    with LibraryLocks(["Music"], shard=(1, 2)):
+        pass
+
+
+def test_tracks_are_assigned_without_accessing_their_files(tmp_path):
+    file_path = tmp_path / "nas2" / "track.mp3"
+    shard = Shard(1, 4, affinity={str(tmp_path / "nas1"): 3})
+
+    # Whether a machine can reach the file or not, it's assigned the same shard
+    index = shard.get_index(file_path, 1)
+
+    file_path.parent.mkdir()
+    file_path.write_bytes(b"")
+
+    assert shard.get_index(file_path, 2) == index
+    assert shard.get_index(str(file_path).replace("/", "\\"), 3) == index
+
+    # The affinity map applies whether the file exists or not
+    assert shard.get_index(tmp_path / "nas1" / "missing.mp3", 4) == 3
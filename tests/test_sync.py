@@ -0,0 +1,202 @@
+import sqlite3
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from mutagen import MutagenError
+
+from plex_music_ratings_sync import ratings
+from plex_music_ratings_sync.ratings import (
+    DatabaseRatingStorage,
+    TagRatingStorage,
+    get_rating_from_file,
+    set_rating_to_file,
+)
+from plex_music_ratings_sync.scope import Scope, parse_since
+from plex_music_ratings_sync.sync import RatingSync
+from tests.fake_plex import FakeLibrary, FakePlexServer
+
+
+def _get_track(fake_library, file_name):
+    """Return the first track of the fake library whose file has the given name."""
+    return next(
+        track
+        for track in fake_library.tracks.values()
+        if track["file"].endswith(file_name)
+    )
+
+
+def test_failed_file_write_does_not_revert_plex(configure, fake_library, monkeypatch):
+    configure(retry={"initial_delay": 0, "max_delay": 0})
+
+    track = _get_track(fake_library, "01.mp3")
+    set_rating_to_file(track["file"], 8)
+
+    monkeypatch.setattr(
+        TagRatingStorage, "set_rating", lambda self, file_path, rating: False
+    )
+
+    run_summary = RatingSync().sync_ratings()
+
+    # Plex keeps its newer rating, which is deferred until the file can be written
+    assert track["rating"] == 2.0
+    assert get_rating_from_file(track["file"]) == 8
+    assert run_summary["persisted_operations"] == 4
+
+
+def test_persisted_retry_does_not_overwrite_newer_rating(
+    configure, fake_library, monkeypatch
+):
+    configure(retry={"initial_delay": 0, "max_delay": 0})
+
+    track = _get_track(fake_library, "00.mp3")
+    set_rating_to_file(track["file"], 8)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(
+            "plex_music_ratings_sync.sync.set_rating_to_plex",
+            lambda item, rating: False,
+        )
+
+        assert RatingSync().sync_ratings()["persisted_operations"] == 1
+
+    # Rated in Plex after the write failed, the item keeps that rating, and so does
+    # the file once synced
+    track["rating"] = 4.0
+
+    run_summary = RatingSync().sync_ratings()
+
+    assert track["rating"] == 4.0
+    assert get_rating_from_file(track["file"]) == 4
+    assert run_summary["persisted_operations"] == 0
+
+
+def test_files_processed_before_other_servers_are_indexed_are_revisited(
+    configure, fake_plex, fake_library, monkeypatch
+):
+    office_library = FakeLibrary(fake_library.root)
+    office_plex = FakePlexServer(office_library, name="Office")
+
+    configure(
+        plex=[
+            {"name": name, "url": url, "token": "token", "libraries": ["Music"]}
+            for name, url in (("Home", fake_plex.url), ("Office", office_plex.url))
+        ]
+    )
+
+    home_track = _get_track(fake_library, "00.mp3")
+    office_track = _get_track(office_library, "00.mp3")
+    office_track["rating"] = 8.0
+
+    # The office server is only indexed once the home server is fully processed
+    home_processed = threading.Event()
+    index_server_tracks = RatingSync._index_server_tracks
+    process_other_server_tracks = RatingSync._process_other_server_tracks
+
+    def slow_index_server_tracks(self, connection):
+        assert home_processed.wait(10)
+        return index_server_tracks(self, connection)
+
+    def release_index(self, executor, mode):
+        home_processed.set()
+        return process_other_server_tracks(self, executor, mode)
+
+    # Revisits reuse the rating each file ended up with, instead of reading it again
+    file_reads = Counter()
+    get_rating = TagRatingStorage.get_rating
+
+    def counting_get_rating(self, file_path, errors=None):
+        file_reads[file_path] += 1
+        return get_rating(self, file_path, errors)
+
+    monkeypatch.setattr(RatingSync, "_index_server_tracks", slow_index_server_tracks)
+    monkeypatch.setattr(RatingSync, "_process_other_server_tracks", release_index)
+    monkeypatch.setattr(TagRatingStorage, "get_rating", counting_get_rating)
+
+    try:
+        run_summary = RatingSync().sync_ratings()
+    finally:
+        office_plex.close()
+
+    assert home_track["rating"] == office_track["rating"] == 8.0
+    assert get_rating_from_file(home_track["file"]) == 8
+    assert run_summary["tracks"] == 24
+    assert set(file_reads.values()) == {1}
+
+
+def test_stopped_run_completes_the_current_batch_only(configure, monkeypatch):
+    configure()
+
+    rating_sync = RatingSync()
+    process_batch = RatingSync._process_batch
+
+    def stopping_process_batch(self, *args, **kwargs):
+        processed_tracks = process_batch(self, *args, **kwargs)
+        self.request_stop()
+        return processed_tracks
+
+    monkeypatch.setattr(RatingSync, "_process_batch", stopping_process_batch)
+
+    # Keeping the Plex order, each album of 3 tracks is a batch
+    assert rating_sync.sync_ratings()["tracks"] == 3
+    assert rating_sync.sync_ratings()["tracks"] == 0
+
+
+def test_only_files_that_cant_be_parsed_are_registered_as_unreadable(
+    configure, fake_library, monkeypatch
+):
+    configure(storage={"backend": "database"})
+
+    corrupt_track, denied_track, locked_track = (
+        _get_track(fake_library, f"0{index}.mp3") for index in range(3)
+    )
+    Path(corrupt_track["file"]).write_bytes(b"garbage" * 100)
+
+    read_mp3 = ratings.MP3
+    lookup = DatabaseRatingStorage._lookup
+
+    def denied_mp3(file_path, **kwargs):
+        if file_path == denied_track["file"]:
+            raise MutagenError(PermissionError(13, "Permission denied"))
+        return read_mp3(file_path, **kwargs)
+
+    def locked_lookup(self, file_path):
+        if file_path == locked_track["file"]:
+            raise sqlite3.OperationalError("database is locked")
+        return lookup(self, file_path)
+
+    monkeypatch.setattr(ratings, "MP3", denied_mp3)
+    monkeypatch.setattr(DatabaseRatingStorage, "_lookup", locked_lookup)
+
+    rating_sync = RatingSync()
+    rating_sync.sync_ratings()
+
+    # Access and backend failures are transient, only the corrupt file is skipped
+    assert [
+        file_path for file_path, _ in rating_sync.unreadable_files.entries()
+    ] == [corrupt_track["file"]]
+
+
+def test_relative_times_are_resolved_at_the_start_of_each_pass(configure, monkeypatch):
+    configure()
+
+    searched_since = []
+    search_filters = Scope._search_filters
+
+    def recording_search_filters(self, include_updated_since=True):
+        filters = search_filters(self, include_updated_since)
+        searched_since.append(filters["track.addedAt>>"])
+        return filters
+
+    monkeypatch.setattr(Scope, "_search_filters", recording_search_filters)
+
+    rating_sync = RatingSync(Scope(added_since=parse_since("30d")))
+
+    for _ in range(2):
+        pass_started_at = datetime.now()
+        rating_sync.sync_ratings()
+
+        assert searched_since[-1] >= pass_started_at - timedelta(days=30)
+
+    assert len(searched_since) == 2
@@ -0,0 +1,125 @@
+import threading
+import time
+
+import pytest
+
+from plex_music_ratings_sync import sync
+from plex_music_ratings_sync.concurrency import AdaptiveLimiter
+from plex_music_ratings_sync.ratings import TagRatingStorage, get_rating_from_file
+from plex_music_ratings_sync.sync import RatingSync
+from plex_music_ratings_sync.watchdog import (
+    OperationRefused,
+    OperationTimeout,
+    Watchdog,
+)
+
+
+def test_hung_operations_hold_their_slot_and_are_bounded():
+    watchdog = Watchdog({"file_read": 0.01})
+    limiter = AdaptiveLimiter("Files", 1, 64, 1)
+    released = threading.Event()
+    completed = threading.Semaphore(0)
+
+    for _ in range(16):
+        with pytest.raises(OperationTimeout) as timeout:
+            watchdog.call("file_read", released.wait)
+
+        timeout.value.add_done_callback(limiter.hold())
+        timeout.value.add_done_callback(completed.release)
+
+    assert limiter._held == 16
+
+    # Further operations of that kind aren't started while the others are hung
+    with pytest.raises(OperationRefused):
+        watchdog.call("file_read", released.wait)
+
+    assert watchdog.running_abandoned["file_read"] == 16
+    assert watchdog.refusals["file_read"] == 1
+
+    released.set()
+
+    for _ in range(16):
+        assert completed.acquire(timeout=10)
+
+    assert watchdog.call("file_read", lambda: "read") == "read"
+    assert limiter._held == 0
+    assert sum(watchdog.running_abandoned.values()) == 0
+
+
+def test_hung_stats_time_out_the_tracks_of_their_file(
+    configure, fake_library, monkeypatch
+):
+    configure(deadlines={"file_stat": 0.05}, io={"ordering": "inode"})
+
+    hung_file = fake_library.artists[0]["albums"][0]["tracks"][0]["file"]
+    released = threading.Event()
+    stat_file = sync.stat_file
+
+    def hanging_stat_file(file_path):
+        if str(file_path) == hung_file:
+            released.wait()
+
+        return stat_file(file_path)
+
+    monkeypatch.setattr(sync, "stat_file", hanging_stat_file)
+
+    try:
+        run_summary = RatingSync().sync_ratings()
+    finally:
+        released.set()
+
+    assert run_summary["tracks"] == 12
+    assert run_summary["outcomes"]["timed_out"] == 1
+    assert run_summary["timed_out_operations"] == {"file_stat": 1}
+
+
+def test_files_are_left_alone_until_their_abandoned_write_completes(
+    configure, fake_library, monkeypatch
+):
+    configure(
+        deadlines={"file_write": 0.05}, retry={"initial_delay": 0, "max_delay": 0}
+    )
+
+    hung_file = fake_library.artists[0]["albums"][0]["tracks"][1]["file"]
+    released = threading.Event()
+    writes = []
+    set_rating = TagRatingStorage.set_rating
+
+    def hanging_set_rating(self, file_path, rating):
+        if file_path != hung_file:
+            return set_rating(self, file_path, rating)
+
+        writes.append(rating)
+
+        if len(writes) > 1:
+            return set_rating(self, file_path, rating)
+
+        released.wait()
+        return set_rating(self, file_path, rating)
+
+    monkeypatch.setattr(TagRatingStorage, "set_rating", hanging_set_rating)
+
+    rating_sync = RatingSync()
+
+    try:
+        run_summary = rating_sync.sync_ratings()
+    finally:
+        released.set()
+
+    # The write was neither retried nor read back while it was still running
+    assert writes == [2]
+    assert run_summary["outcomes"]["timed_out"] == 1
+    assert run_summary["persisted_operations"] == 1
+
+    for _ in range(1000):
+        if not rating_sync._abandoned_writes:
+            break
+
+        time.sleep(0.01)
+
+    # Once it completed, the next pass finds the rating written
+    run_summary = rating_sync.sync_ratings()
+
+    assert writes == [2]
+    assert get_rating_from_file(hung_file) == 2
+    assert run_summary["persisted_operations"] == 0